@@ -0,0 +1,1270 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from functools import partial
+from urllib.parse import parse_qs, urlparse
+
+from bs4 import BeautifulSoup
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+import selenium.common.exceptions as ex
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+import Job_Web_Scraper as scraper
+import Job_Board_Fixture as fixture
+from Crawl_Metrics import CrawlMetrics, load_run_metrics
+from Crawl_Wait_Scheduler import WaitScheduler
+from Database_Connections import close_database_connections, get_database_connection
+from Export_Analytics_Snapshot import export_analytics_snapshot, load_analytics_snapshot
+from Fetch_Pages_By_Url import RESULTS_PER_PAGE, fetch_page_source, fetch_webpage_sources_by_url, get_search_url
+from Initialize_SQLite_Database import initialize_database
+from Job_Duplicate_Clusters import rebuild_duplicate_clusters, refresh_duplicate_clusters, update_duplicate_clusters
+from Job_Page_Cache import store_page_in_cache
+from Job_Text_Search import get_match_expression, get_tag_query, update_search_index
+from Maintain_Summary_Tables import ALL_KEYWORDS, rebuild_summary_tables
+from Normalize_Job_Tables import LEGACY_TABLES, create_legacy_tables, migrate_legacy_tables
+
+
+BENCHMARK_RESULTS_PATH = 'Benchmark_Results.jsonl'
+BENCHMARK_SIZES = (1_000, 100_000, 1_000_000)
+#Number of different synthetic pages the parsing stages cycle through, on top of the saved pages in Fixtures
+BENCHMARK_DISTINCT_PAGES = 200
+#The same aggregate written against the Jobs, KeywordRef and Salaries tables (or views), against the JobDetails and KeywordRefDetails views joined on job_key, 
+#and against the integer keys of the normalized tables
+KEYWORD_JURISDICTION_QUERY = """ SELECT t3.keyword, t1.jurisdiction, count(*), round(avg(t2.annual_expected), 2)
+FROM Jobs t1 INNER JOIN KeywordRef t3 ON t3.id = t1.id LEFT JOIN Salaries t2 ON t2.id = t1.id
+GROUP BY 1, 2 ORDER BY 1, 2
+"""
+DETAILS_KEYWORD_JURISDICTION_QUERY = """ SELECT t3.keyword, t1.jurisdiction, count(*), round(avg(t2.annual_expected), 2)
+FROM JobDetails t1 INNER JOIN KeywordRefDetails t3 ON t3.job_key = t1.job_key LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+GROUP BY 1, 2 ORDER BY 1, 2
+"""
+KEYED_KEYWORD_JURISDICTION_QUERY = """ SELECT t4.keyword, t5.jurisdiction, keyed.job_count, round(keyed.annual_expected, 2)
+FROM (SELECT t3.keyword_key, t1.jurisdiction_key, count(*) AS job_count, avg(t2.annual_expected) AS annual_expected
+FROM KeywordRefRecords t3 INNER JOIN JobRecords t1 ON t1.job_key = t3.job_key LEFT JOIN SalaryRecords t2 ON t2.job_key = t3.job_key
+GROUP BY 1, 2) AS keyed
+INNER JOIN Keywords t4 ON t4.keyword_key = keyed.keyword_key LEFT JOIN Jurisdictions t5 ON t5.jurisdiction_key = keyed.jurisdiction_key
+ORDER BY 1, 2
+"""
+
+
+def parse_fixture_pages(pages):
+    '''Parse page html strings into listing lists the same way parse_webpage_html does for a live driver.'''
+    return [BeautifulSoup(page, 'lxml').find_all('li', class_ = 'css-5lfssm eu4oa1w0') for page in pages]
+
+def append_single_webpage_with_concat(job_list, job_df, job_id_dict, keyword_df, keyword_id_dict, search_term):
+    '''Previous approach of concatenating a one row dataframe per listing. Kept only as the baseline to compare against.'''
+    for job in job_list:
+        new_job = scraper.get_job_attrs(job, job_id_dict)
+        new_keyword = scraper.get_keyword_attrs(job, keyword_id_dict, search_term)
+        try:
+            if new_job is not None:
+                job_df = pd.concat([job_df, pd.DataFrame([new_job], columns = scraper.JOB_COLUMNS).set_index('id')], verify_integrity = True)
+        except ValueError:
+            pass
+        try:
+            if new_keyword is not None:
+                keyword_df = pd.concat([keyword_df, pd.DataFrame([new_keyword], columns = scraper.KEYWORD_COLUMNS).set_index('id')], verify_integrity = True)
+        except ValueError:
+            pass
+    return job_df, keyword_df
+
+def benchmark_record_buffer(page_count = 100, jobs_per_page = 15):
+    '''
+    Time the per page cost of collecting listings into the record buffers compared to the previous concat approach.
+    Returns a dataframe with one row per page so the cost can be checked to stay flat as the crawl goes on.
+    '''
+    job_lists = parse_fixture_pages(fixture.create_synthetic_pages(page_count, jobs_per_page))
+
+    job_buffer, keyword_buffer = scraper.create_record_buffer(), scraper.create_record_buffer()
+    job_df, keyword_df = scraper.create_initial_empty_df('job'), scraper.create_initial_empty_df('keyword')
+    results = []
+    for page, job_list in enumerate(job_lists, start = 1):
+        start = time.perf_counter()
+        scraper.append_single_webpage_of_job_info_to_buffers(job_list, job_buffer, {}, keyword_buffer, {}, 'data analyst')
+        buffer_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        job_df, keyword_df = append_single_webpage_with_concat(job_list, job_df, {}, keyword_df, {}, 'data analyst')
+        concat_seconds = time.perf_counter() - start
+
+        results.append({'page': page, 'buffer_ms': buffer_seconds * 1000, 'concat_ms': concat_seconds * 1000})
+
+    start = time.perf_counter()
+    buffer_job_df = scraper.convert_record_buffer_to_df(job_buffer, 'job')
+    scraper.convert_record_buffer_to_df(keyword_buffer, 'keyword')
+    print(f'buffer to dataframe conversion: {(time.perf_counter() - start) * 1000:.2f} ms for {len(buffer_job_df.index)} jobs')
+
+    return pd.DataFrame(results).set_index('page')
+
+def check_location_parity_with_database(database = 'JobData.db'):
+    '''Re-parse every location string already in the Jobs table and check the result matches what was stored by the previous row based parser. Returns the rows that differ, if asserts are disabled.'''
+    conn = sqlite3.connect(database)
+    jobs = pd.read_sql('SELECT id, location, location_model, city, jurisdiction FROM Jobs', conn, index_col = 'id')
+    conn.close()
+
+    parsed = scraper.parse_job_location_columns(jobs[['location']])
+    columns = ['location_model', 'city', 'jurisdiction']
+    mismatched = (parsed[columns] != jobs[columns]).any(axis = 1)
+    print(f'location parity: {len(jobs.index) - mismatched.sum()} of {len(jobs.index)} rows identical')
+    assert not mismatched.any(), f'{mismatched.sum()} stored locations parse differently, ie. {jobs[mismatched].index[:5].tolist()}'
+    return jobs[mismatched].join(parsed[columns], rsuffix = '_parsed')
+
+def benchmark_location_parsing(row_count = 1_000_000, seed = 0):
+    '''Time get_job_location_attrs on a dataframe of synthetic location strings.'''
+    rng = random.Random(seed)
+    job_df = pd.DataFrame({column: '' for column in scraper.JOB_COLUMNS[1:]}, index = pd.RangeIndex(row_count, name = 'id'))
+    job_df['location'] = rng.choices(fixture.SAMPLE_LOCATIONS, k = row_count)
+
+    start = time.perf_counter()
+    scraper.get_job_location_attrs(job_df, 'Canada')
+    seconds = time.perf_counter() - start
+    print(f'location parsing: {row_count} rows in {seconds:.2f} s ({row_count / seconds:,.0f} rows/s)')
+    return seconds
+
+def create_salary_df_with_apply(job_df):
+    '''Previous approach of chained str.contains passes and a row wise apply to parse salaries. Kept only as the baseline to compare against.'''
+    def get_actual_salary_values(row):
+        text = row['salary_text']
+        if row['salary_type'] == 'range':
+            row['floor'] = float(text.split('–')[0].replace('$','').replace(',',''))
+            row['ceiling'] = float(text.split('–')[1].split()[0].replace('$','').replace(',',''))
+            row['expected'] = round((row['ceiling'] + row['floor'])/2.0,2)
+        elif row['salary_type'] in ['expected', 'ceiling', 'floor']:
+            row[row['salary_type']] = float(text.split('$')[1].split()[0].replace(',',''))
+        return row
+
+    salary_df = job_df[job_df['salary_provided'] == 'y'][['salary_text']].copy()
+    text = salary_df['salary_text']
+    salary_df['salary_period'] = np.where(text.str.contains('year'), 'yearly', np.where(text.str.contains('hour'), 'hourly',
+    np.where(text.str.contains('month'), 'monthly', np.where(text.str.contains('day'), 'daily', np.where(text.str.contains('week'), 'weekly', np.nan)))))
+    salary_df['salary_type'] = np.where(text.str.contains('–'), 'range', np.where(text.str.contains('From'), 'floor',
+    np.where(text.str.contains('Up'), 'ceiling', np.where(text.str.startswith('$'), 'expected', np.nan))))
+    return salary_df.apply(get_actual_salary_values, axis=1)
+
+def benchmark_salary_parsing(row_count = 20_000, database = 'JobData.db', seed = 0):
+    '''Time create_salary_df against the previous row wise approach on the salary strings in the database and on synthetic salary strings.'''
+    conn = sqlite3.connect(database)
+    real_df = pd.read_sql('SELECT id, salary_text FROM Salaries', conn, index_col = 'id').assign(salary_provided = 'y')
+    conn.close()
+
+    rng = random.Random(seed)
+    salaries = [salary for salary in fixture.SAMPLE_SALARIES if salary]
+    synthetic_df = pd.DataFrame({'salary_text': rng.choices(salaries, k = row_count), 'salary_provided': 'y'})
+
+    results = []
+    for name, job_df in [('real', real_df), ('synthetic', synthetic_df)]:
+        start = time.perf_counter()
+        vectorized = scraper.create_salary_df(job_df)
+        vectorized_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        row_wise = create_salary_df_with_apply(job_df)
+        row_wise_seconds = time.perf_counter() - start
+
+        columns = ['floor', 'expected', 'ceiling']
+        differences = (~np.isclose(vectorized[columns], row_wise[columns], atol = 0.011, equal_nan = True)).sum()
+        results.append({'dataset': name, 'rows': len(job_df.index), 'vectorized_s': vectorized_seconds, 'apply_s': row_wise_seconds, 'value_differences': differences})
+
+    return pd.DataFrame(results).set_index('dataset')
+
+def count_table_rows(database):
+    '''Count the rows in each table the scraper writes to.'''
+    conn = sqlite3.connect(database)
+    counts = {table: conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0] for table in ['Jobs', 'KeywordRef', 'Salaries']}
+    conn.close()
+    return counts
+
+def benchmark_worker_pool(worker_counts = (1, 2, 4), search_terms = ('data analyst', 'data scientist', 'business intelligence', 'database administrator'), page_limit = 5, page_delay = 0.2):
+    '''
+    Time a full get_indeed_job_data run against the local fixture server for each worker count, writing to a fresh temporary database each time.
+    page_delay stands in for the time a real browser spends waiting on the job board, which is what the workers overlap.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, page_delay = page_delay)
+    results = []
+    try:
+        for workers in worker_counts:
+            with tempfile.TemporaryDirectory() as directory:
+                database = os.path.join(directory, 'JobData.db')
+                initialize_database(database)
+
+                start = time.perf_counter()
+                scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, workers = workers, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database)
+                seconds = time.perf_counter() - start
+
+                results.append({'workers': workers, 'seconds': seconds, **count_table_rows(database)})
+    finally:
+        server.shutdown()
+
+    results = pd.DataFrame(results).set_index('workers')
+    results['speedup'] = results['seconds'].iloc[0] / results['seconds']
+    return results
+
+def benchmark_parse_pipeline(page_limit = 20, page_delay = 0.05, search_term = 'data analyst'):
+    '''
+    Time a single keyword crawl against the fixture server with parsing done inline after each page, and with parsing handed to a thread or process pool while the driver fetches the next page.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, page_delay = page_delay)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'JobData.db')
+            initialize_database(database)
+
+            start = time.perf_counter()
+            scraper.crawl_webpages_to_append_job_data_to_dfs(search_term, 'Canada', page_limit, driver = fixture.FixtureDriver(), base_url = base_url, database = database)
+            results.append({'mode': 'inline', 'seconds': time.perf_counter() - start})
+
+            for mode, parse_processes in [('thread pool', False), ('process pool', True)]:
+                start = time.perf_counter()
+                page_timings = scraper.get_indeed_job_data([search_term], 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database, parse_processes = parse_processes)
+                results.append({'mode': mode, 'seconds': time.perf_counter() - start, 
+                'wait_seconds': page_timings['wait_seconds'].sum(), 'parse_seconds': page_timings['parse_seconds'].sum()})
+    finally:
+        server.shutdown()
+
+    return pd.DataFrame(results).set_index('mode')
+
+def load_saved_fixture_pages(directory = 'Fixtures'):
+    '''Read the saved search result pages in the fixtures directory.'''
+    pages = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(directory, file_name), encoding = 'utf-8') as file:
+                pages.append(file.read())
+    return pages
+
+def check_parse_engine_parity(pages = None):
+    '''Check the lxml extractor and the BeautifulSoup functions produce the same rows on every page, returning the number of pages that differ. Defaults to the saved fixtures plus synthetic pages.'''
+    if pages is None:
+        pages = load_saved_fixture_pages() + fixture.create_synthetic_pages(20)
+    mismatched_pages = sum(scraper.parse_page_source(page, 'data analyst', 'bs4')[:2] != scraper.parse_page_source(page, 'data analyst', 'lxml')[:2] for page in pages)
+    print(f'parse engine parity: {len(pages) - mismatched_pages} of {len(pages)} pages identical')
+    assert mismatched_pages == 0, f'the parse engines produce different rows on {mismatched_pages} pages'
+    return mismatched_pages
+
+def benchmark_parse_engines(page_count = 50, jobs_per_page = 15):
+    '''
+    Measure per page CPU time and peak python memory of each parse engine on synthetic pages.
+    tracemalloc only sees memory allocated through python, which covers the BeautifulSoup tree but not the C side of lxml. The lxml engine keeps its tree small by clearing each listing once read.
+    '''
+    pages = fixture.create_synthetic_pages(page_count, jobs_per_page)
+    results = []
+    for parse_engine in ['bs4', 'lxml']:
+        start = time.process_time()
+        for page in pages:
+            scraper.parse_page_source(page, 'data analyst', parse_engine)
+        cpu_ms = (time.process_time() - start) / page_count * 1000
+
+        tracemalloc.start()
+        scraper.parse_page_source(pages[0], 'data analyst', parse_engine)
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        results.append({'engine': parse_engine, 'cpu_ms_per_page': cpu_ms, 'peak_kb_per_page': peak_kb})
+
+    return pd.DataFrame(results).set_index('engine')
+
+def benchmark_cache_replay(days = 7, search_terms = ('data analyst', 'data scientist', 'business intelligence', 'database administrator'), page_limit = 15, parse_engine = 'lxml'):
+    '''
+    Fill a temporary page cache with a week of daily crawls of fixture pages, then time rebuilding the Jobs, KeywordRef and Salaries rows from it with no browser.
+    Each day shifts the job ids so later days bring in some new jobs, as a daily crawl would.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        cache_directory = os.path.join(directory, 'Page_Cache')
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+
+        start = time.perf_counter()
+        for day in range(days):
+            date_recorded = f'2024-01-{day + 1:02d}'
+            for search_term in search_terms:
+                for page in range(page_limit):
+                    html = fixture.create_search_page_html(search_term, (day + page) * 10, pages_per_search = days + page_limit)
+                    store_page_in_cache(html, search_term, 'Canada', page + 1, date_recorded, cache_directory)
+        store_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, database = database, cache_directory = cache_directory, replay = True, parse_engine = parse_engine)
+        replay_seconds = time.perf_counter() - start
+
+        pages = days * len(search_terms) * page_limit
+        return pd.Series({'pages': pages, 'store_seconds': store_seconds, 'replay_seconds': replay_seconds, **count_table_rows(database)})
+
+def check_replay_updates_stored_jobs(search_terms = ('data analyst', 'data scientist'), page_limit = 5):
+    '''
+    Replay a page cache into a database, change the stored title and salary of every job as an older parsing function might have left them, then replay the cache again.
+    Checks the second replay puts back the values parsed from the pages, keeps every job's date_recorded and leaves the summary tables matching the rows.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        cache_directory = os.path.join(directory, 'Page_Cache')
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        for search_term in search_terms:
+            for page in range(page_limit):
+                store_page_in_cache(fixture.create_search_page_html(search_term, page * 10, pages_per_search = page_limit), search_term, 'Canada', page + 1, '2024-01-01', 
+                cache_directory)
+
+        stored_jobs_query = 'SELECT t1.id, t1.job_title, t1.date_recorded, t2.expected FROM Jobs t1 LEFT JOIN Salaries t2 ON t2.id = t1.id ORDER BY t1.id'
+        scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, database = database, cache_directory = cache_directory, replay = True)
+        conn = sqlite3.connect(database)
+        expected_jobs = conn.execute(stored_jobs_query).fetchall()
+        with conn:
+            conn.execute("UPDATE JobRecords SET job_title = 'old title', date_recorded = '2023-12-31'")
+            conn.execute('UPDATE SalaryRecords SET expected = -1')
+            conn.execute("DELETE FROM KeywordRefRecords WHERE keyword_key = (SELECT keyword_key FROM Keywords WHERE keyword = ?)", (search_terms[-1],))
+        conn.close()
+
+        scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, database = database, cache_directory = cache_directory, replay = True)
+        conn = sqlite3.connect(database)
+        replayed_jobs = conn.execute(stored_jobs_query).fetchall()
+        keyword_rows = conn.execute('SELECT count(*) FROM KeywordRef').fetchone()[0]
+        summary_rows, summary_expected = conn.execute('SELECT sum(job_count) FILTER (WHERE keyword != ?), sum(expected_sum) FILTER (WHERE keyword = ?) FROM JobSummaries', 
+        (ALL_KEYWORDS, ALL_KEYWORDS)).fetchone()
+        stored_expected = conn.execute('SELECT coalesce(sum(expected), 0) FROM Salaries').fetchone()[0]
+        conn.close()
+
+    assert [job[:2] + job[3:] for job in replayed_jobs] == [job[:2] + job[3:] for job in expected_jobs], 'replay did not restore the stored job and salary values'
+    assert {job[2] for job in replayed_jobs} == {'2023-12-31'}, 'replay changed date_recorded'
+    assert summary_rows == keyword_rows, f'summary tables hold {summary_rows} keyword rows, KeywordRef holds {keyword_rows}'
+    assert round(summary_expected, 2) == round(stored_expected, 2), 'summary tables still hold the salaries from before the replay'
+    print(f'replay updates stored jobs: {len(replayed_jobs)} jobs restored, {keyword_rows} keyword rows')
+
+def benchmark_incremental_crawl(new_job_counts = (0, 15, 60), search_term = 'data analyst', page_limit = 20, page_delay = 0.02):
+    '''
+    Crawl a keyword fully once, then time a refresh of it with a number of new jobs pushed onto the top of the results, both as a full crawl and as an incremental crawl.
+    The incremental crawl should only fetch about as many pages as the new jobs fill.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, page_delay = page_delay, job_number_offset = 1000)
+        for incremental in [False, True]:
+            database = os.path.join(directory, f'JobData_{incremental}.db')
+            initialize_database(database)
+            scraper.get_indeed_job_data([search_term], 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database)
+        server.shutdown()
+
+        for new_jobs in new_job_counts:
+            server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, page_delay = page_delay, job_number_offset = 1000 - new_jobs)
+            for incremental in [False, True]:
+                database = os.path.join(directory, f'JobData_{incremental}.db')
+                start = time.perf_counter()
+                page_stats = scraper.get_indeed_job_data([search_term], 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database, incremental = incremental)
+                results.append({'new_jobs_posted': new_jobs, 'incremental': incremental, 'seconds': time.perf_counter() - start, 
+                'pages_fetched': len(page_stats.index), 'new_jobs_found': page_stats['new_jobs'].sum()})
+            server.shutdown()
+
+    return pd.DataFrame(results).set_index(['new_jobs_posted', 'incremental'])
+
+def check_incremental_keyword_rows(search_terms = ('data analyst', 'data scientist', 'data engineer', 'business analyst'), new_jobs = 60, page_limit = 20):
+    '''
+    Crawl several keywords that share their postings fully once, push new_jobs onto the top of the results and refresh them both as a full crawl and as an incremental crawl.
+    Checks the incremental refresh writes the same jobs and keyword rows as the full one, since a job already stored under another keyword is still new for this one.
+    '''
+    row_counts = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for incremental in [False, True]:
+            database = os.path.join(directory, f'JobData_{incremental}.db')
+            initialize_database(database)
+            for job_number_offset in [1000, 1000 - new_jobs]:
+                server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, job_number_offset = job_number_offset)
+                try:
+                    scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database, 
+                    incremental = incremental and job_number_offset != 1000)
+                finally:
+                    server.shutdown()
+
+            conn = sqlite3.connect(database)
+            row_counts[incremental] = {table: conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0] for table in ['Jobs', 'KeywordRef']}
+            conn.close()
+
+    assert row_counts[True] == row_counts[False], f'incremental refresh wrote {row_counts[True]} rows, a full refresh wrote {row_counts[False]}'
+    print(f'incremental keyword rows: full refresh {row_counts[False]}, incremental refresh {row_counts[True]}')
+
+def create_synthetic_raw_job_df(row_count, seed = 0, start_number = 0):
+    '''Create a dataframe of row_count synthetic jobs, numbered from start_number, shaped the way convert_record_buffer_to_df returns the jobs of a crawl.'''
+    rng = random.Random(seed)
+    return pd.DataFrame.from_records([(fixture.create_synthetic_job_uid(number), rng.choice(fixture.SAMPLE_TITLES), rng.choice(fixture.SAMPLE_COMPANIES), rng.choice(fixture.SAMPLE_LOCATIONS), 
+    'n', None, 'y', rng.choice([salary for salary in fixture.SAMPLE_SALARIES if salary]), scraper.get_job_url(fixture.create_synthetic_job_uid(number)), '2024-01-01') 
+    for number in range(start_number, start_number + row_count)], columns = scraper.JOB_COLUMNS).set_index('id')
+
+def create_synthetic_job_dfs(row_count, seed = 0, start_number = 0):
+    '''Create enriched job, keyword and salary dataframes of row_count synthetic jobs, numbered from start_number, shaped the way write_keyword_job_data writes them.'''
+    job_df = create_synthetic_raw_job_df(row_count, seed, start_number)
+    keyword_df = pd.DataFrame({'keyword': 'data analyst'}, index = job_df.index)
+    return scraper.get_job_location_attrs(job_df, 'Canada'), keyword_df, scraper.create_salary_df(job_df)
+
+def benchmark_sql_writer(row_count = 100_000):
+    '''
+    Time inserting row_count synthetic jobs with their keyword and salary rows through the bulk transactional writer and through the previous DataFrame.to_sql approach into the legacy tables.
+    The bulk writer's time includes updating the summary tables and the JobSearch index, which the to_sql approach never did. 
+    Near-duplicate clustering runs once the crawl is written rather than in the write, so it isn't included.
+    '''
+    job_df, keyword_df, salary_df = create_synthetic_job_dfs(row_count)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for method in ['to_sql', 'bulk']:
+            database = os.path.join(directory, f'JobData_{method}.db')
+            if method == 'bulk':
+                initialize_database(database)
+            else:
+                conn = sqlite3.connect(database)
+                create_legacy_tables(conn)
+                conn.close()
+            start = time.perf_counter()
+            if method == 'bulk':
+                scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+                close_database_connections()
+            else:
+                for table, df in [('Jobs', job_df), ('KeywordRef', keyword_df), ('Salaries', salary_df)]:
+                    engine = sqlalchemy.create_engine(f'sqlite:///{database}')
+                    df.to_sql(table, engine, if_exists = 'append')
+                    engine.dispose()
+            seconds = time.perf_counter() - start
+            rows = len(job_df.index) + len(keyword_df.index) + len(salary_df.index)
+            results.append({'method': method, 'seconds': seconds, 'rows_per_second': rows / seconds, **count_table_rows(database)})
+
+    return pd.DataFrame(results).set_index('method')
+
+
+def load_searchable_dicts(search_term, database):
+    '''Previous approach of loading every job id and every id for the keyword into dicts before a crawl. Kept only as the baseline to compare against.'''
+    conn = sqlite3.connect(database)
+    job_id_dict = pd.read_sql('SELECT id, row_number() OVER () AS row_num FROM Jobs', conn, index_col= 'id')['row_num'].to_dict()
+    keyword_id_dict = pd.read_sql('SELECT id, row_number() OVER () AS row_num FROM KeywordRef WHERE keyword = ?', conn, params = (search_term,), index_col= 'id')['row_num'].to_dict()
+    conn.close()
+    return job_id_dict, keyword_id_dict
+
+def benchmark_duplicate_lookup(table_sizes = (10_000, 100_000, 1_000_000), search_term = 'data analyst', jobs_per_page = 15):
+    '''
+    Time and measure the peak memory of finding which of one page of job ids are already stored, as the Jobs and KeywordRef tables grow.
+    Compares loading every id into dicts up front against the batched lookups through the primary key indexes.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        stored_rows = 0
+        for table_size in table_sizes:
+            conn = sqlite3.connect(database)
+            job_ids = [fixture.create_synthetic_job_uid(number) for number in range(stored_rows, table_size)]
+            conn.execute("INSERT OR IGNORE INTO Companies (company) VALUES ('')")
+            conn.execute("INSERT OR IGNORE INTO Locations (location) VALUES ('')")
+            conn.execute('INSERT OR IGNORE INTO Keywords (keyword) VALUES (?)', (search_term,))
+            conn.executemany("INSERT INTO JobRecords (id, job_title, company_key, location_key, rating_provided, salary_provided, date_recorded) VALUES (?, '', 1, 1, 0, 0, '2024-01-01')", 
+            ((job_id,) for job_id in job_ids))
+            conn.execute('INSERT INTO KeywordRefRecords (job_key, keyword_key) SELECT job_key, (SELECT keyword_key FROM Keywords WHERE keyword = ?) FROM JobRecords WHERE job_key > ?', 
+            (search_term, stored_rows))
+            conn.commit()
+            conn.close()
+            stored_rows = table_size
+
+            #Half the page is already stored and half is new
+            page_job_ids = [fixture.create_synthetic_job_uid(number) for number in range(table_size - jobs_per_page // 2, table_size - jobs_per_page // 2 + jobs_per_page)]
+            for method in ['dicts', 'indexed']:
+                tracemalloc.start()
+                start = time.perf_counter()
+                if method == 'dicts':
+                    job_id_dict, keyword_id_dict = load_searchable_dicts(search_term, database)
+                    new_job_ids = [job_id for job_id in page_job_ids if job_id not in job_id_dict]
+                    new_keyword_ids = [job_id for job_id in page_job_ids if job_id not in keyword_id_dict]
+                else:
+                    existing_job_ids = scraper.get_existing_job_ids(page_job_ids, database)
+                    existing_keyword_ids = scraper.get_existing_keyword_ids(page_job_ids, search_term, database)
+                    new_job_ids = [job_id for job_id in page_job_ids if job_id not in existing_job_ids]
+                    new_keyword_ids = [job_id for job_id in page_job_ids if job_id not in existing_keyword_ids]
+                seconds = time.perf_counter() - start
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({'table_size': table_size, 'method': method, 'milliseconds': seconds * 1000, 'peak_memory_kb': peak_memory / 1024, 
+                'new_jobs': len(new_job_ids), 'new_keyword_rows': len(new_keyword_ids)})
+            close_database_connections()
+
+    return pd.DataFrame(results).set_index(['table_size', 'method'])
+
+
+def crawl_webpage_sources_with_fixed_waits(driver, search_term, search_location, page_limit, base_url):
+    '''Previous navigation loop with fixed WebDriverWait timeouts and three nested fallbacks. Kept only as the baseline to compare against.'''
+    def click_to_next_page():
+        try:
+            WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, scraper.NEXT_PAGE_XPATH))).click()
+            return True
+        except (ex.TimeoutException, ex.ElementClickInterceptedException):
+            return False
+
+    def close_email_popup():
+        try:
+            WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, '//*[@class="DesktopJobAlertPopup-heading"]'))).click()
+            WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, '//*[@class="css-yi9ndv e8ju0x51"]'))).click()
+            return True
+        except ex.TimeoutException:
+            return False
+
+    def bypass_cloudflare_check():
+        try:
+            WebDriverWait(driver, 20).until(EC.frame_to_be_available_and_switch_to_it((By.XPATH,"//iframe[@title='Widget containing a Cloudflare security challenge']")))
+            WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.XPATH, "//label[@class='ctp-checkbox-label']"))).click()
+            time.sleep(10)
+            return True
+        except ex.TimeoutException:
+            return False
+
+    driver.get(get_search_url(search_term, search_location, base_url))
+    for page in range(1, page_limit + 1):
+        if page > 1 and not click_to_next_page() and not close_email_popup() and not bypass_cloudflare_check():
+            return
+        yield page, driver.page_source
+
+def benchmark_wait_scheduler(pages_per_search = 5, page_limit = 10, popup_pages = (3,), search_term = 'data analyst'):
+    '''
+    Time crawling one search past its last page, with the email popup on popup_pages, using the previous fixed waits and the adaptive WaitScheduler.
+    Counts the distinct pages each one fetched, since a popup made the previous loop fetch the same page twice. Also returns the wait stats of the scheduler.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = pages_per_search, popup_pages = popup_pages)
+    results = []
+    wait_scheduler = WaitScheduler()
+    try:
+        for method in ['fixed', 'adaptive']:
+            driver = fixture.FixtureDriver()
+            start = time.perf_counter()
+            if method == 'fixed':
+                pages = [page_source for _, page_source in crawl_webpage_sources_with_fixed_waits(driver, search_term, 'Canada', page_limit, base_url)]
+            else:
+                pages = [page_source for _, page_source, _, _ in scraper.crawl_webpage_sources(driver, search_term, 'Canada', page_limit, base_url, wait_scheduler = wait_scheduler)]
+            seconds = time.perf_counter() - start
+            results.append({'method': method, 'seconds': seconds, 'pages': len(pages), 'distinct_pages': len({tuple(fixture.FixtureDriver.JOB_ID_PATTERN.findall(page)) for page in pages})})
+    finally:
+        server.shutdown()
+
+    return pd.DataFrame(results).set_index('method'), wait_scheduler.get_wait_stats()
+
+
+def benchmark_url_pagination(fetch_worker_counts = (1, 4, 8), search_terms = ('data analyst', 'data scientist'), page_limit = 20, page_delay = 0.1):
+    '''
+    Time a full get_indeed_job_data run against the local fixture server clicking through the pages with one driver and fetching the pages by url with each number of fetch workers.
+    The table row counts show both modes add the same jobs.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = page_limit, page_delay = page_delay)
+    results = []
+    try:
+        for fetch_mode, fetch_workers in [('click', 1)] + [('url', fetch_workers) for fetch_workers in fetch_worker_counts]:
+            with tempfile.TemporaryDirectory() as directory:
+                database = os.path.join(directory, 'JobData.db')
+                initialize_database(database)
+
+                start = time.perf_counter()
+                scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database, 
+                fetch_mode = fetch_mode, fetch_workers = fetch_workers)
+                seconds = time.perf_counter() - start
+
+                results.append({'fetch_mode': fetch_mode, 'fetch_workers': fetch_workers, 'seconds': seconds, **count_table_rows(database)})
+    finally:
+        server.shutdown()
+
+    results = pd.DataFrame(results).set_index(['fetch_mode', 'fetch_workers'])
+    results['speedup'] = results['seconds'].iloc[0] / results['seconds']
+    return results
+
+def check_url_pagination_resume(interrupt_at_page = 9, search_term = 'data analyst', page_limit = 20):
+    '''
+    Interrupt a url crawl that saves to the page cache by failing every fetch from interrupt_at_page on, then run it again. 
+    Checks the second run only fetches the pages the first did not finish and that together they yield the same pages as an uninterrupted crawl.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = page_limit)
+    fetched_urls = []
+    def fetch_page(url, fail_from_start = None):
+        if fail_from_start is not None and int(parse_qs(urlparse(url).query).get('start', ['0'])[0]) >= fail_from_start:
+            raise OSError('connection reset')
+        fetched_urls.append(url)
+        return fetch_page_source(url)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache_directory = os.path.join(directory, 'Page_Cache')
+            expected_pages = [page_source for _, page_source, _, _ in fetch_webpage_sources_by_url(search_term, 'Canada', page_limit, base_url, fetch_page = fetch_page)]
+            fetched_urls.clear()
+
+            interrupted_fetch_page = partial(fetch_page, fail_from_start = (interrupt_at_page - 1) * RESULTS_PER_PAGE)
+            interrupted_pages = list(fetch_webpage_sources_by_url(search_term, 'Canada', page_limit, base_url, fetch_page = interrupted_fetch_page, cache_directory = cache_directory))
+            first_run_fetches = len(fetched_urls)
+            fetched_urls.clear()
+
+            resumed_pages = [page_source for _, page_source, _, _ in fetch_webpage_sources_by_url(search_term, 'Canada', page_limit, base_url, fetch_page = fetch_page, 
+            cache_directory = cache_directory)]
+            close_database_connections()
+    finally:
+        server.shutdown()
+
+    assert len(interrupted_pages) == interrupt_at_page - 1, f'the interrupted run completed {len(interrupted_pages)} pages, expected {interrupt_at_page - 1}'
+    assert len(fetched_urls) == page_limit - len(interrupted_pages), f'the resumed run fetched {len(fetched_urls)} pages, expected {page_limit - len(interrupted_pages)}'
+    assert resumed_pages == expected_pages, 'the resumed run yielded different pages than an uninterrupted crawl'
+    print(f'url pagination resume: first run completed {len(interrupted_pages)} pages ({first_run_fetches} fetched), second run fetched {len(fetched_urls)}, '
+    f'{len(resumed_pages)}/{len(expected_pages)} pages match an uninterrupted crawl')
+
+
+def load_analysis_dfs_with_read_sql(database):
+    '''Previous way the analysis notebook loaded its dataframes, running the joins in SQL on every load. Kept only as the baseline to compare against.'''
+    engine = sqlalchemy.create_engine(f'sqlite:///{database}')
+    jobs = pd.read_sql('Select * FROM Jobs', engine, index_col='id')
+    jobs_keywords = pd.read_sql(""" Select 
+    t1.id, t1.job_title, t1.company, t1.location, t1.location_model, t1.jurisdiction, t1.city, t2.keyword
+    FROM Jobs t1 LEFT JOIN KeywordRef t2 ON t2.id = t1.id""", engine, index_col=['id', 'keyword'])
+    jobs_salaries = pd.read_sql(""" Select
+    t1.id, t1.job_title, t1.company, t1.location, t2.salary_type, t2.salary_period, t2.expected, t2.floor, t2.ceiling 
+    FROM Jobs t1 INNER JOIN Salaries t2 ON t1.id = t2.id""", engine, index_col='id')
+    jobs_salaries_keywords = pd.read_sql(""" Select 
+    t1.id, t1.job_title, t1.company, t1.location, t2.salary_type, t2.salary_period, t2.expected, t2.floor, t2.ceiling, t3.keyword 
+    FROM Jobs t1 INNER JOIN Salaries t2 ON t1.id = t2.id LEFT JOIN KeywordRef t3 ON t3.id = t1.id""", engine, index_col=['id', 'keyword'])
+    engine.dispose()
+    return jobs, jobs_keywords, jobs_salaries, jobs_salaries_keywords
+
+def benchmark_analytics_snapshot(row_count = 200_000, new_row_count = 2_000):
+    '''
+    Time loading the analysis notebook's dataframes with its SQL joins and from the parquet snapshot (as strings and as categoricals) for row_count synthetic jobs, 
+    along with the memory the loaded dataframes take. Also times the full export and an incremental export after new_row_count more jobs are written.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        snapshot_directory = os.path.join(directory, 'Analytics_Snapshot')
+        initialize_database(database)
+        job_df, keyword_df, salary_df = create_synthetic_job_dfs(row_count)
+        scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+
+        start = time.perf_counter()
+        export_analytics_snapshot(database, snapshot_directory)
+        results.append({'stage': 'full export', 'seconds': time.perf_counter() - start})
+
+        job_df, keyword_df, salary_df = create_synthetic_job_dfs(new_row_count, start_number = row_count)
+        scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+        close_database_connections()
+        start = time.perf_counter()
+        export_analytics_snapshot(database, snapshot_directory)
+        results.append({'stage': 'incremental export', 'seconds': time.perf_counter() - start})
+
+        for stage, load in [('read_sql joins', partial(load_analysis_dfs_with_read_sql, database)), 
+        ('snapshot strings', partial(load_analytics_snapshot, snapshot_directory, categoricals = False)), 
+        ('snapshot categoricals', partial(load_analytics_snapshot, snapshot_directory))]:
+            start = time.perf_counter()
+            dfs = load()
+            seconds = time.perf_counter() - start
+            results.append({'stage': stage, 'seconds': seconds, 'memory_mb': sum(df.memory_usage(deep = True).sum() for df in dfs) / 1024 ** 2})
+
+    return pd.DataFrame(results).set_index('stage')
+
+
+def benchmark_summary_tables(history_sizes = (10_000, 100_000, 500_000), batch_size = 1_000):
+    '''
+    Grow a database to each history size, then time writing one more batch of batch_size jobs (with the summary tables updated in the same transaction)
+    and the jurisdiction by salary_provided breakdown read from the raw Jobs table and from JobSummaries. 
+    Checks the incrementally maintained summaries match a full rebuild at the end.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        stored_jobs = 0
+        for history_size in history_sizes:
+            job_df, keyword_df, salary_df = create_synthetic_job_dfs(history_size - stored_jobs, seed = history_size, start_number = stored_jobs)
+            scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+            job_df, keyword_df, salary_df = create_synthetic_job_dfs(batch_size, seed = -history_size, start_number = history_size)
+            start = time.perf_counter()
+            scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+            write_seconds = time.perf_counter() - start
+            stored_jobs = history_size + batch_size
+
+            conn = get_database_connection(database)
+            start = time.perf_counter()
+            raw_counts = conn.execute("SELECT coalesce(jurisdiction, 'Not Specified'), salary_provided, count(*) FROM Jobs GROUP BY 1, 2 ORDER BY 1, 2").fetchall()
+            raw_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            summary_counts = conn.execute(f"SELECT jurisdiction, salary_provided, sum(job_count) FROM JobSummaries WHERE keyword = '{ALL_KEYWORDS}' GROUP BY 1, 2 ORDER BY 1, 2").fetchall()
+            summary_seconds = time.perf_counter() - start
+            assert raw_counts == summary_counts
+
+            results.append({'history_size': history_size, 'batch_write_seconds': write_seconds, 'raw_query_ms': raw_seconds * 1000, 'summary_query_ms': summary_seconds * 1000})
+
+        conn = get_database_connection(database)
+        summary_columns = 'date_recorded, keyword, jurisdiction, location_model, salary_provided, salary_period, job_count, salary_count, round(expected_sum, 2)'
+        incremental_summaries = conn.execute(f'SELECT {summary_columns} FROM JobSummaries ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+        incremental_histograms = conn.execute('SELECT * FROM SalaryHistograms ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+        close_database_connections()
+        rebuild_summary_tables(database)
+        conn = sqlite3.connect(database)
+        assert incremental_summaries == conn.execute(f'SELECT {summary_columns} FROM JobSummaries ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+        assert incremental_histograms == conn.execute('SELECT * FROM SalaryHistograms ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+        conn.close()
+
+    return pd.DataFrame(results).set_index('history_size')
+
+
+def benchmark_text_search(history_sizes = (10_000, 100_000, 500_000), batch_size = 1_000, keyword_sets = None, rare_phrase = 'tableau developer'):
+    '''
+    Grow a database to each history size, then time adding one more batch of batch_size jobs to the JobSearch index, 
+    and tagging every job with keyword_sets through the index against the LIKE scans over Jobs it replaces. Checks both find the same (job, tag) pairs.
+    The synthetic jobs only have a few distinct titles, so every tag matches a large share of them. rare_phrase times a search for a phrase few jobs contain.
+    '''
+    if keyword_sets is None:
+        keyword_sets = {'Power BI': ['power bi'], 'Senior': ['senior'], 'Database': ['database administrator', 'data engineer'], 'Staples': ['staples']}
+    like_query = ' UNION ALL '.join(f"SELECT id, ? AS tag FROM Jobs WHERE {' OR '.join(['job_title LIKE ? OR company LIKE ?'] * len(phrases))}" for phrases in keyword_sets.values())
+    like_params = [param for tag, phrases in keyword_sets.items() for param in [tag] + [f'%{phrase}%' for phrase in phrases for _ in range(2)]]
+    tag_query, tag_params = get_tag_query(keyword_sets)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        stored_jobs = 0
+        for history_size in history_sizes:
+            job_df, keyword_df, salary_df = create_synthetic_job_dfs(history_size - stored_jobs, seed = history_size, start_number = stored_jobs)
+            scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+            job_df, _, _ = create_synthetic_job_dfs(batch_size, seed = -history_size, start_number = history_size)
+            stored_jobs = history_size + batch_size
+
+            conn = get_database_connection(database)
+            with conn:
+                scraper.insert_df_rows(conn, job_df, 'Jobs')
+                start = time.perf_counter()
+                update_search_index(conn)
+                index_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            like_tags = sorted(conn.execute(like_query, like_params).fetchall())
+            like_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            index_tags = sorted(row[1:] for row in conn.execute(tag_query, tag_params).fetchall())
+            index_seconds_query = time.perf_counter() - start
+            assert like_tags == index_tags
+
+            start = time.perf_counter()
+            like_count = conn.execute('SELECT count(*) FROM Jobs WHERE job_title LIKE ? OR company LIKE ?', (f'%{rare_phrase}%', f'%{rare_phrase}%')).fetchone()
+            like_search_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            index_count = conn.execute('SELECT count(*) FROM JobSearch WHERE JobSearch MATCH ?', (get_match_expression([rare_phrase]),)).fetchone()
+            index_search_seconds = time.perf_counter() - start
+            assert like_count == index_count
+
+            results.append({'history_size': history_size, 'batch_index_ms': index_seconds * 1000, 'tagged_pairs': len(index_tags), 
+            'like_tag_seconds': like_seconds, 'index_tag_seconds': index_seconds_query, 'like_search_ms': like_search_seconds * 1000, 'index_search_ms': index_search_seconds * 1000})
+        close_database_connections()
+
+    return pd.DataFrame(results).set_index('history_size')
+
+def check_crawl_metrics(search_terms = ('data analyst', 'data scientist'), page_limit = 5):
+    '''
+    Crawl the fixture board twice into an empty database and check the crawl metrics add up: every listing is either an ad, a duplicate or new, 
+    the first run inserts every new job and the second finds them all again as duplicates. Also times the crawl with and without a cProfile capture.
+    '''
+    server, base_url = fixture.start_fixture_server(pages_per_search = page_limit)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'JobData.db')
+            initialize_database(database)
+            for run, profile_path in enumerate([None, os.path.join(directory, 'crawl.prof')]):
+                start = time.perf_counter()
+                scraper.get_indeed_job_data(list(search_terms), 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = database, 
+                metrics = CrawlMetrics(profile_path))
+                seconds = time.perf_counter() - start
+                _, keyword_metrics, failures = load_run_metrics(database)
+                conn = sqlite3.connect(database)
+                stored_jobs = conn.execute('SELECT count(*) FROM Jobs').fetchone()[0]
+                conn.close()
+                listings_add_up = (keyword_metrics['listings_seen'] == keyword_metrics['ads_skipped'] + keyword_metrics['duplicates_skipped'] + keyword_metrics['new_jobs']).all()
+                results.append({'run': run + 1, 'profiled': profile_path is not None, 'seconds': seconds, 'listings_seen': keyword_metrics['listings_seen'].sum(), 
+                'new_jobs': keyword_metrics['new_jobs'].sum(), 'jobs_inserted': keyword_metrics['jobs_inserted'].sum(), 'stored_jobs': stored_jobs, 
+                'listings_add_up': listings_add_up, 'failures': len(failures.index)})
+    finally:
+        server.shutdown()
+
+    results = pd.DataFrame(results).set_index('run')
+    print(f"crawl metrics: jobs inserted match the database: {results.loc[1, 'jobs_inserted'] == results.loc[1, 'stored_jobs']}, "
+    f"no new jobs on the second run: {results.loc[2, 'new_jobs'] == 0}, listings add up: {results['listings_add_up'].all()}")
+    assert results.loc[1, 'jobs_inserted'] == results.loc[1, 'stored_jobs'], f"first run inserted {results.loc[1, 'jobs_inserted']} jobs, the database holds {results.loc[1, 'stored_jobs']}"
+    assert results.loc[2, 'new_jobs'] == 0, f"second run found {results.loc[2, 'new_jobs']} new jobs"
+    assert results['listings_add_up'].all(), 'listings seen are not all accounted for as ads, duplicates or new jobs'
+    assert (results['failures'] == 0).all(), f"crawl recorded failures: {results['failures'].tolist()}"
+    return results
+
+
+def create_legacy_database(database, job_count, chunk_size = 100_000):
+    '''Build a database with only the legacy Jobs, KeywordRef and Salaries tables, holding job_count synthetic jobs with their keyword and salary rows, generated and inserted a chunk at a time.'''
+    conn = sqlite3.connect(database)
+    create_legacy_tables(conn)
+    for start_number in range(0, job_count, chunk_size):
+        dfs = create_synthetic_job_dfs(min(chunk_size, job_count - start_number), seed = start_number, start_number = start_number)
+        with conn:
+            for table, df in zip(LEGACY_TABLES, dfs):
+                rows_df = df.reset_index()
+                rows_df = rows_df.astype(object).where(rows_df.notna(), None)
+                conn.executemany(f'INSERT INTO {table} ({", ".join(rows_df.columns)}) VALUES ({", ".join("?" * len(rows_df.columns))})', rows_df.itertuples(index = False, name = None))
+    conn.close()
+
+def copy_to_legacy_database(database, legacy_database):
+    '''Copy the jobs of a normalized database into a new database with only the legacy Jobs, KeywordRef and Salaries tables, in the order they were inserted.'''
+    conn = sqlite3.connect(legacy_database)
+    create_legacy_tables(conn)
+    conn.execute('ATTACH DATABASE ? AS normalized', (database,))
+    with conn:
+        conn.execute('INSERT INTO main.Jobs SELECT id, job_title, company, location, rating_provided, rating, salary_provided, weblink, date_recorded, location_model, jurisdiction, city, country FROM normalized.JobDetails ORDER BY job_key')
+        conn.execute('INSERT INTO main.KeywordRef SELECT id, keyword FROM normalized.KeywordRefDetails ORDER BY keyword_ref_key')
+        conn.execute('INSERT INTO main.Salaries SELECT t2.* FROM normalized.JobRecords t1 INNER JOIN normalized.Salaries t2 ON t2.id = t1.id ORDER BY t1.job_key')
+    conn.execute('DETACH DATABASE normalized')
+    conn.close()
+
+def time_query(conn, query, params = (), repeats = 3):
+    '''Run a query repeats times, returning its rows and its fastest time in milliseconds.'''
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rows = conn.execute(query, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, min(timings)
+
+def benchmark_normalized_tables(database = 'JobData.db', synthetic_sizes = (1_000_000,), directory = None, lookup_count = 15):
+    '''
+    Compare the file size and join latency of the legacy text tables against the normalized tables with integer keys, on a legacy copy of database and on synthetic databases of each size.
+    Each legacy database is vacuumed and measured, then migrated, vacuumed and measured again, so both hold the same jobs and no summary or search tables.
+    Times the keyword by jurisdiction salary aggregate through the Jobs, KeywordRef and Salaries views, through JobDetails and KeywordRefDetails joined on job_key 
+    and through the integer keys, and a lookup of lookup_count jobs by id.
+    Checks the views return the same rows the legacy tables did. The 10M row synthetic database takes several GB and around an hour, so directory can point at a roomier disk than the temp directory.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory(dir = directory) as directory:
+        for size in ['current', *synthetic_sizes]:
+            legacy_database = os.path.join(directory, f'JobData_{size}.db')
+            start = time.perf_counter()
+            if size == 'current':
+                copy_to_legacy_database(database, legacy_database)
+            else:
+                create_legacy_database(legacy_database, size)
+            build_seconds = time.perf_counter() - start
+
+            conn = sqlite3.connect(legacy_database)
+            conn.execute('VACUUM')
+            job_count = conn.execute('SELECT count(*) FROM Jobs').fetchone()[0]
+            #Spread the looked up ids over the whole table
+            lookup_ids = [row[0] for row in conn.execute(f'SELECT id FROM Jobs WHERE rowid % {max(job_count // lookup_count, 1)} = 0 LIMIT {lookup_count}')]
+            lookup_query = f'SELECT * FROM Jobs WHERE id IN ({", ".join("?" * len(lookup_ids))}) ORDER BY id'
+            schema_rows = {}
+            for schema in ['legacy', 'normalized']:
+                migrate_seconds = None
+                if schema == 'normalized':
+                    start = time.perf_counter()
+                    with conn:
+                        migrate_legacy_tables(conn)
+                    conn.execute('VACUUM')
+                    migrate_seconds = time.perf_counter() - start
+                aggregate_rows, aggregate_ms = time_query(conn, KEYWORD_JURISDICTION_QUERY)
+                details_aggregate_ms, keyed_aggregate_ms = None, None
+                if schema == 'normalized':
+                    details_rows, details_aggregate_ms = time_query(conn, DETAILS_KEYWORD_JURISDICTION_QUERY)
+                    keyed_rows, keyed_aggregate_ms = time_query(conn, KEYED_KEYWORD_JURISDICTION_QUERY)
+                    assert details_rows == aggregate_rows and keyed_rows == aggregate_rows
+                lookup_rows, lookup_ms = time_query(conn, lookup_query, lookup_ids, repeats = 10)
+                schema_rows[schema] = (aggregate_rows, lookup_rows)
+                results.append({'database': size, 'jobs': job_count, 'schema': schema, 'size_mb': os.path.getsize(legacy_database) / 1e6, 'aggregate_ms': aggregate_ms, 
+                'details_aggregate_ms': details_aggregate_ms, 'keyed_aggregate_ms': keyed_aggregate_ms, 'lookup_ms': lookup_ms, 'build_seconds': build_seconds, 'migrate_seconds': migrate_seconds})
+            conn.close()
+            assert schema_rows['legacy'] == schema_rows['normalized']
+            os.remove(legacy_database)
+
+    return pd.DataFrame(results).set_index(['database', 'schema'])
+
+
+def create_crawled_page_messages(page_count, keyword, jobs_per_page = 15):
+    '''Parse page_count synthetic pages into the (keyword, job rows, keyword rows, page stats) messages crawler workers put on the page queue, with no stage times recorded.'''
+    messages = []
+    for page, page_source in enumerate(fixture.create_synthetic_pages(page_count, jobs_per_page), start = 1):
+        job_rows, keyword_rows, parse_stats = scraper.parse_page_source(page_source, keyword, 'lxml')
+        page_stats = {'keyword': keyword, 'page': page, 'wait_seconds': 0, 'parse_seconds': 0, 'extract_seconds': 0, 'duplicate_check_seconds': 0, 'listings_seen': parse_stats['listings_seen'], 
+        'ads_skipped': parse_stats['listings_seen'] - len(job_rows), 'listings': len(job_rows), 'duplicates_skipped': 0, 'new_jobs': len(job_rows), 'first_job_id': job_rows[0][0]}
+        messages.append((keyword, job_rows, keyword_rows, page_stats))
+    return messages
+
+def benchmark_streaming_writes(page_count = 1_000, batch_page_counts = (None, 10, 50), stop_at_page = 900, keyword = 'data analyst'):
+    '''
+    Time and measure the peak memory of writing page_count crawled pages of one keyword, buffered until the crawl is finished against committed every few pages with write_batch_pages.
+    Then replays the first stop_at_page pages with the worker stopping before it finishes the keyword, and counts the jobs kept in the database.
+    '''
+    messages = create_crawled_page_messages(page_count, keyword)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for write_batch_pages in batch_page_counts:
+            row = {'write_batch_pages': write_batch_pages or 'keyword'}
+            #Timed without tracemalloc, which slows pandas down several times over, then run again traced for the peak memory
+            for run, run_messages in [('full', messages + [(keyword, None, None, None)]), ('traced', messages + [(keyword, None, None, None)]), ('stopped', messages[:stop_at_page])]:
+                database = os.path.join(directory, f'JobData_{write_batch_pages}_{run}.db')
+                initialize_database(database)
+                page_queue = queue.Queue()
+                for message in run_messages + [None]:
+                    page_queue.put(message)
+                if run == 'traced':
+                    tracemalloc.start()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    scraper.write_crawled_pages(page_queue, 1, 'Canada', set(), database, write_batch_pages = write_batch_pages)
+                seconds = time.perf_counter() - start
+                close_database_connections()
+                stored_jobs = count_table_rows(database)['Jobs']
+                if run == 'full':
+                    row.update({'seconds': seconds, 'jobs_written': stored_jobs})
+                elif run == 'traced':
+                    row['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+                    tracemalloc.stop()
+                else:
+                    row['jobs_kept_after_stop'] = stored_jobs
+            results.append(row)
+
+    return pd.DataFrame(results).set_index('write_batch_pages')
+
+def benchmark_reenrichment(row_count = 200_000, chunk_sizes = (None, 50_000, 10_000)):
+    '''
+    Time and measure the peak memory of re-enriching row_count stored jobs with reenrich_stored_jobs, reading the whole table at once (None) against bounded chunks.
+    Checks the stored rows are unchanged, since the rows were enriched under the same rules.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        job_df, keyword_df, salary_df = create_synthetic_job_dfs(row_count)
+        scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+        close_database_connections()
+        del job_df, keyword_df, salary_df
+        conn = sqlite3.connect(database)
+        stored_rows = [conn.execute(f'SELECT * FROM {table} ORDER BY id').fetchall() for table in ['Jobs', 'Salaries']]
+        conn.close()
+
+        for chunk_size in chunk_sizes:
+            row = {'chunk_size': chunk_size or 'all'}
+            #Timed without tracemalloc, then run again traced for the peak memory
+            for traced in [False, True]:
+                if traced:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    scraper.reenrich_stored_jobs(database, chunk_size = chunk_size or row_count, snapshot_directory = None)
+                seconds = time.perf_counter() - start
+                if traced:
+                    row['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+                    tracemalloc.stop()
+                else:
+                    row.update({'seconds': seconds, 'jobs_per_second': row_count / seconds})
+            conn = sqlite3.connect(database)
+            assert [conn.execute(f'SELECT * FROM {table} ORDER BY id').fetchall() for table in ['Jobs', 'Salaries']] == stored_rows
+            conn.close()
+            results.append(row)
+
+    return pd.DataFrame(results).set_index('chunk_size')
+
+def create_synthetic_reposted_job_dfs(row_count, seed = 0, start_number = 0, role_count = 0, repost_share = 0.5):
+    '''
+    Create enriched job, keyword and salary dataframes of row_count synthetic jobs, numbered from start_number, where repost_share of the jobs are reposts of an earlier role under a new id.
+    Each role has its own title. A repost may be in another location, with another or no salary, or with its title lowercased. role_count is the number of roles created by earlier calls.
+    Returns the three dataframes, the role of each job, and the new role count.
+    '''
+    rng = random.Random(seed)
+    records, roles = [], []
+    for number in range(start_number, start_number + row_count):
+        repost = role_count > 0 and rng.random() < repost_share
+        if repost:
+            role = rng.randrange(role_count)
+        else:
+            role, role_count = role_count, role_count + 1
+        #The original posting of the role, the same on every call
+        role_rng = random.Random(role)
+        title, company, location, salary = (f'{role_rng.choice(fixture.SAMPLE_TITLES)} - Team {role}', role_rng.choice(fixture.SAMPLE_COMPANIES), role_rng.choice(fixture.SAMPLE_LOCATIONS), 
+        role_rng.choice(fixture.SAMPLE_SALARIES))
+        if repost:
+            location = rng.choice([location, rng.choice(fixture.SAMPLE_LOCATIONS)])
+            salary = rng.choice([salary, rng.choice(fixture.SAMPLE_SALARIES)])
+            title = rng.choice([title, title.lower()])
+        job_uid = fixture.create_synthetic_job_uid(number)
+        records.append((job_uid, title, company, location, 'n', None, 'n' if salary is None else 'y', salary, scraper.get_job_url(job_uid), '2024-01-01'))
+        roles.append(role)
+    job_df = pd.DataFrame.from_records(records, columns = scraper.JOB_COLUMNS).set_index('id')
+    keyword_df = pd.DataFrame({'keyword': 'data analyst'}, index = job_df.index)
+    return scraper.get_job_location_attrs(job_df, 'Canada'), keyword_df, scraper.create_salary_df(job_df), pd.Series(roles, index = job_df.index), role_count
+
+def get_cluster_pair_accuracy(cluster_df):
+    '''Precision and recall of the near-duplicate clusters over pairs of jobs, from a dataframe of the cluster_key and true role of each job.'''
+    count_pairs = lambda sizes: (sizes * (sizes - 1) // 2).sum()
+    true_pairs = count_pairs(cluster_df.groupby(['cluster_key', 'role']).size())
+    return true_pairs / max(count_pairs(cluster_df.groupby('cluster_key').size()), 1), true_pairs / max(count_pairs(cluster_df.groupby('role').size()), 1)
+
+def benchmark_duplicate_detection(history_sizes = (10_000, 100_000, 300_000), batch_size = 1_000):
+    '''
+    Grow a database of synthetic reposted roles to each history size, then time clustering one more batch of batch_size jobs against the stored clusters, and reclustering every job from scratch.
+    Checks the incrementally maintained clusters match the rebuild, and measures their pair precision and recall against the true roles.
+    '''
+    results = []
+    roles = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'JobData.db')
+        initialize_database(database)
+        stored_jobs, role_count = 0, 0
+        for history_size in history_sizes:
+            job_df, keyword_df, salary_df, job_roles, role_count = create_synthetic_reposted_job_dfs(history_size - stored_jobs, history_size, stored_jobs, role_count)
+            scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+            refresh_duplicate_clusters(database)
+            roles.append(job_roles)
+            job_df, keyword_df, salary_df, job_roles, role_count = create_synthetic_reposted_job_dfs(batch_size, -history_size, history_size, role_count)
+            roles.append(job_roles)
+            stored_jobs = history_size + batch_size
+
+            conn = get_database_connection(database)
+            with conn:
+                for table, df in [('Jobs', job_df), ('KeywordRef', keyword_df), ('Salaries', salary_df)]:
+                    scraper.insert_df_rows(conn, df, table)
+                start = time.perf_counter()
+                batch_duplicates = update_duplicate_clusters(conn)
+                batch_seconds = time.perf_counter() - start
+            incremental_clusters = conn.execute('SELECT * FROM JobClusters ORDER BY job_key').fetchall()
+            close_database_connections()
+
+            start = time.perf_counter()
+            rebuild_duplicate_clusters(database)
+            rebuild_seconds = time.perf_counter() - start
+            conn = sqlite3.connect(database)
+            assert conn.execute('SELECT * FROM JobClusters ORDER BY job_key').fetchall() == incremental_clusters
+            cluster_df = pd.read_sql('SELECT t1.id, t2.cluster_key FROM JobDetails t1 INNER JOIN JobClusters t2 ON t2.job_key = t1.job_key', conn, index_col = 'id')
+            conn.close()
+            cluster_df['role'] = pd.concat(roles)
+            precision, recall = get_cluster_pair_accuracy(cluster_df)
+
+            results.append({'history_size': history_size, 'batch_cluster_ms': batch_seconds * 1000, 'batch_duplicates': batch_duplicates, 'rebuild_seconds': rebuild_seconds, 
+            'roles': cluster_df['role'].nunique(), 'clusters': cluster_df['cluster_key'].nunique(), 'pair_precision': precision, 'pair_recall': recall})
+
+    return pd.DataFrame(results).set_index('history_size')
+
+
+def get_git_commit():
+    '''Return the short hash of the checked out commit, with a + if tracked files have uncommitted changes, or None outside a git checkout.'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if changes else '')
+
+def cycle_pages_for_jobs(pages, page_job_counts, job_count):
+    '''Yield pages from the list over and over until they hold at least job_count listings between them.'''
+    listed_jobs = 0
+    while listed_jobs < job_count:
+        for page, page_job_count in zip(pages, page_job_counts):
+            yield page
+            listed_jobs += page_job_count
+            if listed_jobs >= job_count:
+                return
+
+def create_stage_setups(job_count, directory, search_term = 'data analyst'):
+    '''
+    Return (stage, max_jobs, setup) for every stage of the pipeline at job_count jobs, in pipeline order. Stages are skipped for job counts above max_jobs (None for no limit).
+    setup prepares fresh inputs for one run of the stage outside the timing and returns a function that runs the stage and returns the number of jobs it processed.
+    Later stages read the database written by the sql_write stage.
+    '''
+    pages = load_saved_fixture_pages() + fixture.create_synthetic_pages(BENCHMARK_DISTINCT_PAGES)
+    page_job_counts = [len(scraper.parse_page_source(page, search_term, 'lxml')[0]) for page in pages]
+    raw_job_df = create_synthetic_raw_job_df(job_count)
+    job_rows = list(raw_job_df.reset_index().itertuples(index = False, name = None))
+    job_df = scraper.get_job_location_attrs(raw_job_df.copy(), 'Canada')
+    keyword_df = pd.DataFrame({'keyword': search_term}, index = job_df.index)
+    salary_df = scraper.create_salary_df(raw_job_df)
+    database = os.path.join(directory, 'JobData.db')
+
+    def setup_parse(parse_engine):
+        return lambda: sum(len(scraper.parse_page_source(page, search_term, parse_engine)[0]) for page in cycle_pages_for_jobs(pages, page_job_counts, job_count))
+
+    def setup_record_buffer():
+        def run():
+            job_buffer = scraper.create_record_buffer()
+            for job_row in job_rows:
+                scraper.add_record_to_buffer(job_buffer, job_row)
+            return len(scraper.convert_record_buffer_to_df(job_buffer, 'job').index)
+        return run
+
+    def setup_location_attrs():
+        df = raw_job_df.copy()
+        return lambda: len(scraper.get_job_location_attrs(df, 'Canada').index)
+
+    def setup_salary_df():
+        def run():
+            scraper.create_salary_df(raw_job_df)
+            return job_count
+        return run
+
+    def setup_sql_write():
+        close_database_connections()
+        if os.path.exists(database):
+            os.remove(database)
+        initialize_database(database)
+        def run():
+            scraper.write_dfs_to_sql([('job', job_df), ('keyword', keyword_df), ('salary', salary_df)], database)
+            close_database_connections()
+            return job_count
+        return run
+
+    def setup_duplicate_lookup():
+        job_ids = list(job_df.index)
+        def run():
+            for start in range(0, job_count, 15):
+                scraper.get_existing_job_ids(job_ids[start:start + 15], database)
+                scraper.get_existing_keyword_ids(job_ids[start:start + 15], search_term, database)
+            close_database_connections()
+            return job_count
+        return run
+
+    def setup_snapshot_export():
+        snapshot_directory = os.path.join(directory, 'Analytics_Snapshot')
+        if os.path.exists(snapshot_directory):
+            shutil.rmtree(snapshot_directory)
+        return lambda: export_analytics_snapshot(database, snapshot_directory)
+
+    def setup_fixture_crawl():
+        crawl_database = os.path.join(directory, 'JobData_crawl.db')
+        if os.path.exists(crawl_database):
+            os.remove(crawl_database)
+        initialize_database(crawl_database)
+        page_limit = -(-job_count // 15)
+        def run():
+            server, base_url = fixture.start_fixture_server(pages_per_search = page_limit)
+            try:
+                page_timings = scraper.get_indeed_job_data([search_term], 'Canada', page_limit, driver_factory = fixture.FixtureDriver, base_url = base_url, database = crawl_database, 
+                parse_engine = 'lxml')
+            finally:
+                server.shutdown()
+            return int(page_timings['listings'].sum())
+        return run
+
+    return [('parse_bs4', 100_000, partial(setup_parse, 'bs4')), ('parse_lxml', None, partial(setup_parse, 'lxml')), ('record_buffer', None, setup_record_buffer), 
+    ('location_attrs', None, setup_location_attrs), ('salary_df', None, setup_salary_df), ('sql_write', None, setup_sql_write), ('duplicate_lookup', None, setup_duplicate_lookup), 
+    ('snapshot_export', None, setup_snapshot_export), ('fixture_crawl', 10_000, setup_fixture_crawl)]
+
+def measure_stage(setup, measure_memory = True):
+    '''
+    Run a stage once for its time and, if measure_memory is set, once more under tracemalloc for its peak python memory, since tracing slows the code it traces.
+    Returns the jobs processed, seconds, jobs per second and peak memory in MB.
+    '''
+    run = setup()
+    start = time.perf_counter()
+    jobs = run()
+    seconds = time.perf_counter() - start
+
+    peak_memory_mb = None
+    if measure_memory:
+        run = setup()
+        tracemalloc.start()
+        run()
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return {'jobs': jobs, 'seconds': seconds, 'jobs_per_second': jobs / seconds, 'peak_memory_mb': peak_memory_mb}
+
+def run_stage_benchmarks(sizes = BENCHMARK_SIZES, stages = None, results_path = BENCHMARK_RESULTS_PATH, measure_memory = True):
+    '''
+    Benchmark every pipeline stage (or only the stages listed) offline at each size of synthetic dataset, from parsing the saved and synthetic listing html to writing the database and snapshot.
+    Each result is appended to results_path as a json line tagged with the commit and time it was run, so runs can be compared across commits with compare_stage_benchmarks.
+    Returns the results of this run as a dataframe.
+    '''
+    run_details = {'commit': get_git_commit(), 'run_at': datetime.now().isoformat(timespec = 'seconds'), 'python': platform.python_version()}
+    results = []
+    for job_count in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for stage, max_jobs, setup in create_stage_setups(job_count, directory):
+                if (stages is not None and stage not in stages) or (max_jobs is not None and job_count > max_jobs):
+                    continue
+                result = {**run_details, 'stage': stage, 'size': job_count, **measure_stage(setup, measure_memory)}
+                peak_memory = 'n/a' if result['peak_memory_mb'] is None else f"{result['peak_memory_mb']:,.1f} MB"
+                print(f"{stage} at {job_count} jobs: {result['jobs_per_second']:,.0f} jobs/s, peak memory {peak_memory}")
+                with open(results_path, 'a') as file:
+                    file.write(json.dumps(result) + '\n')
+                results.append(result)
+            close_database_connections()
+
+    return pd.DataFrame(results).set_index(['stage', 'size'])
+
+def compare_stage_benchmarks(results_path = BENCHMARK_RESULTS_PATH, baseline_commit = None, commit = None):
+    '''
+    Compare the throughput and peak memory of each stage and size between two benchmarked commits, by default the last two in the results file. 
+    Where a commit was benchmarked more than once its latest run is used. A throughput_ratio below 1 means the later commit is slower.
+    '''
+    results = pd.read_json(results_path, lines = True)
+    commits = list(dict.fromkeys(results['commit'].iloc[::-1]))
+    if commit is None:
+        commit = commits[0]
+    if baseline_commit is None:
+        baseline_commit = next(earlier_commit for earlier_commit in commits if earlier_commit != commit)
+
+    latest_runs = results.sort_values('run_at').groupby(['commit', 'stage', 'size']).last()
+    baseline, current = latest_runs.loc[baseline_commit], latest_runs.loc[commit]
+    comparison = pd.DataFrame({'baseline_jobs_per_second': baseline['jobs_per_second'], 'jobs_per_second': current['jobs_per_second'], 
+    'baseline_peak_memory_mb': baseline['peak_memory_mb'], 'peak_memory_mb': current['peak_memory_mb']}).dropna(subset = ['baseline_jobs_per_second', 'jobs_per_second'])
+    comparison['throughput_ratio'] = comparison['jobs_per_second'] / comparison['baseline_jobs_per_second']
+    comparison['memory_ratio'] = comparison['peak_memory_mb'] / comparison['baseline_peak_memory_mb']
+    print(f'{commit} compared to {baseline_commit}')
+    return comparison
+
+
+def run_comparison_benchmarks():
+    '''Run the benchmarks comparing each optimization to the code it replaced.'''
+    record_buffer_results = benchmark_record_buffer()
+    print(record_buffer_results.iloc[[0, 9, 49, 99]].round(2))
+
+    check_location_parity_with_database()
+    benchmark_location_parsing()
+    print(benchmark_salary_parsing().round(3))
+    print(benchmark_worker_pool().round(2))
+    print(benchmark_parse_pipeline().round(2))
+    check_parse_engine_parity()
+    print(benchmark_parse_engines().round(2))
+    print(benchmark_cache_replay().round(2))
+    check_replay_updates_stored_jobs()
+    print(benchmark_incremental_crawl().round(2))
+    check_incremental_keyword_rows()
+    print(benchmark_sql_writer().round(2))
+    print(benchmark_duplicate_lookup().round(2))
+    for wait_results in benchmark_wait_scheduler():
+        print(wait_results.round(2))
+    print(benchmark_url_pagination().round(2))
+    check_url_pagination_resume()
+    print(benchmark_analytics_snapshot().round(2))
+    print(benchmark_summary_tables().round(2))
+    print(check_crawl_metrics().round(2))
+    print(benchmark_text_search().round(3))
+    print(benchmark_normalized_tables().round(2))
+    print(benchmark_streaming_writes().round(2))
+    print(benchmark_reenrichment().round(2))
+    print(benchmark_duplicate_detection().round(3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark each stage of the job pipeline offline and append the results to a file for comparison across commits.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = BENCHMARK_SIZES, help = 'numbers of synthetic jobs to benchmark each stage at')
+    parser.add_argument('--stages', nargs = '+', help = 'only benchmark these stages')
+    parser.add_argument('--output', default = BENCHMARK_RESULTS_PATH, help = 'json lines file the results are appended to')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the second, traced run of each stage that measures peak memory')
+    parser.add_argument('--compare', action = 'store_true', help = 'compare the last two commits in the results file instead of benchmarking')
+    parser.add_argument('--comparisons', action = 'store_true', help = 'also run the benchmarks comparing each optimization to the code it replaced')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_stage_benchmarks(args.output).round(2))
+    else:
+        print(run_stage_benchmarks(args.sizes, args.stages, args.output, not args.no_memory)[['jobs', 'seconds', 'jobs_per_second', 'peak_memory_mb']].round(2))
+        if args.comparisons:
+            run_comparison_benchmarks()
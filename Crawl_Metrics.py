@@ -0,0 +1,250 @@
+import cProfile
+import pstats
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from Normalize_Job_Tables import add_missing_columns
+
+
+DATABASE_PATH = 'JobData.db'
+#Stages of a crawl in the order a page passes through them. Waits are also recorded per wait type (ie. wait_page_load) as a breakdown of navigation
+CRAWL_STAGES = ['driver_startup', 'navigation', 'parse', 'extract', 'duplicate_check', 'enrichment', 'sql_write', 'duplicate_clustering', 'snapshot_export']
+KEYWORD_COUNT_COLUMNS = ['pages', 'listings_seen', 'ads_skipped', 'duplicates_skipped', 'new_jobs', 'jobs_inserted', 'keyword_rows_inserted']
+#Measures of a keyword's yield compared against earlier runs by find_yield_drops
+YIELD_COLUMNS = ['listings_per_page', 'new_jobs']
+
+
+def create_metrics_tables(c):
+    '''Create the tables the timings, counts and failures of each crawl run are written to.'''
+    c.execute(""" CREATE TABLE IF NOT EXISTS CrawlRuns(
+        run_id integer not null,
+        started text not null,
+        seconds real not null,
+        search_location text not null,
+        keywords text not null,
+        page_limit integer not null,
+        workers integer not null,
+        fetch_mode text not null,
+        parse_engine text not null,
+        profile_path text null,
+        incremental integer not null default 0,
+
+        CONSTRAINT PK_CrawlRuns PRIMARY KEY (run_id)
+    )
+    """)
+    #Runs recorded before incremental was stored were full crawls, as incremental refreshes were rare
+    add_missing_columns(c, 'CrawlRuns', [('incremental', 'integer not null default 0')])
+
+    #keyword is null for stages not tied to a single keyword, ie. starting a driver
+    c.execute(""" CREATE TABLE IF NOT EXISTS CrawlStageMetrics(
+        run_id integer not null,
+        keyword text null,
+        stage text not null,
+        calls integer not null,
+        seconds real not null,
+        failures integer not null,
+
+        CONSTRAINT FK_CrawlStageMetrics_run_id FOREIGN KEY (run_id) REFERENCES CrawlRuns (run_id)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS CrawlKeywordMetrics(
+        run_id integer not null,
+        keyword text not null,
+        pages integer not null,
+        listings_seen integer not null,
+        ads_skipped integer not null,
+        duplicates_skipped integer not null,
+        new_jobs integer not null,
+        jobs_inserted integer not null,
+        keyword_rows_inserted integer not null,
+
+        CONSTRAINT PK_CrawlKeywordMetrics PRIMARY KEY (run_id, keyword),
+        CONSTRAINT FK_CrawlKeywordMetrics_run_id FOREIGN KEY (run_id) REFERENCES CrawlRuns (run_id)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS CrawlFailures(
+        run_id integer not null,
+        keyword text null,
+        stage text not null,
+        page integer null,
+        reason text not null,
+
+        CONSTRAINT FK_CrawlFailures_run_id FOREIGN KEY (run_id) REFERENCES CrawlRuns (run_id)
+    )
+    """)
+
+
+class CrawlMetrics:
+    '''
+    Collects the seconds spent in each stage of a crawl per keyword, the number of listings seen, skipped and inserted per keyword and the reason for every failure,
+    so a slow or low yield crawl can be traced to a keyword and a stage. One instance is shared by the crawler workers and the writer.
+    With profile_path set, the crawler threads and the writer are also profiled with cProfile and the combined profile is saved there when the run is written.
+    '''
+    def __init__(self, profile_path = None):
+        self.profile_path = profile_path
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.keyword_counts = {}
+        self.failures = []
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def record_stage(self, stage, keyword, seconds, calls = 1, failures = 0):
+        '''Add the seconds spent in a stage for a keyword (None if it's not tied to one) to its running total.'''
+        with self.lock:
+            stage_metrics = self.stages.setdefault((keyword, stage), {'calls': 0, 'seconds': 0.0, 'failures': 0})
+            stage_metrics['calls'] += calls
+            stage_metrics['seconds'] += seconds
+            stage_metrics['failures'] += failures
+
+    def record_failure(self, stage, keyword, reason, page = None):
+        '''Record why a stage failed for a keyword, along with the page it failed on if known.'''
+        with self.lock:
+            self.failures.append({'keyword': keyword, 'stage': stage, 'page': page, 'reason': reason})
+            self.stages.setdefault((keyword, stage), {'calls': 0, 'seconds': 0.0, 'failures': 0})['failures'] += 1
+
+    def count(self, keyword, **counts):
+        '''Add to the counts of a keyword, ie. count(keyword, pages = 1).'''
+        with self.lock:
+            keyword_counts = self.keyword_counts.setdefault(keyword, dict.fromkeys(KEYWORD_COUNT_COLUMNS, 0))
+            for column, value in counts.items():
+                keyword_counts[column] += value
+
+    def record_page(self, page_stats):
+        '''Record the stage timings and counts of a page handed to the writer, from the page stats built by forward_parsed_page.'''
+        keyword = page_stats['keyword']
+        self.record_stage('navigation', keyword, page_stats['wait_seconds'])
+        self.record_stage('parse', keyword, page_stats['parse_seconds'] - page_stats['extract_seconds'])
+        self.record_stage('extract', keyword, page_stats['extract_seconds'])
+        self.record_stage('duplicate_check', keyword, page_stats['duplicate_check_seconds'])
+        self.count(keyword, pages = 1, listings_seen = page_stats['listings_seen'], ads_skipped = page_stats['ads_skipped'], duplicates_skipped = page_stats['duplicates_skipped'],
+        new_jobs = page_stats['new_jobs'])
+
+    def record_wait_stats(self, wait_stats):
+        '''Record the waits, timeouts and seconds waited per wait type from WaitScheduler.get_wait_stats, with each timeout counted as a failure.'''
+        for wait_type, row in wait_stats.iterrows():
+            self.record_stage(f'wait_{wait_type}', None, float(row['seconds']), int(row['waits']), int(row['timeouts']))
+
+    def start_profile(self):
+        '''Start profiling the calling thread if profile_path is set. Returns the profiler to pass to stop_profile, or None when not profiling.'''
+        if self.profile_path is None:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop_profile(self, profiler):
+        '''Stop a profiler from start_profile on the thread that started it and keep it to be combined with the others.'''
+        if profiler is None:
+            return
+        profiler.disable()
+        with self.lock:
+            self.profiles.append(profiler)
+
+    def get_stage_stats(self):
+        '''Return the calls, seconds and failures of each stage per keyword as a dataframe.'''
+        with self.lock:
+            stage_stats = [{'keyword': keyword, 'stage': stage, **stage_metrics} for (keyword, stage), stage_metrics in self.stages.items()]
+        return pd.DataFrame(stage_stats, columns = ['keyword', 'stage', 'calls', 'seconds', 'failures'])
+
+    def get_stage_seconds(self):
+        '''Return the seconds spent in each of the CRAWL_STAGES per keyword, with a blank keyword for the stages not tied to one.'''
+        stage_stats = self.get_stage_stats()
+        stage_stats = stage_stats[stage_stats['stage'].isin(CRAWL_STAGES)].fillna({'keyword': ''})
+        stage_seconds = stage_stats.pivot_table(index = 'keyword', columns = 'stage', values = 'seconds', aggfunc = 'sum', fill_value = 0.0)
+        return stage_seconds[[stage for stage in CRAWL_STAGES if stage in stage_seconds.columns]]
+
+    def write_run(self, run_details, database = DATABASE_PATH):
+        '''
+        Write the run to the crawl metrics tables in a single transaction, where run_details holds the search_location, keywords, page_limit, workers, fetch_mode, parse_engine 
+        and whether the crawl was incremental.
+        Saves the combined profile first if profiling. Returns the run id.
+        '''
+        if self.profiles:
+            stats = pstats.Stats(self.profiles[0])
+            stats.add(*self.profiles[1:])
+            stats.dump_stats(self.profile_path)
+            print(f'Crawl profile saved to {self.profile_path}')
+
+        with self.lock:
+            stage_rows = [(keyword, stage, stage_metrics['calls'], stage_metrics['seconds'], stage_metrics['failures']) for (keyword, stage), stage_metrics in self.stages.items()]
+            keyword_rows = [(keyword, *(keyword_counts[column] for column in KEYWORD_COUNT_COLUMNS)) for keyword, keyword_counts in self.keyword_counts.items()]
+            failure_rows = [(failure['keyword'], failure['stage'], failure['page'], failure['reason']) for failure in self.failures]
+
+        conn = sqlite3.connect(database)
+        try:
+            with conn:
+                create_metrics_tables(conn)
+                run_id = conn.execute(""" INSERT INTO CrawlRuns (started, seconds, search_location, keywords, page_limit, workers, fetch_mode, parse_engine, profile_path, incremental)
+                VALUES (:started, :seconds, :search_location, :keywords, :page_limit, :workers, :fetch_mode, :parse_engine, :profile_path, :incremental)""",
+                {'incremental': False, **run_details, 'started': self.started.isoformat(timespec = 'seconds'), 'seconds': time.perf_counter() - self.start, 'profile_path': self.profile_path}).lastrowid
+                conn.executemany('INSERT INTO CrawlStageMetrics VALUES (?, ?, ?, ?, ?, ?)', [(run_id, *row) for row in stage_rows])
+                conn.executemany(f'INSERT INTO CrawlKeywordMetrics VALUES ({", ".join("?" * (len(KEYWORD_COUNT_COLUMNS) + 2))})', [(run_id, *row) for row in keyword_rows])
+                conn.executemany('INSERT INTO CrawlFailures VALUES (?, ?, ?, ?, ?)', [(run_id, *row) for row in failure_rows])
+        finally:
+            conn.close()
+        return run_id
+
+
+def find_yield_drops(database = DATABASE_PATH, history_runs = 7, min_ratio = 0.5):
+    '''
+    Compare the yield of each keyword in the latest crawl run (listings seen per page and new jobs found) to its average over the history_runs earlier runs that crawled it 
+    with the same fetch_mode, incremental setting and page_limit, since an incremental refresh or a shorter crawl finds fewer new jobs by design.
+    Replay runs only re-parse cached pages, so they are never compared: nothing is reported after one, and they are left out of the history.
+    A fall in listings per page usually means the page layout changed and listings are being missed, while a fall in new jobs can also mean the search has run dry.
+    Prints and returns the keywords whose yield fell below min_ratio of their average. Keywords with no earlier runs are skipped.
+    '''
+    conn = sqlite3.connect(database)
+    try:
+        latest_run_id = conn.execute('SELECT max(run_id) FROM CrawlRuns').fetchone()[0]
+        keyword_metrics = pd.read_sql(""" SELECT t1.run_id, t1.keyword, t1.pages, t1.listings_seen, t1.new_jobs, t2.fetch_mode, t2.incremental, t2.page_limit
+        FROM CrawlKeywordMetrics t1 INNER JOIN CrawlRuns t2 ON t2.run_id = t1.run_id
+        WHERE t1.run_id = ? OR t2.fetch_mode != 'replay'
+        ORDER BY t1.run_id
+        """, conn, params = (latest_run_id,))
+    finally:
+        conn.close()
+    latest_config = keyword_metrics.loc[keyword_metrics['run_id'] == latest_run_id, ['fetch_mode', 'incremental', 'page_limit']].head(1)
+    if latest_config.empty or latest_config['fetch_mode'].iloc[0] == 'replay':
+        return pd.DataFrame(columns = ['latest', 'average', 'ratio'], index = pd.MultiIndex.from_tuples([], names = ['keyword', 'measure']))
+    keyword_metrics = keyword_metrics.merge(latest_config, on = ['fetch_mode', 'incremental', 'page_limit'])
+
+    #A keyword that reached no pages at all counts as no listings per page rather than being skipped
+    keyword_metrics['listings_per_page'] = keyword_metrics['listings_seen'] / keyword_metrics['pages'].clip(lower = 1)
+    latest = keyword_metrics[keyword_metrics['run_id'] == latest_run_id].set_index('keyword')[YIELD_COLUMNS]
+    history = keyword_metrics[keyword_metrics['run_id'] < latest_run_id].groupby('keyword').tail(history_runs).groupby('keyword')[YIELD_COLUMNS].mean()
+
+    yields = pd.DataFrame({'latest': latest.stack(), 'average': history.reindex(latest.index).stack()}).dropna()
+    yields['ratio'] = yields['latest'] / yields['average']
+    yield_drops = yields[yields['ratio'] < min_ratio].rename_axis(['keyword', 'measure'])
+    for (keyword, measure), row in yield_drops.iterrows():
+        print(f'Yield drop for {keyword}: {measure} was {row["latest"]:.1f} against an average of {row["average"]:.1f} over earlier runs')
+    return yield_drops
+
+def load_run_metrics(database = DATABASE_PATH, run_id = None):
+    '''Load the stage metrics, keyword counts and failures of a crawl run (the latest by default) as dataframes.'''
+    conn = sqlite3.connect(database)
+    try:
+        if run_id is None:
+            run_id = conn.execute('SELECT max(run_id) FROM CrawlRuns').fetchone()[0]
+        stage_metrics = pd.read_sql('SELECT keyword, stage, calls, seconds, failures FROM CrawlStageMetrics WHERE run_id = ?', conn, params = (run_id,))
+        keyword_metrics = pd.read_sql('SELECT * FROM CrawlKeywordMetrics WHERE run_id = ?', conn, params = (run_id,)).drop(columns = 'run_id').set_index('keyword')
+        failures = pd.read_sql('SELECT keyword, stage, page, reason FROM CrawlFailures WHERE run_id = ?', conn, params = (run_id,))
+    finally:
+        conn.close()
+    return stage_metrics, keyword_metrics, failures
+
+
+if __name__ == '__main__':
+    stage_metrics, keyword_metrics, failures = load_run_metrics()
+    print(stage_metrics.round(2))
+    print(keyword_metrics)
+    print(failures)
+    find_yield_drops()
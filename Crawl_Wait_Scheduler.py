@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import deque
+
+from selenium.webdriver.support.ui import WebDriverWait
+import selenium.common.exceptions as ex
+
+import numpy as np
+import pandas as pd
+
+
+#Starting (and longest) timeout in seconds of each type of wait, used until enough waits have been seen to learn a timeout from
+DEFAULT_WAIT_TIMEOUTS = {'page_load': 10, 'page_controls': 10, 'popup': 5, 'cloudflare': 20, 'cloudflare_clear': 20}
+MIN_WAIT_TIMEOUT = 2
+WAIT_POLL_SECONDS = 0.1
+
+
+class WaitScheduler:
+    '''
+    Sets the timeout of each type of browser wait from the latencies seen so far (a high percentile times a safety margin, kept between min_timeout and the default timeout). 
+    DEFAULT_WAIT_TIMEOUTS are used until min_samples waits of a type have finished. 
+    Also records the number of waits, timeouts and seconds spent per wait type so it shows where crawl time goes. One scheduler can be shared by all the crawler workers.
+    '''
+    def __init__(self, default_timeouts = DEFAULT_WAIT_TIMEOUTS, percentile = 95, margin = 2, min_timeout = MIN_WAIT_TIMEOUT, min_samples = 5, max_samples = 200):
+        self.default_timeouts = default_timeouts
+        self.percentile = percentile
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.latencies = {wait_type: deque(maxlen = max_samples) for wait_type in default_timeouts}
+        self.stats = {wait_type: {'waits': 0, 'timeouts': 0, 'seconds': 0.0} for wait_type in default_timeouts}
+        self.lock = threading.Lock()
+
+    def get_timeout(self, wait_type):
+        '''Return the timeout to use for the next wait of wait_type.'''
+        with self.lock:
+            latencies = list(self.latencies[wait_type])
+        if len(latencies) < self.min_samples:
+            return self.default_timeouts[wait_type]
+        return float(np.clip(np.percentile(latencies, self.percentile) * self.margin, self.min_timeout, self.default_timeouts[wait_type]))
+
+    def wait(self, driver, wait_type, condition):
+        '''Wait until condition(driver) returns something truthy and return it, or return None once the timeout for wait_type runs out.'''
+        timeout = self.get_timeout(wait_type)
+        start = time.perf_counter()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency = WAIT_POLL_SECONDS).until(condition)
+        except ex.TimeoutException:
+            result = None
+        seconds = time.perf_counter() - start
+        with self.lock:
+            stats = self.stats[wait_type]
+            stats['waits'] += 1
+            stats['seconds'] += seconds
+            if result is None:
+                stats['timeouts'] += 1
+            else:
+                self.latencies[wait_type].append(seconds)
+        return result
+
+    def get_wait_stats(self):
+        '''Return the number of waits and timeouts, the total seconds waited and the current timeout of each wait type as a dataframe.'''
+        with self.lock:
+            stats = [{'wait_type': wait_type, **wait_stats} for wait_type, wait_stats in self.stats.items()]
+        wait_stats = pd.DataFrame(stats).set_index('wait_type')
+        wait_stats['timeout'] = [self.get_timeout(wait_type) for wait_type in wait_stats.index]
+        return wait_stats
@@ -0,0 +1,28 @@
+import sqlite3
+import threading
+
+
+DATABASE_PATH = 'JobData.db'
+#Open connections of each thread, by database path
+database_connections = threading.local()
+
+
+def get_database_connection(database = DATABASE_PATH):
+    '''
+    Return this thread's open connection to the database, connecting on first use. sqlite connections cannot be shared between threads, so each thread keeps its own for its lifetime
+    rather than opening a new one for every read and write. Connections use WAL journaling so the crawler workers can read while the writer is writing.
+    '''
+    connections = database_connections.__dict__.setdefault('connections', {})
+    if database not in connections:
+        conn = sqlite3.connect(database, timeout = 30)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        connections[database] = conn
+    return connections[database]
+
+def close_database_connections():
+    '''Close every connection opened by the current thread.'''
+    connections = database_connections.__dict__.setdefault('connections', {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+DATABASE_PATH = 'JobData.db'
+SNAPSHOT_DIRECTORY = 'Analytics_Snapshot'
+SNAPSHOT_STATE_FILE = 'snapshot_state.json'
+SNAPSHOT_CHUNK_ROWS = 100_000
+PARTITION_COLUMNS = ['date_recorded', 'keyword']
+#Low cardinality text columns, stored dictionary encoded and loaded back as pandas categoricals
+CATEGORICAL_COLUMNS = ['company', 'rating_provided', 'salary_provided', 'location_model', 'jurisdiction', 'city', 'country', 'salary_type', 'salary_period']
+
+#Column selections of the dataframes the analysis notebook works from
+JOBS_COLUMNS = ['job_title', 'company', 'location', 'rating_provided', 'rating', 'salary_provided', 'weblink', 'date_recorded', 'location_model', 'jurisdiction', 'city', 'country']
+JOBS_KEYWORDS_COLUMNS = ['job_title', 'company', 'location', 'location_model', 'jurisdiction', 'city']
+JOBS_SALARIES_COLUMNS = ['job_title', 'company', 'location', 'salary_type', 'salary_period', 'expected', 'floor', 'ceiling', 'annual_floor', 'annual_expected', 'annual_ceiling']
+
+#One row per (job, keyword) with the job's salary joined on. keyword_ref_key only grows, so it marks which rows have been exported already.
+#The keys keep the keyword_rowid and job_rowid names of the rowids they carried over from, so existing snapshots stay valid
+SNAPSHOT_QUERY = """ SELECT
+t3.keyword_ref_key AS keyword_rowid, t1.job_key AS job_rowid, t1.id, t3.keyword, t1.date_recorded, t1.job_title, t1.company, t1.location, t1.rating_provided, t1.rating,
+t1.salary_provided, t1.weblink, t1.location_model, t1.jurisdiction, t1.city, t1.country,
+t2.salary_text, t2.salary_type, t2.salary_period, t2.floor, t2.expected, t2.ceiling, t2.annual_floor, t2.annual_expected, t2.annual_ceiling
+FROM KeywordRefDetails t3 INNER JOIN JobDetails t1 ON t1.job_key = t3.job_key LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+WHERE t3.keyword_ref_key > ?
+ORDER BY t3.keyword_ref_key
+"""
+
+
+def read_snapshot_state(snapshot_directory = SNAPSHOT_DIRECTORY):
+    '''Read the last keyword_ref_key and the number of rows exported to the snapshot. An empty state is returned if there's no snapshot yet.'''
+    state_path = os.path.join(snapshot_directory, SNAPSHOT_STATE_FILE)
+    if not os.path.exists(state_path):
+        return {'last_keyword_rowid': 0, 'rows': 0}
+    with open(state_path) as file:
+        return json.load(file)
+
+def write_snapshot_state(state, snapshot_directory = SNAPSHOT_DIRECTORY):
+    '''Save the snapshot state, replacing the old file in one step so an interrupted export never leaves a partly written state.'''
+    state_path = os.path.join(snapshot_directory, SNAPSHOT_STATE_FILE)
+    with open(f'{state_path}.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(f'{state_path}.tmp', state_path)
+
+def mark_snapshot_for_rebuild(snapshot_directory = SNAPSHOT_DIRECTORY):
+    '''Flag an existing snapshot as out of date, ie. before existing rows are updated, so the next export rebuilds it instead of only appending the new rows.'''
+    if os.path.exists(os.path.join(snapshot_directory, SNAPSHOT_STATE_FILE)):
+        write_snapshot_state({**read_snapshot_state(snapshot_directory), 'rebuild': True}, snapshot_directory)
+
+def export_analytics_snapshot(database = DATABASE_PATH, snapshot_directory = SNAPSHOT_DIRECTORY, rebuild = False):
+    '''
+    Bring the parquet snapshot of the database up to date by appending the (job, keyword) rows added since the last export, with the Jobs, KeywordRef and Salaries joins already done.
+    The snapshot is partitioned by date_recorded and keyword, and the low cardinality text columns are dictionary encoded.
+    Each export adds new files named after the last keyword_ref_key they hold, so re-running an interrupted export overwrites its own files rather than duplicating rows.
+    rebuild deletes the snapshot and exports every row again (ie. after existing rows were updated). The snapshot is also rebuilt if the database is older than it, 
+    or if it was flagged by mark_snapshot_for_rebuild.
+    Returns the number of rows exported.
+    '''
+    if rebuild and os.path.exists(snapshot_directory):
+        shutil.rmtree(snapshot_directory)
+    os.makedirs(snapshot_directory, exist_ok = True)
+    state = read_snapshot_state(snapshot_directory)
+    if state.get('rebuild'):
+        print('The analytics snapshot is out of date, rebuilding the snapshot')
+        return export_analytics_snapshot(database, snapshot_directory, rebuild = True)
+
+    conn = sqlite3.connect(database)
+    try:
+        last_keyword_rowid = conn.execute('SELECT coalesce(max(keyword_ref_key), 0) FROM KeywordRefRecords').fetchone()[0]
+        if last_keyword_rowid < state['last_keyword_rowid']:
+            print(f'{database} has fewer rows than the snapshot, rebuilding the snapshot')
+            conn.close()
+            return export_analytics_snapshot(database, snapshot_directory, rebuild = True)
+
+        exported_rows = 0
+        for chunk in pd.read_sql(SNAPSHOT_QUERY, conn, params = (state['last_keyword_rowid'],), chunksize = SNAPSHOT_CHUNK_ROWS):
+            if chunk.empty:
+                continue
+            chunk_last_rowid = int(chunk['keyword_rowid'].max())
+            chunk = chunk.drop(columns = 'keyword_rowid')
+            chunk[CATEGORICAL_COLUMNS] = chunk[CATEGORICAL_COLUMNS].astype('category')
+            chunk.to_parquet(os.path.join(snapshot_directory, 'job_keywords'), engine = 'pyarrow', partition_cols = PARTITION_COLUMNS, index = False,
+            basename_template = f'part-{chunk_last_rowid}-{{i}}.parquet')
+
+            exported_rows += len(chunk.index)
+            state = {'last_keyword_rowid': chunk_last_rowid, 'rows': state['rows'] + len(chunk.index)}
+            write_snapshot_state(state, snapshot_directory)
+    finally:
+        conn.close()
+
+    print(f'Rows exported to the analytics snapshot: {exported_rows}, total rows: {state["rows"]}')
+    return exported_rows
+
+def load_analytics_snapshot(snapshot_directory = SNAPSHOT_DIRECTORY, categoricals = True):
+    '''
+    Load the snapshot into the dataframes the analysis notebook works from: jobs, jobs_keywords, jobs_salaries and jobs_salaries_keywords,
+    the same as its pd.read_sql joins (plus the annualized salaries) with rows in the order the jobs were added to the database.
+    With categoricals set, keyword, date_recorded and the CATEGORICAL_COLUMNS are pandas categoricals. Otherwise they're plain strings, the same as pd.read_sql returns.
+    '''
+    job_keywords = pd.read_parquet(os.path.join(snapshot_directory, 'job_keywords'), engine = 'pyarrow')
+    if not categoricals:
+        for column in CATEGORICAL_COLUMNS + PARTITION_COLUMNS:
+            job_keywords[column] = np.asarray(job_keywords[column].astype(object).where(job_keywords[column].notna(), None))
+    job_keywords = job_keywords.iloc[np.lexsort((job_keywords['keyword'].astype(str), job_keywords['job_rowid']))]
+
+    jobs = job_keywords.drop_duplicates('id').set_index('id')[JOBS_COLUMNS]
+    jobs_keywords = job_keywords.set_index(['id', 'keyword'])[JOBS_KEYWORDS_COLUMNS]
+    job_salary_keywords = job_keywords[job_keywords['salary_text'].notna()]
+    jobs_salaries = job_salary_keywords.drop_duplicates('id').set_index('id')[JOBS_SALARIES_COLUMNS]
+    jobs_salaries_keywords = job_salary_keywords.set_index(['id', 'keyword'])[JOBS_SALARIES_COLUMNS]
+    return jobs, jobs_keywords, jobs_salaries, jobs_salaries_keywords
+
+
+if __name__ == '__main__':
+    export_analytics_snapshot()
@@ -0,0 +1,88 @@
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from urllib.parse import urlencode
+
+import selenium.common.exceptions as ex
+
+from Job_Page_Cache import read_webpage_sources_from_cache, store_page_in_cache
+
+
+INDEED_BASE_URL = 'https://ca.indeed.com'
+RESULTS_PER_PAGE = 10 #Offset the start parameter moves by for each page of results
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0', 'Accept-Language': 'en-CA,en;q=0.5'}
+
+
+def get_search_url(search_term, search_location, base_url = INDEED_BASE_URL, sort = None, page = 1):
+    '''Build the url of a page of search results for a keyword and location, the first page by default. sort = 'date' lists the newest jobs first instead of the most relevant.'''
+    query = {'q': search_term, 'l': search_location, 'lang': 'en'}
+    if sort is not None:
+        query['sort'] = sort
+    if page > 1:
+        query['start'] = (page - 1) * RESULTS_PER_PAGE
+    return f'{base_url}/jobs?' + urlencode(query)
+
+def fetch_page_source(url, timeout = 30):
+    '''Fetch the html of a page over plain http with browser headers. Lightweight alternative to a driver for fetching pages by url.'''
+    with urllib.request.urlopen(urllib.request.Request(url, headers = HTTP_HEADERS), timeout = timeout) as response:
+        return response.read().decode('utf-8')
+
+def page_has_next_page(page_source):
+    '''Check the html of a page of results for the next page button.'''
+    return 'data-testid="pagination-page-next"' in page_source
+
+def fetch_webpage_sources_by_url(search_term, search_location, page_limit = 100, base_url = INDEED_BASE_URL, sort = None, fetch_workers = 4, fetch_page = fetch_page_source, 
+    cache_directory = None, metrics = None):
+    '''
+    Alternative to crawl_webpage_sources that builds the url of each page from its result offset and fetches up to fetch_workers pages at the same time instead of clicking through them.
+    fetch_page takes a url and returns its html, plain http by default. 
+    Yields the same (page, html, seconds, date) tuples as crawl_webpage_sources in page order, stopping after the first page without a next page button or at the first page that fails to fetch.
+    If cache_directory is set, each page is saved to the page cache before it's yielded, and the pages of this search already cached today are read back instead of fetched, 
+    so an interrupted crawl resumes after the last page it completed. A page that fails to fetch is recorded as a navigation failure in metrics if given.
+    '''
+    date_recorded = datetime.today().strftime('%Y-%m-%d')
+    next_page = 1
+    if cache_directory is not None:
+        for page, page_source, wait_seconds, _ in read_webpage_sources_from_cache(search_term, search_location, page_limit, cache_directory, [date_recorded]):
+            if page != next_page:
+                break
+            yield page, page_source, wait_seconds, date_recorded
+            next_page += 1
+            if not page_has_next_page(page_source):
+                print(f'reached last page of {search_term} jobs at page: {page} from the page cache, page requested: {page_limit}')
+                return
+        if next_page > 1:
+            print(f'resuming {search_term} crawl at page {next_page}, earlier pages read from the page cache')
+
+    def fetch(page):
+        start = time.perf_counter()
+        page_source = fetch_page(get_search_url(search_term, search_location, base_url, sort, page))
+        return page_source, time.perf_counter() - start
+
+    pages = iter(range(next_page, page_limit + 1))
+    with ThreadPoolExecutor(max_workers = fetch_workers) as fetch_executor:
+        pending_pages = deque((page, fetch_executor.submit(fetch, page)) for page in islice(pages, fetch_workers))
+        try:
+            while pending_pages:
+                page, fetched_page = pending_pages.popleft()
+                try:
+                    page_source, wait_seconds = fetched_page.result()
+                except (OSError, ex.WebDriverException) as e:
+                    print(f'failed fetching page {page} of {search_term} jobs: {e}')
+                    if metrics is not None:
+                        metrics.record_failure('navigation', search_term, f'{type(e).__name__}: {e}', page)
+                    return
+                if cache_directory is not None:
+                    store_page_in_cache(page_source, search_term, search_location, page, date_recorded, cache_directory)
+                yield page, page_source, wait_seconds, date_recorded
+                if not page_has_next_page(page_source):
+                    print(f'reached last page of {search_term} jobs at page: {page}, page requested: {page_limit}')
+                    return
+                pending_pages.extend((page, fetch_executor.submit(fetch, page)) for page in islice(pages, 1))
+            print(f'{search_term} page reached: {page_limit}, page requested: {page_limit}')
+        finally:
+            for _, fetched_page in pending_pages:
+                fetched_page.cancel()
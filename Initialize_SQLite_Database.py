@@ -1,50 +1,69 @@
+import os
 import sqlite3
 
-#Create sqlite tables
-conn = sqlite3.connect('JobData.db')
-
-c = conn.cursor()
-
-c.execute(""" CREATE TABLE Jobs(
-    id text not null,
-    job_title text not null,
-    company text not null,
-    location text not null,
-    rating_provided text not null,
-    rating real null,
-    salary_provided text not null,
-    weblink text not null,
-    date_recorded not null, 
-    location_model text, 
-    jurisdiction text, 
-    city text, 
-    country text,
-
-    CONSTRAINT PK_Jobs_id PRIMARY KEY (id)
-)
-""")
-
-c.execute(""" CREATE TABLE Salaries(
-    id text not null,
-    salary_text text not null,
-    salary_type text null,
-    salary_period text null,
-    floor real null,
-    expected real null,
-    ceiling real null,
-
-    CONSTRAINT PK_Salaries_id PRIMARY KEY (id),
-    CONSTRAINT FK_Salaries_id FOREIGN KEY (id) REFERENCES Jobs (id)
-)
-""")
-
-c.execute(""" CREATE TABLE KeywordRef(
-    id text not null,
-    keyword text not null,
-    CONSTRAINT PK_KeywordRef_id_keyword PRIMARY KEY (id, keyword)
-)
-""")
-
-conn.commit()
-
-conn.close()
\ No newline at end of file
+from Crawl_Metrics import create_metrics_tables
+from Job_Duplicate_Clusters import create_duplicate_tables, update_duplicate_clusters
+from Job_Text_Search import create_search_index, update_search_index
+from Maintain_Summary_Tables import create_summary_tables, load_jurisdiction_populations, update_summary_tables
+from Normalize_Job_Tables import create_normalized_tables, create_normalized_views, has_legacy_tables, migrate_legacy_tables
+
+def initialize_database(database = 'JobData.db'):
+    '''Create the sqlite tables used by the web scraper, or upgrade the tables of an existing database to the current schema.'''
+    conn = sqlite3.connect(database)
+
+    c = conn.cursor()
+
+    #Databases created before the normalized tables are migrated to them, keeping Jobs, KeywordRef and Salaries as views
+    migrated = has_legacy_tables(c)
+    if migrated:
+        size_before = os.path.getsize(database)
+        migrate_legacy_tables(c)
+    create_normalized_tables(c)
+    create_normalized_views(c)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS CrawlHighWaterMarks(
+        keyword text not null,
+        search_location text not null,
+        last_crawled text not null,
+        newest_job_id text null,
+        pages_crawled integer not null,
+        last_new_page integer not null,
+        new_jobs integer not null,
+        CONSTRAINT PK_CrawlHighWaterMarks PRIMARY KEY (keyword, search_location)
+    )
+    """)
+
+    #Summary tables for the notebook and dashboards. Counts any rows not yet summarized, which on first run is every row
+    create_summary_tables(c)
+    load_jurisdiction_populations(c)
+    update_summary_tables(c)
+
+    #Timings, counts and failures of each crawl run, written by get_indeed_job_data
+    create_metrics_tables(c)
+
+    #Full text index over the job titles and companies. Indexes any jobs not yet in it, which on first run is every job
+    create_search_index(c)
+    update_search_index(c)
+
+    #Near-duplicate clusters, so reposts of a role are counted once. Clusters from before role_hash are dropped along with their JobBuckets index and clustered again
+    dropped_buckets = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'JobBuckets'").fetchone() is not None
+    create_duplicate_tables(c)
+
+    conn.commit()
+
+    #Clusters any jobs not yet in one, which on first run is every job, in its own transaction after the schema changes are committed
+    update_duplicate_clusters(c)
+    conn.commit()
+
+    #Free the space of the dropped legacy tables
+    if migrated:
+        c.execute('VACUUM')
+        print(f'Moved {database} to the normalized tables: {size_before / 1e6:.2f} MB before, {os.path.getsize(database) / 1e6:.2f} MB after')
+    elif dropped_buckets:
+        c.execute('VACUUM')
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    initialize_database()
@@ -0,0 +1,184 @@
+import random
+import re
+import threading
+import time
+import urllib.request
+import zlib
+from functools import partial
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urljoin, urlparse
+
+import selenium.common.exceptions as ex
+
+from Job_Web_Scraper import NEXT_PAGE_XPATH, PAGE_STATE_SCRIPT
+
+
+SAMPLE_TITLES = ['Data Analyst', 'Senior Data Analyst', 'Data Scientist', 'Business Intelligence Developer', 'Power BI Developer', 'Database Administrator', 'Data Engineer', 'Reporting Analyst']
+SAMPLE_COMPANIES = ['CorGTA Inc.', 'Staples Canada', 'Enbridge', 'Royal Bank of Canada', 'TD Bank', 'Shopify', 'Government of Alberta', 'Rogers Communications']
+SAMPLE_LOCATIONS = ['Toronto, ON', 'Hybrid remote in Toronto, ON', 'Remote', 'Mississauga, ON', 'Vancouver, BC', 'Calgary, AB', 'Remote in Toronto, ON', 'Montréal, QC',
+'Ontario', 'Canada', 'Remote in Ontario', 'Hybrid remote in Canada', 'Halifax', 'Remote Hybrid', 'Temporarily Remote in Edmonton, AB']
+SAMPLE_SALARIES = ['$60–$62 an hour', '$70,000–$80,000 a year', '$84,000 a year', 'From $25 an hour', 'Up to $95,000 a year', '$5,000–$6,000 a month', '$200 a day',
+'From $1,200 a week', '$41.12–$47.67 an hour', None, None, None]
+
+
+def create_synthetic_job_uid(number):
+    '''Create a 16 character hex id in the same format as the Indeed job ids.'''
+    return f'{number:016x}'
+
+def create_synthetic_listing_html(job_uid, rng = random):
+    '''Create the html for a single job listing using the same tags and attributes the scraper looks for on Indeed.'''
+    salary = rng.choice(SAMPLE_SALARIES)
+    salary_html = ''
+    if salary:
+        salary_html = f'<div class="metadata salary-snippet-container"><div data-testid="attribute_snippet_testid">{salary}</div></div>'
+    rating_html = ''
+    if rng.random() < 0.3:
+        rating_html = f'<span data-testid="holistic-rating">{rng.randint(25, 50) / 10}</span>'
+
+    return (f'<li class="css-5lfssm eu4oa1w0"><div class="cardOutline"><h2 class="jobTitle"><a data-jk="{job_uid}"><span id="jobTitle-{job_uid}">{rng.choice(SAMPLE_TITLES)}</span></a></h2>'
+    f'<div class="company_location"><span data-testid="company-name">{rng.choice(SAMPLE_COMPANIES)}</span>{rating_html}<div data-testid="text-location">{rng.choice(SAMPLE_LOCATIONS)}</div></div>'
+    f'{salary_html}</div></li>')
+
+def create_synthetic_ad_html():
+    '''Create the html for an ad container that sits in the listing list on Indeed but is not a job.'''
+    return '<li class="css-5lfssm eu4oa1w0"><div class="mosaic-zone nonJobContent-desktop"><span id="ad-banner">Ad</span></div></li>'
+
+EMAIL_POPUP_HTML = '<div id="email-popup"><h2 class="DesktopJobAlertPopup-heading">Get new jobs for this search by email</h2><button class="css-yi9ndv e8ju0x51">Close</button></div>'
+
+def create_synthetic_page_html(job_uids, rng = random, include_ad = True, has_next_page = True, next_page_url = '#', include_popup = False):
+    '''Create the html for a full page of search results containing a listing for each job id provided, an ad, a next page button and optionally the email popup.'''
+    listings = [create_synthetic_listing_html(job_uid, rng) for job_uid in job_uids]
+    if include_ad:
+        listings.insert(len(listings) // 2, create_synthetic_ad_html())
+    next_button = f'<nav><a data-testid="pagination-page-next" href="{escape(next_page_url)}">Next</a></nav>' if has_next_page else '<nav></nav>'
+    popup = EMAIL_POPUP_HTML if include_popup else ''
+    return f'<html><head><title>Jobs</title></head><body><div id="mosaic-jobResults"><ul>{"".join(listings)}</ul></div>{next_button}{popup}</body></html>'
+
+def create_synthetic_pages(page_count, jobs_per_page = 15, seed = 0, start_number = 0):
+    '''Create a list of page html strings with unique job ids across all pages.'''
+    rng = random.Random(seed)
+    pages = []
+    for page in range(page_count):
+        first = start_number + page * jobs_per_page
+        job_uids = [create_synthetic_job_uid(number) for number in range(first, first + jobs_per_page)]
+        pages.append(create_synthetic_page_html(job_uids, rng, has_next_page = page < page_count - 1))
+    return pages
+
+
+def create_search_page_html(search_term, start, pages_per_search = 5, jobs_per_page = 15, job_number_offset = 0, popup_pages = ()):
+    '''
+    Create the results page a search for search_term would show at offset start (10 per page on Indeed).
+    Job ids come from a window that depends on the search term, so different search terms share some jobs the same way overlapping keywords do on the job board.
+    Lowering job_number_offset between crawls pushes that many new jobs onto the top of the results, like new postings on a date sorted search.
+    The email popup is shown over the page numbers (counting from 1) in popup_pages.
+    '''
+    page = start // 10
+    first = job_number_offset + zlib.crc32(search_term.encode()) % (jobs_per_page * pages_per_search) + page * jobs_per_page
+    job_uids = [create_synthetic_job_uid(number) for number in range(first, first + jobs_per_page)]
+    next_page_url = '/jobs?' + urlencode({'q': search_term, 'start': start + 10})
+    return create_synthetic_page_html(job_uids, random.Random(f'{search_term}-{page}'), has_next_page = page < pages_per_search - 1, next_page_url = next_page_url, 
+    include_popup = page + 1 in popup_pages)
+
+def start_fixture_server(pages_per_search = 5, jobs_per_page = 15, page_delay = 0.0, job_number_offset = 0, popup_pages = ()):
+    '''
+    Serve synthetic search result pages on a local port in place of the job board. page_delay adds a pause before each response to stand in for network and render time.
+    popup_pages are the page numbers the email popup is shown on.
+    Returns the server and its base url. Call server.shutdown() once finished.
+    '''
+    class FixtureRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/jobs':
+                self.send_error(404)
+                return
+            query = parse_qs(url.query)
+            html = create_search_page_html(query.get('q', [''])[0], int(query.get('start', ['0'])[0]), pages_per_search, jobs_per_page, job_number_offset, popup_pages)
+            time.sleep(page_delay)
+            body = html.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureRequestHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class FixtureElement:
+    '''Stand-in for a selenium WebElement that is always visible and runs on_click when clicked. Like a browser, clicks on anything outside the popup are intercepted while it shows.'''
+    def __init__(self, driver, on_click, in_popup = False):
+        self.driver = driver
+        self.on_click = on_click
+        self.in_popup = in_popup
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def click(self):
+        if EMAIL_POPUP_HTML in self.driver.page_source and not self.in_popup:
+            raise ex.ElementClickInterceptedException('email popup')
+        self.on_click()
+
+
+class FixtureSwitchTo:
+    '''Stand-in for driver.switch_to. The fixture pages have no frames, so there is nothing to switch between.'''
+    def frame(self, frame_reference):
+        pass
+
+    def default_content(self):
+        pass
+
+
+class FixtureDriver:
+    '''
+    Stand-in for the Firefox driver that fetches pages over plain http, so the crawler can run against the fixture server without a browser.
+    Only the next page button and the email popup heading and close button can be found. Everything else raises NoSuchElementException like a page without that element would.
+    PAGE_STATE_SCRIPT is answered from the page html. Any other script does nothing.
+    '''
+    NEXT_PAGE_PATTERN = re.compile(r'<a data-testid="pagination-page-next" href="([^"]*)"')
+    JOB_ID_PATTERN = re.compile(r'<a data-jk="([^"]*)"')
+
+    def __init__(self):
+        self.current_url = None
+        self.page_source = ''
+        self.switch_to = FixtureSwitchTo()
+
+    def get(self, url):
+        with urllib.request.urlopen(url) as response:
+            self.page_source = response.read().decode()
+        self.current_url = url
+
+    def execute_script(self, script, *args):
+        if script == PAGE_STATE_SCRIPT:
+            return {'job_ids': self.JOB_ID_PATTERN.findall(self.page_source), 'next_page': self.NEXT_PAGE_PATTERN.search(self.page_source) is not None, 
+            'popup': EMAIL_POPUP_HTML in self.page_source, 'cloudflare': False}
+        return None
+
+    def close_popup(self):
+        self.page_source = self.page_source.replace(EMAIL_POPUP_HTML, '')
+
+    def find_element(self, by, value):
+        next_page = self.NEXT_PAGE_PATTERN.search(self.page_source)
+        if value == NEXT_PAGE_XPATH and next_page:
+            return FixtureElement(self, partial(self.get, urljoin(self.current_url, next_page.group(1).replace('&amp;', '&'))))
+        if EMAIL_POPUP_HTML in self.page_source:
+            if value == '//*[@class="DesktopJobAlertPopup-heading"]':
+                return FixtureElement(self, lambda: None, in_popup = True)
+            if value == '//*[@class="css-yi9ndv e8ju0x51"]':
+                return FixtureElement(self, self.close_popup, in_popup = True)
+        raise ex.NoSuchElementException(value)
+
+    def close(self):
+        pass
+
+    def quit(self):
+        pass
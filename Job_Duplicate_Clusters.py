@@ -0,0 +1,204 @@
+import hashlib
+import re
+import sqlite3
+import unicodedata
+
+import pandas as pd
+
+
+DATABASE_PATH = 'JobData.db'
+#Jobs are fingerprinted on these columns, shingled into overlapping runs of SHINGLE_LENGTH characters once normalized
+FINGERPRINT_COLUMNS = ['job_title', 'company', 'location', 'salary_text']
+SHINGLE_LENGTH = 4
+#Minimum share of shingles in common (Jaccard similarity) for a candidate to be a near-duplicate, allowing for a different location or salary text.
+#Candidates must also have the same title words and company, so "Senior Data Analyst" isn't a repost of "Data Analyst" at the same company
+DUPLICATE_SIMILARITY = 0.5
+#New jobs are clustered this many at a time, to bound the memory held by their fingerprints
+CLUSTER_CHUNK_ROWS = 20_000
+
+#Jobs with the columns they're fingerprinted on, ie. the new jobs since the last update
+FINGERPRINT_QUERY = f""" SELECT t1.job_key, {', '.join(f"coalesce({column}, '')" for column in FINGERPRINT_COLUMNS)}
+FROM JobDetails t1 LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+WHERE t1.job_key {{condition}}
+ORDER BY t1.job_key
+"""
+
+
+def create_duplicate_tables(c):
+    '''
+    Create the JobClusters table, holding the near-duplicate cluster of every job. A cluster's key is the job_key of its first job, 
+    so a job with no near-duplicates is a cluster of its own with cluster_key = job_key. similarity is the Jaccard similarity of the job's fingerprint to its cluster's first job 
+    and role_hash a hash of its title words and company. Only the first job of each cluster is indexed by role_hash, since those are the only jobs new jobs are compared to.
+    JobClusters tables from before role_hash, and their JobBuckets LSH index, are dropped to be clustered again since they only hold derived rows.
+    '''
+    if c.execute("SELECT 1 FROM pragma_table_info('JobClusters') WHERE name = 'text_hash'").fetchone():
+        c.execute('DROP TABLE JobClusters')
+    c.execute('DROP TABLE IF EXISTS JobBuckets')
+    c.execute(""" CREATE TABLE IF NOT EXISTS JobClusters(
+        job_key integer not null,
+        cluster_key integer not null,
+        similarity real not null,
+        role_hash integer not null,
+
+        CONSTRAINT PK_JobClusters PRIMARY KEY (job_key),
+        CONSTRAINT FK_JobClusters_job_key FOREIGN KEY (job_key) REFERENCES JobRecords (job_key)
+    )
+    """)
+    c.execute('CREATE INDEX IF NOT EXISTS IX_JobClusters_role_hash ON JobClusters (role_hash) WHERE cluster_key = job_key')
+
+def normalize_text(text):
+    '''Lowercase, fold accents and reduce text to its letters and digits separated by single spaces, so punctuation and spacing don't change a fingerprint.'''
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+def get_shingles(text, length = SHINGLE_LENGTH):
+    '''Split text into its overlapping runs of length characters. Text shorter than that is a single shingle.'''
+    return {text[i:i + length] for i in range(max(len(text) - length + 1, 1))}
+
+def get_fingerprint(row):
+    '''
+    Build the fingerprint of a (job_title, company, location, salary_text) row: the shingles of its normalized text, the set of words in its title and its normalized company.
+    '''
+    fields = [normalize_text(value) for value in row]
+    return get_shingles(' '.join(fields)), frozenset(fields[0].split()), fields[1]
+
+def get_role_hash(fingerprint):
+    '''
+    Hash a fingerprint's title words and company into a 31 bit integer, so sqlite stores it in 4 bytes. 
+    Two roles rarely sharing a hash only adds a candidate that fails the similarity check.
+    '''
+    _, title_words, company = fingerprint
+    return int.from_bytes(hashlib.blake2b(f'{" ".join(sorted(title_words))}|{company}'.encode(), digest_size = 4).digest(), 'big') >> 1
+
+def get_jaccard_similarity(a, b):
+    '''Share of the elements of two sets that are in both.'''
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def get_fingerprint_similarity(fingerprint, other):
+    '''Jaccard similarity of two fingerprints' shingles if they are near-duplicates, or None if not.'''
+    shingles, title_words, company = fingerprint
+    if title_words != other[1] or company != other[2]:
+        return None
+    similarity = get_jaccard_similarity(shingles, other[0])
+    return similarity if similarity >= DUPLICATE_SIMILARITY else None
+
+def update_duplicate_clusters(c, chunk_size = CLUSTER_CHUNK_ROWS):
+    '''
+    Assign the jobs inserted since the last update to near-duplicate clusters, chunk_size jobs at a time. See cluster_new_jobs.
+    Must be called inside a transaction. Kept out of the insert transactions, since fingerprinting costs more than the inserts themselves. Returns the number of new jobs that were near-duplicates.
+    '''
+    last_job_key = c.execute('SELECT coalesce(max(job_key), 0) FROM JobClusters').fetchone()[0]
+    duplicates = 0
+    while True:
+        rows = c.execute(FINGERPRINT_QUERY.format(condition = '> ?') + 'LIMIT ?', (last_job_key, chunk_size)).fetchall()
+        if not rows:
+            break
+        duplicates += cluster_new_jobs(c, rows)
+        last_job_key = rows[-1][0]
+    return duplicates
+
+def cluster_new_jobs(c, rows):
+    '''
+    Assign new (job_key, job_title, company, location, salary_text) rows to near-duplicate clusters. Each job joins the cluster of the most similar earlier job 
+    that starts a cluster with the same title words and company, or starts a new cluster of its own.
+    Only the new jobs are fingerprinted, and their candidates are looked up by role_hash, so the cost depends on the number of new jobs rather than the size of the database.
+    Returns the number of new jobs that were near-duplicates.
+    '''
+    #Reposts are often identical, so each distinct row is fingerprinted and compared once
+    row_indexes = {}
+    for row in rows:
+        row_indexes.setdefault(row[1:], len(row_indexes))
+    fingerprints = [get_fingerprint(row) for row in row_indexes]
+    role_hashes = [get_role_hash(fingerprint) for fingerprint in fingerprints]
+
+    #Stored clusters of the same roles as the new rows
+    c.execute('DROP TABLE IF EXISTS temp.NewJobRoles')
+    c.execute('CREATE TEMP TABLE NewJobRoles (role_hash integer primary key)')
+    c.executemany('INSERT OR IGNORE INTO temp.NewJobRoles VALUES (?)', ((role_hash,) for role_hash in role_hashes))
+    role_clusters = {}
+    for cluster_key, role_hash in c.execute(""" SELECT t2.job_key, t2.role_hash
+    FROM temp.NewJobRoles t1 INNER JOIN JobClusters t2 ON t2.role_hash = t1.role_hash AND t2.cluster_key = t2.job_key
+    ORDER BY t2.job_key
+    """):
+        role_clusters.setdefault(role_hash, []).append(cluster_key)
+    c.execute('DROP TABLE temp.NewJobRoles')
+    candidate_keys = [cluster_key for cluster_keys in role_clusters.values() for cluster_key in cluster_keys]
+    cluster_fingerprints = {}
+    for start in range(0, len(candidate_keys), 500):
+        batch = candidate_keys[start:start + 500]
+        for row in c.execute(FINGERPRINT_QUERY.format(condition = f'IN ({", ".join("?" * len(batch))})'), batch):
+            cluster_fingerprints[row[0]] = get_fingerprint(row[1:])
+
+    #New jobs are compared in order, so a job can also join a cluster started earlier in the same insert
+    assigned_rows = {}
+    cluster_rows = []
+    for row in rows:
+        job_key, row_index = row[0], row_indexes[row[1:]]
+        if row_index not in assigned_rows:
+            best_key, best_similarity = None, 0
+            for cluster_key in role_clusters.get(role_hashes[row_index], ()):
+                similarity = get_fingerprint_similarity(fingerprints[row_index], cluster_fingerprints[cluster_key])
+                if similarity is not None and similarity > best_similarity:
+                    best_key, best_similarity = cluster_key, similarity
+            if best_key is not None:
+                assigned_rows[row_index] = (best_key, best_similarity)
+            else:
+                assigned_rows[row_index] = (job_key, 1.0)
+                cluster_fingerprints[job_key] = fingerprints[row_index]
+                role_clusters.setdefault(role_hashes[row_index], []).append(job_key)
+        cluster_rows.append((job_key, *assigned_rows[row_index], role_hashes[row_index]))
+
+    c.executemany('INSERT INTO JobClusters VALUES (?, ?, ?, ?)', cluster_rows)
+    return sum(job_key != cluster_key for job_key, cluster_key, _, _ in cluster_rows)
+
+def refresh_duplicate_clusters(database = DATABASE_PATH):
+    '''Cluster the jobs inserted since the last update in one transaction, ie. once a crawl is written. Returns the number of new jobs that were near-duplicates.'''
+    conn = sqlite3.connect(database)
+    with conn:
+        duplicates = update_duplicate_clusters(conn)
+    conn.close()
+    return duplicates
+
+def rebuild_duplicate_clusters(database = DATABASE_PATH):
+    '''Recluster every job from scratch, ie. after changing the fingerprint or similarity settings.'''
+    conn = sqlite3.connect(database)
+    with conn:
+        create_duplicate_tables(conn)
+        conn.execute('DELETE FROM JobClusters')
+        duplicates = update_duplicate_clusters(conn)
+    conn.close()
+    return duplicates
+
+def count_unique_roles(group_by = ('keyword',), database = DATABASE_PATH):
+    '''
+    Count the jobs and the unique roles (near-duplicate clusters) in each group of group_by, which can hold keyword and any of the Jobs columns, ie. ('keyword', 'jurisdiction').
+    Without keyword every job is counted once, whichever keywords it was found under. Only reads the database, so jobs not yet clustered 
+    (ie. written outside get_indeed_job_data and before refresh_duplicate_clusters is run) are left out.
+    '''
+    group_columns = ', '.join(f't3.{column}' if column == 'keyword' else f't1.{column}' for column in group_by)
+    keyword_join = 'INNER JOIN KeywordRefDetails t3 ON t3.job_key = t1.job_key' if 'keyword' in group_by else ''
+    conn = sqlite3.connect(database)
+    try:
+        return pd.read_sql(f""" SELECT {group_columns}, count(*) AS job_count, count(DISTINCT t2.cluster_key) AS role_count
+        FROM JobDetails t1 INNER JOIN JobClusters t2 ON t2.job_key = t1.job_key {keyword_join}
+        GROUP BY {group_columns}
+        """, conn, index_col = list(group_by))
+    finally:
+        conn.close()
+
+def get_duplicate_clusters(database = DATABASE_PATH, min_size = 2):
+    '''Return the jobs of every cluster with at least min_size jobs, along with each job's similarity to the first job of its cluster, for checking what was grouped.'''
+    conn = sqlite3.connect(database)
+    try:
+        return pd.read_sql(f""" SELECT t2.cluster_key, t1.id, {', '.join(FINGERPRINT_COLUMNS)}, t1.date_recorded, t2.similarity
+        FROM JobClusters t2 INNER JOIN JobDetails t1 ON t1.job_key = t2.job_key LEFT JOIN SalaryRecords t3 ON t3.job_key = t1.job_key
+        WHERE t2.cluster_key IN (SELECT cluster_key FROM JobClusters GROUP BY cluster_key HAVING count(*) >= ?)
+        ORDER BY t2.cluster_key, t2.job_key
+        """, conn, params = (min_size,), index_col = ['cluster_key', 'id'])
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print(count_unique_roles())
+    print(get_duplicate_clusters().head(20))
@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from Database_Connections import get_database_connection
+
+
+PAGE_CACHE_DIRECTORY = 'Page_Cache'
+PAGE_CACHE_MAX_AGE_DAYS = 30
+PAGE_CACHE_MAX_BYTES = 1024 ** 3
+
+
+def connect_to_page_cache(cache_directory):
+    '''
+    Open the index of the page cache, creating the cache directory and index table if needed. 
+    The index maps a (search term, location, page, date) key to the sha256 hash of the page html. The html itself is stored gzipped once per hash under objects/.
+    '''
+    os.makedirs(os.path.join(cache_directory, 'objects'), exist_ok = True)
+    conn = get_database_connection(os.path.join(cache_directory, 'index.db'))
+    conn.execute(""" CREATE TABLE IF NOT EXISTS CachedPages(
+        search_term text not null,
+        search_location text not null,
+        page integer not null,
+        date_recorded text not null,
+        content_hash text not null,
+        compressed_size integer not null,
+
+        CONSTRAINT PK_CachedPages PRIMARY KEY (search_term, search_location, page, date_recorded)
+    )
+    """)
+    return conn
+
+def get_cached_page_path(cache_directory, content_hash):
+    '''Path of the gzipped html for a content hash. Files are spread over subfolders by the first two characters of the hash.'''
+    return os.path.join(cache_directory, 'objects', content_hash[:2], f'{content_hash}.html.gz')
+
+def store_page_in_cache(page_source, search_term, search_location, page, date_recorded, cache_directory = PAGE_CACHE_DIRECTORY):
+    '''Save the html of a fetched page to the cache. Identical pages are only written to disk once since the file name is the hash of the html.'''
+    page_bytes = page_source.encode('utf-8')
+    content_hash = hashlib.sha256(page_bytes).hexdigest()
+    path = get_cached_page_path(cache_directory, content_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        temporary_path = f'{path}.{threading.get_ident()}.tmp'
+        with gzip.open(temporary_path, 'wb') as file:
+            file.write(page_bytes)
+        os.replace(temporary_path, path)
+
+    conn = connect_to_page_cache(cache_directory)
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO CachedPages VALUES (?, ?, ?, ?, ?, ?)', (search_term, search_location, page, date_recorded, content_hash, os.path.getsize(path)))
+    return content_hash
+
+def cache_webpage_sources(page_sources, search_term, search_location, cache_directory = PAGE_CACHE_DIRECTORY):
+    '''Pass through the pages from crawl_webpage_sources, saving each one to the cache on the way.'''
+    for page, page_source, wait_seconds, date_recorded in page_sources:
+        store_page_in_cache(page_source, search_term, search_location, page, date_recorded, cache_directory)
+        yield page, page_source, wait_seconds, date_recorded
+
+def read_webpage_sources_from_cache(search_term, search_location, page_limit = 100, cache_directory = PAGE_CACHE_DIRECTORY, dates = None):
+    '''
+    Yield the cached pages for a search in the same form as crawl_webpage_sources, oldest date first, so a crawl can be replayed without a browser.
+    dates limits the replay to a list of 'YYYY-MM-DD' dates, otherwise every date in the cache is used.
+    '''
+    conn = connect_to_page_cache(cache_directory)
+    cached_pages = conn.execute('SELECT page, date_recorded, content_hash FROM CachedPages WHERE search_term = ? AND search_location = ? AND page <= ? ORDER BY date_recorded, page', 
+    (search_term, search_location, page_limit)).fetchall()
+
+    for page, date_recorded, content_hash in cached_pages:
+        if dates is not None and date_recorded not in dates:
+            continue
+        start = time.perf_counter()
+        with gzip.open(get_cached_page_path(cache_directory, content_hash), 'rb') as file:
+            page_source = file.read().decode('utf-8')
+        yield page, page_source, time.perf_counter() - start, date_recorded
+
+def evict_page_cache(cache_directory = PAGE_CACHE_DIRECTORY, max_age_days = PAGE_CACHE_MAX_AGE_DAYS, max_bytes = PAGE_CACHE_MAX_BYTES):
+    '''
+    Remove cached pages recorded more than max_age_days ago, then remove the oldest dates until the cache is no larger than max_bytes. 
+    Either limit can be None to skip it. Page files no longer referenced by the index are deleted. Returns the number of files deleted.
+    '''
+    conn = connect_to_page_cache(cache_directory)
+    with conn:
+        if max_age_days is not None:
+            cutoff = (datetime.today() - timedelta(days = max_age_days)).strftime('%Y-%m-%d')
+            conn.execute('DELETE FROM CachedPages WHERE date_recorded < ?', (cutoff,))
+        if max_bytes is not None:
+            date_sizes = conn.execute('''SELECT date_recorded, sum(compressed_size) FROM (SELECT DISTINCT date_recorded, content_hash, compressed_size FROM CachedPages) 
+            GROUP BY date_recorded ORDER BY date_recorded''').fetchall()
+            total_bytes = sum(size for _, size in date_sizes)
+            for date_recorded, size in date_sizes:
+                if total_bytes <= max_bytes:
+                    break
+                conn.execute('DELETE FROM CachedPages WHERE date_recorded = ?', (date_recorded,))
+                total_bytes -= size
+        referenced_hashes = {row[0] for row in conn.execute('SELECT DISTINCT content_hash FROM CachedPages')}
+
+    deleted_files = 0
+    for folder, _, file_names in os.walk(os.path.join(cache_directory, 'objects')):
+        for file_name in file_names:
+            if file_name.split('.')[0] not in referenced_hashes:
+                os.remove(os.path.join(folder, file_name))
+                deleted_files += 1
+    return deleted_files
@@ -0,0 +1,119 @@
+import sqlite3
+
+import pandas as pd
+
+
+DATABASE_PATH = 'JobData.db'
+SEARCH_COLUMNS = ['job_title', 'company']
+
+#Example taxonomy for save_job_tags, each tag matching any of its phrases. A trailing * matches any word starting with the phrase
+SENIORITY_TAGS = {'Senior': ['senior', 'sr', 'lead', 'principal', 'staff'], 'Junior': ['junior', 'jr', 'entry level', 'associate', 'intern*'], 'Manager': ['manager', 'director', 'head of']}
+TOOL_TAGS = {'Power BI': ['power bi', 'powerbi'], 'Tableau': ['tableau'], 'SQL': ['sql', 'sql server', 't-sql'], 'Python': ['python']}
+
+
+def create_search_index(c):
+    '''
+    Create the JobSearch full text index over the job titles and companies, and the JobTags table save_job_tags writes to.
+    The index reads the text from the JobSearchText view (an external content table), so only the index itself is stored. Accents are folded so "Montréal" matches "montreal".
+    '''
+    c.execute(""" CREATE VIEW IF NOT EXISTS JobSearchText AS
+    SELECT t1.job_key, t1.job_title, t2.company FROM JobRecords t1 INNER JOIN Companies t2 ON t2.company_key = t1.company_key
+    """)
+    c.execute(f""" CREATE VIRTUAL TABLE IF NOT EXISTS JobSearch USING fts5(
+        {', '.join(SEARCH_COLUMNS)}, content = 'JobSearchText', content_rowid = 'job_key', tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS JobTags(
+        job_key integer not null,
+        taxonomy text not null,
+        tag text not null,
+
+        CONSTRAINT PK_JobTags PRIMARY KEY (taxonomy, tag, job_key),
+        CONSTRAINT FK_JobTags_job_key FOREIGN KEY (job_key) REFERENCES JobRecords (job_key)
+    )
+    """)
+
+def update_search_index(c):
+    '''
+    Add the jobs inserted since the last update to the JobSearch index. Jobs are only ever added, so the jobs not yet indexed are the ones past the highest job_key in the index.
+    Called inside the transaction that inserts the rows, the same as update_summary_tables.
+    '''
+    #JobSearch_docsize holds a row per indexed job. max(rowid) on JobSearch itself would read JobSearchText, since the text lives there
+    c.execute(f""" INSERT INTO JobSearch (rowid, {', '.join(SEARCH_COLUMNS)})
+    SELECT job_key, {', '.join(SEARCH_COLUMNS)} FROM JobSearchText WHERE job_key > (SELECT coalesce(max(id), 0) FROM JobSearch_docsize)
+    """)
+
+def rebuild_search_index(database = DATABASE_PATH):
+    '''Re-index every job from scratch, ie. after existing jobs were updated or deleted.'''
+    conn = sqlite3.connect(database)
+    with conn:
+        create_search_index(conn)
+        conn.execute("INSERT INTO JobSearch (JobSearch) VALUES ('rebuild')")
+    conn.close()
+
+def get_match_expression(phrases, columns = None):
+    '''
+    Build an FTS5 query matching any of the phrases, each matched as a whole run of words (so "power bi" doesn't match "power platform, bi").
+    A phrase ending in * matches any word starting with its last word. columns limits the match to some of the SEARCH_COLUMNS, both by default.
+    '''
+    terms = []
+    for phrase in phrases:
+        prefix = phrase.endswith('*')
+        phrase = phrase.rstrip('*').replace('"', '""')
+        terms.append(f'"{phrase}"' + ('*' if prefix else ''))
+    expression = ' OR '.join(terms)
+    if columns is not None:
+        expression = f'{{{" ".join(columns)}}} : ({expression})'
+    return expression
+
+def search_jobs(phrases, database = DATABASE_PATH, columns = None):
+    '''Return the jobs whose title or company (or only the columns given) contain any of the phrases, best matches first, using the JobSearch index.'''
+    conn = sqlite3.connect(database)
+    try:
+        return pd.read_sql(""" SELECT t1.id, t1.job_title, t1.company, t1.location, t1.date_recorded
+        FROM JobSearch INNER JOIN JobDetails t1 ON t1.job_key = JobSearch.rowid
+        WHERE JobSearch MATCH ?
+        ORDER BY JobSearch.rank
+        """, conn, params = (get_match_expression(phrases, columns),), index_col = 'id')
+    finally:
+        conn.close()
+
+def get_tag_query(keyword_sets, columns = None):
+    '''Build a query returning a (job_key, id, tag) row for each job matching each tag in keyword_sets, a dict of tag to phrases, along with its parameters.'''
+    tag_queries = ' UNION ALL '.join(['SELECT t1.job_key, t1.id, ? AS tag FROM JobSearch INNER JOIN JobRecords t1 ON t1.job_key = JobSearch.rowid WHERE JobSearch MATCH ?'] * len(keyword_sets))
+    params = [param for tag, phrases in keyword_sets.items() for param in (tag, get_match_expression(phrases, columns))]
+    return tag_queries, params
+
+def tag_jobs(keyword_sets, database = DATABASE_PATH, columns = None):
+    '''
+    Classify every job in the database into the tags of keyword_sets, a dict of tag to the phrases that mark a job with it (ie. SENIORITY_TAGS), through the JobSearch index.
+    Returns a dataframe with a row per (job, tag) pair, indexed the same way as KeywordRef so it can be joined onto the jobs in place of the search term keyword.
+    '''
+    tag_query, params = get_tag_query(keyword_sets, columns)
+    conn = sqlite3.connect(database)
+    try:
+        return pd.read_sql(tag_query, conn, params = params, index_col = 'id').drop(columns = 'job_key')
+    finally:
+        conn.close()
+
+def save_job_tags(taxonomy, keyword_sets, database = DATABASE_PATH, columns = None):
+    '''
+    Replace the tags of a taxonomy in the JobTags table with the tags of keyword_sets applied to every job in the database, in a single transaction.
+    Re-tagging under a changed taxonomy only reads the index, so no pages need to be scraped again. Jobs added later aren't tagged until it's run again. 
+    Returns the number of (job, tag) rows saved.
+    '''
+    tag_query, params = get_tag_query(keyword_sets, columns)
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            create_search_index(conn)
+            conn.execute('DELETE FROM JobTags WHERE taxonomy = ?', (taxonomy,))
+            return conn.execute(f'INSERT OR IGNORE INTO JobTags (job_key, taxonomy, tag) SELECT job_key, ?, tag FROM ({tag_query})', [taxonomy, *params]).rowcount
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print(f"Jobs tagged by seniority: {save_job_tags('seniority', SENIORITY_TAGS)}")
+    print(f"Jobs tagged by tool: {save_job_tags('tool', TOOL_TAGS)}")
@@ -3,84 +3,214 @@ from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.firefox.options import Options
 
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 import selenium.common.exceptions as ex
 
+import io
+import queue
+import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 
 from bs4 import BeautifulSoup
+from lxml import etree
 
 import numpy as np
 import pandas as pd
 
 import sqlite3
-import sqlalchemy
+
+from Crawl_Metrics import CrawlMetrics, find_yield_drops
+from Crawl_Wait_Scheduler import WaitScheduler
+from Database_Connections import close_database_connections, get_database_connection
+from Export_Analytics_Snapshot import SNAPSHOT_DIRECTORY, export_analytics_snapshot, mark_snapshot_for_rebuild
+from Fetch_Pages_By_Url import INDEED_BASE_URL, fetch_webpage_sources_by_url, get_search_url
+from Job_Duplicate_Clusters import rebuild_duplicate_clusters, refresh_duplicate_clusters
+from Job_Page_Cache import cache_webpage_sources, evict_page_cache, read_webpage_sources_from_cache
+from Job_Text_Search import rebuild_search_index, update_search_index
+from Maintain_Summary_Tables import rebuild_summary_tables, update_summary_tables
+from Normalize_Job_Tables import insert_normalized_rows, update_normalized_rows
+
+
+DATABASE_PATH = 'JobData.db'
+
+JOB_COLUMNS = ['id', 'job_title', 'company', 'location', 'rating_provided', 'rating', 'salary_provided', 'salary_text', 'weblink', 'date_recorded']
+KEYWORD_COLUMNS = ['id', 'keyword']
+TABLE_NAMES = {'job': 'Jobs', 'keyword': 'KeywordRef', 'salary': 'Salaries'}
+#Kept below the 999 variable limit of older sqlite versions
+ID_LOOKUP_BATCH_SIZE = 500
+LISTING_CLASS = 'css-5lfssm eu4oa1w0'
+
+NEXT_PAGE_XPATH = '//*[@data-testid="pagination-page-next"]'
+#Reads everything the crawler needs to know about the page in one round trip to the browser
+PAGE_STATE_SCRIPT = '''
+return {
+    'job_ids': Array.from(document.querySelectorAll('a[data-jk]'), link => link.getAttribute('data-jk')),
+    'next_page': document.querySelector('[data-testid="pagination-page-next"]') !== null,
+    'popup': document.querySelector('.DesktopJobAlertPopup-heading') !== null,
+    'cloudflare': document.querySelector('iframe[title="Widget containing a Cloudflare security challenge"]') !== null
+};
+'''
 
 
 def create_initial_empty_df(df_type):
     '''Create empty dataframes to append new jobs and keywords data to.'''
 
     if df_type == 'job':
-        return pd.DataFrame(columns=['id', 'job_title', 'company', 'location', 'rating_provided', 'rating', 'salary_provided', 'salary_text', 'weblink', 'date_recorded']).set_index('id')
+        return pd.DataFrame(columns=JOB_COLUMNS).set_index('id')
     if df_type == 'keyword':
-        return pd.DataFrame(columns=['id', 'keyword']).set_index('id')
+        return pd.DataFrame(columns=KEYWORD_COLUMNS).set_index('id')
+
+def create_record_buffer():
+    '''
+    Create an empty buffer to collect parsed rows as plain tuples. The buffer is a list of rows and a set of the ids already in it, so duplicates are skipped with a hash lookup.
+    Rows are only converted into a pandas dataframe once the crawl is done rather than concatenating a one row dataframe for every listing.
+    '''
+    return [], set()
 
-def get_searchable_dict(dict_type, search_term = None):
-    '''Create a dictionary with the existing values from SQL as the keys. Used to do hash lookups to ensure only unique values are inserted back into the database.'''
-    engine = sqlalchemy.create_engine('sqlite:///JobData.db')
-    if dict_type == 'job':
-        return pd.read_sql('SELECT id, row_number() OVER () AS row_num FROM Jobs', engine, index_col= 'id')['row_num'].to_dict()
-    if dict_type == 'keyword':
-        return pd.read_sql(f"SELECT id, row_number() OVER () AS row_num FROM KeywordRef WHERE keyword = '{search_term}'", engine, index_col= 'id')['row_num'].to_dict()
+def add_record_to_buffer(buffer, record):
+    '''Add a row tuple to the buffer if its id (first element) is not already in it. Returns True if the row was added.'''
+    rows, ids = buffer
+    if record[0] in ids:
+        return False
+    ids.add(record[0])
+    rows.append(record)
+    return True
+
+def convert_record_buffer_to_df(buffer, df_type):
+    '''Build a dataframe from all rows collected in the buffer in a single call.'''
+    rows, _ = buffer
+    if not rows:
+        return create_initial_empty_df(df_type)
+    if df_type == 'job':
+        return pd.DataFrame.from_records(rows, columns=JOB_COLUMNS).set_index('id')
+    if df_type == 'keyword':
+        return pd.DataFrame.from_records(rows, columns=KEYWORD_COLUMNS).set_index('id')
+
+def select_existing_ids(query, ids, params = (), database = DATABASE_PATH):
+    '''Run a query ending in "id IN ({})" for the ids given in batches of ID_LOOKUP_BATCH_SIZE and return the set of ids it finds.'''
+    conn = get_database_connection(database)
+    ids = list(dict.fromkeys(ids))
+    existing_ids = set()
+    for start in range(0, len(ids), ID_LOOKUP_BATCH_SIZE):
+        batch = ids[start:start + ID_LOOKUP_BATCH_SIZE]
+        existing_ids.update(row[0] for row in conn.execute(query.format(', '.join('?' * len(batch))), (*params, *batch)))
+    return existing_ids
+
+def get_existing_job_ids(job_ids, database = DATABASE_PATH):
+    '''
+    Return the job ids given that already exist in the Jobs table. Used to ensure only unique values are inserted back into the database. 
+    Only the ids on hand are looked up through the primary key index, so memory and time don't grow with the size of the table.
+    '''
+    return select_existing_ids('SELECT id FROM Jobs WHERE id IN ({})', job_ids, database = database)
 
+def get_existing_keyword_ids(job_ids, search_term, database = DATABASE_PATH):
+    '''Return the job ids given that already exist in the KeywordRef table for the search term.'''
+    return select_existing_ids('SELECT id FROM KeywordRef WHERE keyword = ? AND id IN ({})', job_ids, (search_term,), database)
 
 def create_firefox_driver(headless = False):
     '''Open Firefox webpage usable by program to navigate to webpages.'''
     options = Options()
-    options.headless = headless
+    if headless:
+        options.add_argument('-headless')
     driver = webdriver.Firefox(options = options)
     return driver
 
-def click_to_next_page(driver):
-    '''Click the next page button, moving to the next page of jobs.'''
+def get_page_state(driver):
+    '''Read the job ids of the listings and whether the next page button, the email popup and a cloudflare check are on the page, in a single script call.'''
+    return driver.execute_script(PAGE_STATE_SCRIPT)
+
+def wait_for_new_listings(driver, wait_scheduler, previous_job_ids = ()):
+    '''Wait for listings with job ids other than previous_job_ids to show, which is when navigating to a page has finished. Returns the state of the new page, or None on timeout.'''
+    previous_job_ids = list(previous_job_ids)
+    def listings_changed(driver):
+        page_state = get_page_state(driver)
+        return page_state if page_state['job_ids'] and page_state['job_ids'] != previous_job_ids else False
+    return wait_scheduler.wait(driver, 'page_load', listings_changed)
+
+def wait_for_page_controls(driver, wait_scheduler):
+    '''
+    Wait for the next page button, the email popup or a cloudflare check to show, whichever comes first, and return the page state. 
+    Returns None if none of them show before the timeout, which means this is the last page.
+    '''
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);") #Scroll to bottom required to load next page button on webpage
+    def controls_showing(driver):
+        page_state = get_page_state(driver)
+        return page_state if page_state['next_page'] or page_state['popup'] or page_state['cloudflare'] else False
+    return wait_scheduler.wait(driver, 'page_controls', controls_showing)
+
+def click_to_next_page(driver, wait_scheduler, job_ids):
+    '''Click the next page button, moving to the next page of jobs. Returns the state of the new page once its listings show, or None if the click or the page load failed.'''
     try:
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);") #Scroll to bottom required to load next page button on webpage
-        WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, '//*[@data-testid="pagination-page-next"]'))).click()
-        return True
-    except (ex.TimeoutException, ex.ElementClickInterceptedException):
-        return False
+        driver.find_element(By.XPATH, NEXT_PAGE_XPATH).click()
+    except (ex.NoSuchElementException, ex.ElementClickInterceptedException, ex.ElementNotInteractableException):
+        return None
+    return wait_for_new_listings(driver, wait_scheduler, job_ids)
 
-def close_email_popup(driver):
+def close_email_popup(driver, wait_scheduler):
     '''Clears email popup if prompted on indeed during web scrape.'''
     try:
-        WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, '//*[@class="DesktopJobAlertPopup-heading"]'))).click()
-        WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, '//*[@class="css-yi9ndv e8ju0x51"]'))).click()
-        return True
-    except ex.TimeoutException:
-        print('failed clicking next button')
+        driver.find_element(By.XPATH, '//*[@class="DesktopJobAlertPopup-heading"]').click()
+    except (ex.NoSuchElementException, ex.ElementClickInterceptedException, ex.ElementNotInteractableException):
         return False
+    close_button = wait_scheduler.wait(driver, 'popup', EC.element_to_be_clickable((By.XPATH, '//*[@class="css-yi9ndv e8ju0x51"]')))
+    if close_button is None:
+        print('failed closing email popup')
+        return False
+    close_button.click()
+    return True
 
-def bypass_cloudflare_check(driver):
-    '''In rare instances, a cloudflare check comes up on Indeed. This will bypass the cloudflare check if it comes up.'''
-    try:
-        WebDriverWait(driver, 20).until(EC.frame_to_be_available_and_switch_to_it((By.XPATH,"//iframe[@title='Widget containing a Cloudflare security challenge']")))
-        WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.XPATH, "//label[@class='ctp-checkbox-label']"))).click()
-        time.sleep(10)
-        return True
-    except ex.TimeoutException:
+def bypass_cloudflare_check(driver, wait_scheduler):
+    '''In rare instances, a cloudflare check comes up on Indeed. This will bypass the cloudflare check and wait for it to clear.'''
+    if not wait_scheduler.wait(driver, 'cloudflare', EC.frame_to_be_available_and_switch_to_it((By.XPATH,"//iframe[@title='Widget containing a Cloudflare security challenge']"))):
+        return False
+    checkbox = wait_scheduler.wait(driver, 'cloudflare', EC.element_to_be_clickable((By.XPATH, "//label[@class='ctp-checkbox-label']")))
+    if checkbox is not None:
+        checkbox.click()
+    driver.switch_to.default_content()
+    if checkbox is None:
         return False
+    return wait_scheduler.wait(driver, 'cloudflare_clear', lambda driver: not get_page_state(driver)['cloudflare']) is not None
+
+def go_to_next_page(driver, wait_scheduler, job_ids, max_attempts = 3):
+    '''
+    Move to the next page of jobs. A single wait tells the next page button, the email popup and a cloudflare check apart, 
+    so the popup and the check are only dealt with when they show and the last page is found after one timeout. 
+    job_ids are the ids on the current page, used to tell when the next page has loaded.
+    Returns the state of the new page, or None on the last page.
+    '''
+    for _ in range(max_attempts):
+        page_state = wait_for_page_controls(driver, wait_scheduler)
+        if page_state is None:
+            return None
+        if page_state['job_ids'] and page_state['job_ids'] != list(job_ids):
+            return page_state #An earlier click finished loading after its wait ran out
+        if page_state['cloudflare']:
+            bypass_cloudflare_check(driver, wait_scheduler)
+        elif page_state['popup']:
+            close_email_popup(driver, wait_scheduler)
+        else:
+            new_page_state = click_to_next_page(driver, wait_scheduler, job_ids)
+            if new_page_state is not None:
+                return new_page_state
+    return None
 
 def parse_webpage_html(driver):
     '''
     Parse the page to extract the html code blocks related to the listings on the left side of the webpage. 
     Creates a list with each element in the list containing the information for each listing.
     '''
-    source = driver.page_source
+    return parse_page_source_html(driver.page_source)
+
+def parse_page_source_html(source):
+    '''Parse the html source of a page into the list of listings. Split from parse_webpage_html so pages can be parsed away from the driver.'''
     soup = BeautifulSoup(source, 'lxml')
-    job_list = soup.find_all('li', class_ = 'css-5lfssm eu4oa1w0')
+    job_list = soup.find_all('li', class_ = LISTING_CLASS)
     return job_list
 
 
@@ -131,7 +261,7 @@ def get_job_salary(job):
 
 def get_job_url(job_uid):
     '''Parse out job webpage url from html string'''
-    return f'https://ca.indeed.com/viewjob?jk={job_uid}'
+    return f'{INDEED_BASE_URL}/viewjob?jk={job_uid}'
 
 def get_current_str_date():
     return datetime.today().strftime('%Y-%m-%d')
@@ -139,7 +269,7 @@ def get_current_str_date():
 def get_job_attrs(job, job_id_dict):
     '''
     Accept html section of code relating to a single job and a reference dictionary of job id's from the Jobs database. 
-    Ensures job found has a unique job id and, if so, parses out necessary elements of the job and populates into a pandas dataframe row. This is the main return value.
+    Ensures job found has a unique job id and, if so, parses out necessary elements of the job and returns them as a tuple ordered as JOB_COLUMNS. This is the main return value.
     If element does not have a job id or it's a duplicate of an existing one, a Null value is returned which will skip that element.
     '''
     if job_is_ad(job):
@@ -157,16 +287,12 @@ def get_job_attrs(job, job_id_dict):
     job_url = get_job_url(job_uid)
     date_recorded = get_current_str_date()
 
-    new_row = {'id': job_uid, 'job_title': job_title, 'company': company, 'location': location, 'rating_provided': rating_provided, 'rating': rating,
-    'salary_provided': salary_provided, 'salary_text': salary, 'weblink': job_url, 'date_recorded': date_recorded}
-    row_to_add = pd.DataFrame(new_row, index = [0]).set_index('id')
-
-    return row_to_add
+    return (job_uid, job_title, company, location, rating_provided, rating, salary_provided, salary, job_url, date_recorded)
 
 def get_keyword_attrs(job, keyword_id_dict, search_term):
     '''
     Accept html section of code relating to a single job, a reference dictionary of job id's and keyword in the keyword database, and the search term used for the current job found.
-    Ensures job and keyword combination found is unique and, if so, populates the job id and keyword into a pandas dataframe row. This is the return value. 
+    Ensures job and keyword combination found is unique and, if so, returns the job id and keyword as a tuple. This is the return value. 
     If element does not have a job id or it's a duplicate of an existing one, a Null value is returned which will skip that element. 
     ''' 
     if job_is_ad(job):
@@ -176,236 +302,363 @@ def get_keyword_attrs(job, keyword_id_dict, search_term):
     if job_uid is None:
         return None
 
-    new_row = {'id': job_uid, 'keyword': search_term}
-    row_to_add = pd.DataFrame(new_row, index = [0]).set_index('id')
-
-    return row_to_add
+    return (job_uid, search_term)
 
-def append_single_webpage_of_job_info_to_dfs(job_list, job_df, job_id_dict, keyword_df, keyword_id_dict, search_term):
+def append_single_webpage_of_job_info_to_buffers(job_list, job_buffer, job_id_dict, keyword_buffer, keyword_id_dict, search_term):
     '''
     Loops through each listing in list provided. For each listing, calls functions to ensure listing is a job and if so, extract the relevant features provided for the job. 
-    Returns this information as a pandas dataframe. Returns information for both job and keyword dataframes. 
+    The rows are added to the job and keyword record buffers, skipping any id already collected earlier in the crawl.
     '''    
     for job in job_list:
         new_job = get_job_attrs(job, job_id_dict)
         new_keyword = get_keyword_attrs(job, keyword_id_dict, search_term)
 
-        try:
-            if new_job is not None:
-                job_df = pd.concat([job_df, new_job], verify_integrity = True)
-        except ValueError:
-            pass
-        
-        try:
-            if new_keyword is not None:    
-                keyword_df = pd.concat([keyword_df ,new_keyword], verify_integrity = True)
-        except ValueError:
-            pass
+        if new_job is not None:
+            add_record_to_buffer(job_buffer, new_job)
+        if new_keyword is not None:
+            add_record_to_buffer(keyword_buffer, new_keyword)
 
-    return job_df, keyword_df
+    return job_buffer, keyword_buffer
 
-def crawl_webpages_to_append_job_data_to_dfs(search_term, search_location, page_limit = 100):
+def crawl_webpage_sources(driver, search_term, search_location, page_limit = 100, base_url = INDEED_BASE_URL, sort = None, wait_scheduler = None):
     '''
-    Web scraper function to navigate to indeed, search for requested job title keywork (search_term), and loop through pages up to specified limit (page_limit).
-    The job data is extracted from the webpages and sent to necessary functions to parse. New jobs found are appended to the relevant pandas dataframes. 
+    Navigate to indeed with the driver provided, search for requested job title keyword (search_term), and loop through pages up to specified limit (page_limit).
+    Yields the page number, the raw html of the page, the seconds spent navigating to and waiting on the page and the date it was fetched. 
+    No parsing is done so the driver can move on to the next page straight away.
+    Waits are timed by wait_scheduler, so a shared scheduler carries its learned timeouts and wait stats across keywords.
+    The driver is left open so it can be reused for the next keyword.
     '''
-    job_df = create_initial_empty_df('job') 
-    job_id_dict = get_searchable_dict('job') 
-
-    keyword_df = create_initial_empty_df('keyword')
-    keyword_id_dict = get_searchable_dict('keyword', search_term)
+    if wait_scheduler is None:
+        wait_scheduler = WaitScheduler()
+    start = time.perf_counter()
+    driver.get(get_search_url(search_term, search_location, base_url, sort))
+    page_state = wait_for_new_listings(driver, wait_scheduler)
 
-    driver = create_firefox_driver()
-    driver.get(f'https://ca.indeed.com/jobs?q={search_term}&l={search_location}&lang=en')
-    
     for page in range(1,page_limit+1):    
         if page > 1:
-            if not click_to_next_page(driver):
-                if not close_email_popup(driver):
-                    if not bypass_cloudflare_check(driver):
-                        print(f'reached last page of jobs at page: {page}, page requested: {page_limit}')
-                        driver.close()
-                        return job_df, keyword_df
-
-        job_list = parse_webpage_html(driver)
-        
-        job_df, keyword_df = append_single_webpage_of_job_info_to_dfs(job_list, job_df, job_id_dict, keyword_df, keyword_id_dict, search_term)
+            start = time.perf_counter()
+            page_state = go_to_next_page(driver, wait_scheduler, page_state['job_ids'] if page_state else [])
+            if page_state is None:
+                print(f'reached last page of {search_term} jobs at page: {page}, page requested: {page_limit}')
+                return
+
+        page_source = driver.page_source
+        yield page, page_source, time.perf_counter() - start, get_current_str_date()
 
-    print(f'page reached: {page}, page requested: {page_limit}')
-    driver.close()    
-    return job_df, keyword_df
+    print(f'{search_term} page reached: {page}, page requested: {page_limit}')
 
+def crawl_webpage_listings(driver, search_term, search_location, page_limit = 100, base_url = INDEED_BASE_URL):
+    '''Same as crawl_webpage_sources but yields the list of listings parsed from each page so the caller decides what to do with them.'''
+    for _, page_source, _, _ in crawl_webpage_sources(driver, search_term, search_location, page_limit, base_url):
+        yield parse_page_source_html(page_source)
 
-def assign_salary_period(df):
+def iterate_listing_elements(page_source):
     '''
-    Determine the salary period used for the jobs and populate within dataframe. 
-    Periods are typically yearly or hourly salaries; but monthly, weekly and daily periods also exist.
+    Stream the page html through lxml and yield each listing element as soon as its closing tag is parsed.
+    Each listing and everything before it is cleared once the caller is done with it, so only one listing subtree is held in memory at a time rather than the whole page.
     '''
-    df['salary_period'] = np.where(df['salary_text'].str.contains('year'), 'yearly',
-    np.where(df['salary_text'].str.contains('hour'), 'hourly',
-    np.where(df['salary_text'].str.contains('month'), 'monthly',
-    np.where(df['salary_text'].str.contains('day'), 'daily',
-    np.where(df['salary_text'].str.contains('week'), 'weekly',
-    np.NaN
-    )))))
+    for _, element in etree.iterparse(io.BytesIO(page_source.encode('utf-8')), events = ('end',), tag = 'li', html = True, encoding = 'utf-8'):
+        if element.get('class') != LISTING_CLASS:
+            continue
+        yield element
+        element.clear(keep_tail = True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+def get_element_text(element):
+    '''Return all the text inside an element, the same as .text on a BeautifulSoup tag.'''
+    return etree.tostring(element, method = 'text', encoding = str, with_tail = False)
+
+def extract_listing_fields(listing):
+    '''
+    Pull every field the scraper needs out of a listing element in a single pass over its subtree, following the same rules as job_is_ad, get_job_uid, get_job_title, get_job_company, 
+    get_job_location, get_company_rating and get_job_salary. Returns None if the listing is an ad or has no job id.
+    '''
+    job_uid = job_title = company = location = rating = salary = None
+    first_span_seen = salary_container_seen = False
+
+    for element in listing.iter('span', 'div', 'h2'):
+        tag = element.tag
+        if tag == 'span':
+            if not first_span_seen:
+                first_span_seen = True
+                id_parts = (element.get('id') or '').split('-')
+                job_uid = id_parts[1] if len(id_parts) > 1 else None
+            test_id = element.get('data-testid')
+            if test_id == 'company-name' and company is None:
+                company = get_element_text(element)
+            elif test_id == 'holistic-rating' and rating is None:
+                rating = get_element_text(element)
+        elif tag == 'div':
+            class_name = element.get('class')
+            if class_name == 'mosaic-zone nonJobContent-desktop':
+                return None
+            if class_name == 'metadata salary-snippet-container' and not salary_container_seen:
+                salary_container_seen = True
+                salary_element = next((div for div in element.iter('div') if div.get('data-testid') == 'attribute_snippet_testid' and div is not element), None)
+                if salary_element is not None:
+                    salary = get_element_text(salary_element)
+            elif location is None and element.get('data-testid') == 'text-location':
+                location = get_element_text(element)
+        elif job_title is None:
+            job_title = get_element_text(element)
 
-    return df
+    if job_uid is None:
+        return None
+    return job_uid, job_title, company, location, rating, salary
 
-def assign_salary_type(df):
+def parse_page_source_lxml(page_source, search_term):
     '''
-    Determine the type of salary for the jobs and populte within dataframe. In this case, type is defined as either range, floor, ceiling or expected. 
-    Most of the time, the salary is a range between 2 values (range) or a single value (expected). 
-    Sometimes, the top (ceiling) or bottom (floor) of the salary is provided instead (ie. "From $x" or "To $x" respectively).
+    Extract the job and keyword rows for every listing on a page using the single pass lxml extractor. Returns the same rows as the BeautifulSoup functions, 
+    along with the number of listings on the page and the seconds spent extracting their fields (the rest of the time is spent parsing the html).
     '''
-    df['salary_type'] = np.where(df['salary_text'].str.contains('–'), 'range',
-    np.where(df['salary_text'].str.contains('From'), 'floor',
-    np.where(df['salary_text'].str.contains('Up'), 'ceiling',
-    np.where(df['salary_text'].str.startswith('$'), 'expected',
-    np.NaN
-    ))))
-
-    return df
+    job_buffer, keyword_buffer = create_record_buffer(), create_record_buffer()
+    date_recorded = get_current_str_date()
+    listings_seen = 0
+    extract_seconds = 0.0
+    for listing in iterate_listing_elements(page_source):
+        listings_seen += 1
+        start = time.perf_counter()
+        fields = extract_listing_fields(listing)
+        extract_seconds += time.perf_counter() - start
+        if fields is None:
+            continue
+        job_uid, job_title, company, location, rating, salary = fields
+        job_row = (job_uid, job_title, company, location, 'y' if rating is not None else 'n', rating, 'y' if salary is not None else 'n', salary, get_job_url(job_uid), date_recorded)
+        add_record_to_buffer(job_buffer, job_row)
+        add_record_to_buffer(keyword_buffer, (job_uid, search_term))
+    return job_buffer[0], keyword_buffer[0], listings_seen, extract_seconds
+
+def parse_page_source(page_source, search_term, parse_engine = 'bs4', date_recorded = None):
+    '''
+    Parse the html of a page and extract the job and keyword rows for every listing on it, along with the parse stats of the page: 
+    the seconds taken in total, the part of them spent extracting fields from the listings and the number of listings (ads included) on the page.
+    parse_engine is either 'bs4' to use the BeautifulSoup get_job_* functions or 'lxml' to use the single pass extractor.
+    date_recorded overrides today's date on the job rows, ie. when replaying a page from the cache.
+    This runs in the parser pool, so only plain tuples are returned and checking for ids already in the database is left to the caller.
+    '''
+    start = time.perf_counter()
+    if parse_engine == 'lxml':
+        job_rows, keyword_rows, listings_seen, extract_seconds = parse_page_source_lxml(page_source, search_term)
+    else:
+        job_buffer, keyword_buffer = create_record_buffer(), create_record_buffer()
+        job_list = parse_page_source_html(page_source)
+        extract_start = time.perf_counter()
+        append_single_webpage_of_job_info_to_buffers(job_list, job_buffer, {}, keyword_buffer, {}, search_term)
+        extract_seconds = time.perf_counter() - extract_start
+        job_rows, keyword_rows, listings_seen = job_buffer[0], keyword_buffer[0], len(job_list)
+    if date_recorded is not None:
+        job_rows = [job_row[:-1] + (date_recorded,) for job_row in job_rows]
+    return job_rows, keyword_rows, {'parse_seconds': time.perf_counter() - start, 'extract_seconds': extract_seconds, 'listings_seen': listings_seen}
+
+def crawl_webpages_to_append_job_data_to_dfs(search_term, search_location, page_limit = 100, driver = None, base_url = INDEED_BASE_URL, database = DATABASE_PATH):
+    '''
+    Web scraper function to navigate to indeed, search for requested job title keywork (search_term), and loop through pages up to specified limit (page_limit).
+    The job data is extracted from the webpages and sent to necessary functions to parse. New jobs found are collected and returned as pandas dataframes. 
+    A new Firefox driver is opened and closed for the crawl unless an existing driver is passed in.
+    '''
+    job_buffer = create_record_buffer()
+    keyword_buffer = create_record_buffer()
 
-def convert_salary_str_to_float(salary_str, salary_type = None, column = None):
-    '''Convert a salary string to a floating point number.'''
-    if salary_type == 'range':
-        if column == 'min':
-            return float(salary_str.split('–')[0].replace('$','').replace(',',''))
-        if column == 'max':
-            return float(salary_str.split('–')[1].split()[0].replace('$','').replace(',',''))
+    close_driver = driver is None
+    if close_driver:
+        driver = create_firefox_driver()
 
-    return float(salary_str.split('$')[1].split()[0].replace(',',''))
+    try:
+        for job_list in crawl_webpage_listings(driver, search_term, search_location, page_limit, base_url):
+            page_job_ids = [get_job_uid(job, ()) for job in job_list if not job_is_ad(job)]
+            job_id_dict = get_existing_job_ids(page_job_ids, database)
+            keyword_id_dict = get_existing_keyword_ids(page_job_ids, search_term, database)
+            append_single_webpage_of_job_info_to_buffers(job_list, job_buffer, job_id_dict, keyword_buffer, keyword_id_dict, search_term)
+    finally:
+        if close_driver:
+            driver.close()
+
+    return convert_record_buffer_to_df(job_buffer, 'job'), convert_record_buffer_to_df(keyword_buffer, 'keyword')
+
+def forward_parsed_page(pending_pages, page_queue, keyword, accepted_job_ids, database = DATABASE_PATH, replay = False):
+    '''
+    Wait for the oldest page in the parser pool to finish, drop the ids already in the database or already accepted by the writer during this crawl and pass the rows and page stats on to the writer.
+    With replay set, the rows of jobs already in the database are passed on as well so the writer can update them; only ids accepted during this crawl are dropped.
+    The page stats (stage timings, number of listings and ads seen, number of jobs listed, how many of them are new or duplicates and how many are new for this keyword) are also returned.
+    '''
+    page, wait_seconds, parsed_page = pending_pages.popleft()
+    job_rows, keyword_rows, parse_stats = parsed_page.result()
+    first_job_id = job_rows[0][0] if job_rows else None
+    listings = len(job_rows)
+    start = time.perf_counter()
+    page_job_ids = [job_row[0] for job_row in job_rows]
+    existing_job_ids = get_existing_job_ids(page_job_ids, database)
+    existing_keyword_ids = get_existing_keyword_ids(page_job_ids, keyword, database)
+    new_job_rows = [job_row for job_row in job_rows if job_row[0] not in existing_job_ids and job_row[0] not in accepted_job_ids]
+    new_keyword_rows = [keyword_row for keyword_row in keyword_rows if keyword_row[0] not in existing_keyword_ids]
+    page_stats = {'keyword': keyword, 'page': page, 'wait_seconds': wait_seconds, **parse_stats, 'duplicate_check_seconds': time.perf_counter() - start, 
+    'ads_skipped': parse_stats['listings_seen'] - listings, 'listings': listings, 'duplicates_skipped': listings - len(new_job_rows), 'new_jobs': len(new_job_rows), 
+    'new_keyword_rows': len(new_keyword_rows), 'first_job_id': first_job_id}
+    if replay:
+        page_queue.put((keyword, [job_row for job_row in job_rows if job_row[0] not in accepted_job_ids], keyword_rows, page_stats))
+    else:
+        page_queue.put((keyword, new_job_rows, new_keyword_rows, page_stats))
+    return page_stats
 
-def get_actual_salary_values(row):
+def update_crawl_summary(crawl_summary, page_stats, known_page_streak):
+    '''
+    Add a page's stats to the keyword's crawl summary. Returns the number of pages in a row, up to and including this one, that had no jobs new for the keyword.
+    A job already stored under another keyword, or accepted for one earlier in this crawl, still needs its keyword row, so it doesn't count as known.
+    '''
+    crawl_summary['pages_crawled'] += 1
+    crawl_summary['new_jobs'] += page_stats['new_jobs']
+    if page_stats['page'] == 1:
+        crawl_summary['newest_job_id'] = page_stats['first_job_id']
+    if page_stats['new_keyword_rows']:
+        crawl_summary['last_new_page'] = max(crawl_summary['last_new_page'], page_stats['page'])
+        return 0
+    return known_page_streak + 1
+
+def crawl_keywords_with_driver(driver_factory, keyword_queue, page_queue, search_location, page_limit, accepted_job_ids, base_url, database, parse_executor, parse_queue_size, parse_engine, 
+    cache_directory = None, replay = False, replay_dates = None, stop_after_known_pages = None, wait_scheduler = None, fetch_mode = 'click', fetch_workers = 4, metrics = None):
+    '''
+    Worker loop for the crawler pool. Opens one driver and reuses it for every keyword it takes from the keyword queue until the queue is empty.
+    If cache_directory is set every page fetched is also saved to the page cache. With replay set, no driver is opened and the pages are read back from the cache instead.
+    With fetch_mode = 'url' no driver is opened either: the pages of each keyword are fetched fetch_workers at a time by url with fetch_webpage_sources_by_url.
+    The driver only fetches the html of each page. Pages are handed to the parser pool and up to parse_queue_size pages can be waiting there before the driver stops to wait on the oldest one.
+    If stop_after_known_pages is set, results are sorted newest first and a keyword's crawl stops once that many pages in a row had no jobs new for the keyword. 
+    Parsed pages are passed on as soon as they're done, and when stopping the pages that could complete the streak are parsed before fetching another, so the crawl stops right at the last known page.
+    The rows parsed from each page are put on the page queue for the writer as (keyword, job rows, keyword rows, page stats), 
+    followed by (keyword, None, None, crawl summary) once the keyword is finished. The crawl summary is None when replaying.
+    A None is always put on the page queue when the worker stops so the writer knows how many workers are still running.
+    Driver startup time and the reason the worker stopped, if it failed, are recorded in metrics.
+    '''
+    if metrics is None:
+        metrics = CrawlMetrics()
+    profiler = metrics.start_profile()
+    driver = None
+    keyword = None
+    try:
+        if not replay and fetch_mode == 'click':
+            start = time.perf_counter()
+            driver = driver_factory()
+            metrics.record_stage('driver_startup', None, time.perf_counter() - start)
+        while True:
+            try:
+                keyword = keyword_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            pending_pages = deque()
+            if replay:
+                page_sources = read_webpage_sources_from_cache(keyword, search_location, page_limit, cache_directory, replay_dates)
+            elif fetch_mode == 'url':
+                page_sources = fetch_webpage_sources_by_url(keyword, search_location, page_limit, base_url, 'date' if stop_after_known_pages else None, fetch_workers, 
+                cache_directory = cache_directory, metrics = metrics)
+            else:
+                page_sources = crawl_webpage_sources(driver, keyword, search_location, page_limit, base_url, 'date' if stop_after_known_pages else None, wait_scheduler)
+                if cache_directory is not None:
+                    page_sources = cache_webpage_sources(page_sources, keyword, search_location, cache_directory)
+
+            crawl_summary = {'keyword': keyword, 'search_location': search_location, 'pages_crawled': 0, 'new_jobs': 0, 'last_new_page': 0, 'newest_job_id': None}
+            known_page_streak = 0
+            for page, page_source, wait_seconds, date_recorded in page_sources:
+                pending_pages.append((page, wait_seconds, parse_executor.submit(parse_page_source, page_source, keyword, parse_engine, date_recorded)))
+                #Pages already parsed are passed on straight away so the known page streak is current before the next page is fetched. 
+                #When the pages still parsing could complete the streak they're waited on, since a page of parsing costs far less than fetching one more page
+                while pending_pages and (pending_pages[0][2].done() or (stop_after_known_pages and known_page_streak + len(pending_pages) >= stop_after_known_pages)):
+                    known_page_streak = update_crawl_summary(crawl_summary, forward_parsed_page(pending_pages, page_queue, keyword, accepted_job_ids, database, replay), known_page_streak)
+                    if stop_after_known_pages and known_page_streak >= stop_after_known_pages:
+                        break
+                if len(pending_pages) >= parse_queue_size and not (stop_after_known_pages and known_page_streak >= stop_after_known_pages):
+                    known_page_streak = update_crawl_summary(crawl_summary, forward_parsed_page(pending_pages, page_queue, keyword, accepted_job_ids, database, replay), known_page_streak)
+                if stop_after_known_pages and known_page_streak >= stop_after_known_pages:
+                    print(f'stopping {keyword} crawl at page {page}: no new jobs for the keyword in the last {known_page_streak} pages')
+                    break
+            while pending_pages:
+                known_page_streak = update_crawl_summary(crawl_summary, forward_parsed_page(pending_pages, page_queue, keyword, accepted_job_ids, database, replay), known_page_streak)
+            page_queue.put((keyword, None, None, None if replay else crawl_summary))
+    except Exception as e:
+        metrics.record_failure('driver_startup' if keyword is None else 'crawl', keyword, f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        if driver is not None:
+            driver.close()
+        close_database_connections()
+        metrics.stop_profile(profiler)
+        page_queue.put(None)
+
+#Matches "$x", "$x–$y", "From $x" and "Up to $x" followed by the salary period, ie. "$60–$62 an hour"
+SALARY_PATTERN = re.compile(r'^(?P<prefix>From |Up to )?\$(?P<first>[\d,]+(?:\.\d+)?)(?:–\$(?P<second>[\d,]+(?:\.\d+)?))?(?:.*?(?P<period>year|hour|month|day|week))?')
+SALARY_PERIODS = {'year': 'yearly', 'hour': 'hourly', 'month': 'monthly', 'day': 'daily', 'week': 'weekly'}
+#Assumes a 40 hour, 5 day work week for 52 weeks of the year
+SALARY_PERIOD_ANNUAL_FACTORS = {'yearly': 1, 'hourly': 2080, 'monthly': 12, 'daily': 260, 'weekly': 52}
+
+def parse_salary_columns(df):
     '''
-    Defines and populates 3 salary columns. "Floor" represents the minimum salary, "Ceiling" represents the maximum salary, and "Expected" represents the expected salary. 
+    Parse the salary type, period and values for every salary string at once using a single regex.
+    Periods are typically yearly or hourly salaries; but monthly, weekly and daily periods also exist.
+    Type is defined as either range, floor, ceiling or expected. Most of the time, the salary is a range between 2 values (range) or a single value (expected). 
+    Sometimes, the bottom (floor) or top (ceiling) of the salary is provided instead (ie. "From $x" or "Up to $x" respectively).
+    "Floor" represents the minimum salary, "Ceiling" represents the maximum salary, and "Expected" represents the expected salary. 
     The "Range" salary type has a floor and ceiling value with the a calculated expected being linearlly interpolated between the two. The rest only have one salary value corresponding to their respective type. 
     '''
-    if row['salary_type'] == 'range':
-        row['floor'] = convert_salary_str_to_float(row['salary_text'], 'range', 'min')
-        row['ceiling'] = convert_salary_str_to_float(row['salary_text'], 'range', 'max')
-        row['expected'] = round((row['ceiling'] + row['floor'])/2.0,2)
-        return row
-    if row['salary_type'] == 'expected':
-        row['expected'] = convert_salary_str_to_float(row['salary_text'])
-        return row
-    if row['salary_type'] == 'ceiling':
-        row['ceiling'] = convert_salary_str_to_float(row['salary_text'])
-        return row
-    if row['salary_type'] == 'floor':
-        row['floor'] = convert_salary_str_to_float(row['salary_text'])
-        return row
-        
+    parts = df['salary_text'].str.extract(SALARY_PATTERN)
+    first = pd.to_numeric(parts['first'].str.replace(',', '', regex = False))
+    second = pd.to_numeric(parts['second'].str.replace(',', '', regex = False))
+
+    salary_type = pd.Series(np.select([second.notna(), parts['prefix'] == 'From ', parts['prefix'] == 'Up to ', first.notna()], ['range', 'floor', 'ceiling', 'expected'], ''), index = df.index)
+    salary_type = salary_type.replace('', np.nan)
+
+    return df.assign(
+        salary_period = parts['period'].map(SALARY_PERIODS),
+        salary_type = salary_type,
+        floor = first.where(salary_type.isin(['range', 'floor'])),
+        ceiling = second.where(salary_type == 'range', first.where(salary_type == 'ceiling')),
+        expected = ((first + second) / 2.0).round(2).where(salary_type == 'range', first.where(salary_type == 'expected'))
+    )
+
+def annualize_salary_columns(df):
+    '''Add floor, expected and ceiling salaries converted to a yearly amount so jobs with different salary periods can be compared directly.'''
+    factor = df['salary_period'].map(SALARY_PERIOD_ANNUAL_FACTORS)
+    return df.assign(
+        annual_floor = (df['floor'] * factor).round(2),
+        annual_expected = (df['expected'] * factor).round(2),
+        annual_ceiling = (df['ceiling'] * factor).round(2)
+    )
+
 def create_salary_df(job_df):
     '''Use jobs with salaries provided to create a dataframe with salary numbers for those jobs.'''
     salary_df = job_df[job_df['salary_provided'] == 'y'][['salary_text']]
 
     salary_df = (
-        salary_df.pipe(assign_salary_period).pipe(assign_salary_type).apply(get_actual_salary_values, axis=1)
+        salary_df.pipe(parse_salary_columns).pipe(annualize_salary_columns)
     )
     return salary_df
 
 
-def assign_job_location_type(job_df):
+CANADA_JURISDICTIONS = {'Alberta' : 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB', 'New Brunswick': 'NB', 'Newfoundland and Labrador': 'NL', 'Nova Scotia': 'NS', 'Ontario': 'ON', 
+'Prince Edward Island': 'PE', 'Quebec': 'QC', 'Saskatchewan': 'SK', 'Northwest Territories': 'NT', 'Nunavut': 'NU', 'Yukon': 'YT'}
+COUNTRY_NAMES = ['Canada']
+LOCATION_MODELS_WITHOUT_PLACE = ['Remote', 'Remote Hybrid']
+
+#Splits "[Location Model] in [place], [region]" where all three parts are optional
+LOCATION_PATTERN = re.compile(r'^(?:(?P<location_model>.*?) in )?(?P<place>[^,]*?)(?:, (?P<region>.*?)(?:, .*)?)?$')
+
+def parse_job_location_columns(job_df):
     '''
-    Defines a location "type" based on presence or absence of "in" or "," in the location string. The location fields that can be parsed from the string will depend on the location type determined.
+    Parse the location model, city and jurisdiction out of the location string for every row at once.
     The typical format for a location string is: "[Location Model] in [city], [jurisdiction]. Where location model is "Remote", "Hybrid Remote", etc. 
-    However, all three fields there are optional so the parsing has to be able to account for this. 
-    '''
-    job_df['location_type'] = np.where(~job_df['location'].str.contains(' in |,', regex = True), 'neither',
-    np.where(~job_df['location'].str.contains(' in ') & job_df['location'].str.contains(','), 'comma',
-    np.where(job_df['location'].str.contains(' in ') & ~job_df['location'].str.contains(','), 'in',
-    np.where(job_df['location'].str.contains(' in ') & job_df['location'].str.contains(','), 'both',
-    np.NaN))))
-
-    return job_df
-
-def get_job_location_model(row):
-    '''Parse out location model based on location string and location type. This is done on a row basis.'''
-    if row['location_type'] == 'neither':
-        if row['location'] in ['Remote', 'Remote Hybrid']:
-            row['location_model'] = row['location']
-            return row
-
-    elif row['location_type'] == 'comma':
-        row['location_model'] = 'Not Specified'
-        return row
-
-    elif row['location_type'] == 'in' or row['location_type'] == 'both':
-        row['location_model'] = row['location'].split(' in ')[0]
-        return row
-    
-    row['location_model'] = 'Not Specified'
-    return row
-
-def check_if_jurisdiction(location_str):
-    '''Checks to see if location string contains a reference to a Canadian jurisdiction (province/territory)'''
-    
-    canada_jurisdictions = {'Alberta' : 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB', 'New Brunswick': 'NB', 'Newfoundland and Labrador': 'NL', 'Nova Scotia': 'NS', 'Ontario': 'ON', 
-    'Prince Edward Island': 'PE', 'Quebec': 'QC', 'Saskatchewan': 'SK', 'Northwest Territories': 'NT', 'Nunavut': 'NU', 'Yukon': 'YT'}
-
-    if location_str in canada_jurisdictions:
-        return True
-    return False
-
-def check_if_country(location_str):
-    '''At times, the location string provides just the country and no other information - this is a check for that.'''
-    if location_str in ['Canada']:
-        return True
-    return False
-
-def get_abbreviated_jurisdiction(jurisdiction_str):
-    '''Returns an abbreviated form of the canadian jurisdiction based on the full name string provided.'''
-
-    canada_jurisdictions = {'Alberta' : 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB', 'New Brunswick': 'NB', 'Newfoundland and Labrador': 'NL', 'Nova Scotia': 'NS', 'Ontario': 'ON', 
-    'Prince Edward Island': 'PE', 'Quebec': 'QC', 'Saskatchewan': 'SK', 'Northwest Territories': 'NT', 'Nunavut': 'NU', 'Yukon': 'YT'}
-
-    return canada_jurisdictions.get(jurisdiction_str, 'Not Found')
-
-def get_job_city(row):
-    '''Parse out city based on location string and location type. This is done on a row basis.'''
-    if row['location_type'] == 'neither':
-        if not check_if_jurisdiction(row['location']) and not check_if_country(row['location']):
-            row['city'] = row['location']
-            return row
-
-    elif row['location_type'] == 'comma':
-        row['city'] = row['location'].split(',')[0]
-        return row
-
-    elif row['location_type'] == 'in':
-        row['city'] = 'Not Specified'
-    
-    elif row['location_type'] == 'both':
-        row['city'] = row['location'].split(',')[0].split(' in ')[1]
-        return row
-    
-    row['city'] = 'Not Specified'
-    return row
-
-def get_job_jurisdiction(row):
-    '''Parse out juristiction based on location string and location type. This is done on a row basis.'''
-    if row['location_type'] == 'neither':
-        if check_if_jurisdiction(row['location']):
-            row['jurisdiction'] = get_abbreviated_jurisdiction(row['location'])
-            return row
-
-    elif row['location_type'] == 'comma':
-        row['jurisdiction'] = row['location'].split(', ')[1]
-        return row
-
-    elif row['location_type'] == 'in':
-        location_to_check = row['location'].split(' in ')[1]
-        if check_if_jurisdiction(location_to_check):
-            row['jurisdiction'] = get_abbreviated_jurisdiction(location_to_check)
-            return row
-    
-    elif row['location_type'] == 'both':
-        row['jurisdiction'] = row['location'].split(', ')[1]
-        return row
-    
-    row['jurisdiction'] = 'Not Specified'
-    return row
+    However, all three fields there are optional so the parsing has to be able to account for this. The string is split by a single regex and the presence or absence of "in" and "," then decides which part fills each field.
+    A location with no "in" or "," is either a jurisdiction, the country, a location model with no place (ie. "Remote") or a city.
+    '''
+    location = job_df['location']
+    parts = location.str.extract(LOCATION_PATTERN)
+    has_in = parts['location_model'].notna()
+    has_comma = location.str.contains(',', regex = False)
+    is_jurisdiction_or_country = location.isin(CANADA_JURISDICTIONS) | location.isin(COUNTRY_NAMES)
+
+    location_model = np.select([has_in, ~has_comma & location.isin(LOCATION_MODELS_WITHOUT_PLACE)], [parts['location_model'], location], 'Not Specified')
+    city = np.select([has_comma, has_in, ~is_jurisdiction_or_country], [parts['place'], 'Not Specified', location], 'Not Specified')
+    jurisdiction = np.select([has_comma, has_in], [parts['region'], parts['place'].map(CANADA_JURISDICTIONS)], location.map(CANADA_JURISDICTIONS))
+
+    return job_df.assign(location_model = location_model, city = city, jurisdiction = pd.Series(jurisdiction, index = job_df.index).fillna('Not Specified'))
 
 def get_job_country(df, country):
     '''Parse out country based on location string.'''
@@ -415,49 +668,304 @@ def get_job_country(df, country):
 def get_job_location_attrs(job_df, country):
     '''Pass dataframe into various functions that parse out location attributes from the location string using method chaining. Parsed attributes are populated into the database and returned.'''
     job_df_with_location_data = (
-        job_df.pipe(assign_job_location_type).apply(get_job_location_model, axis=1).apply(get_job_city, axis=1).apply(get_job_jurisdiction, axis=1).pipe(get_job_country, country)
+        job_df.pipe(parse_job_location_columns).pipe(get_job_country, country)
     )
 
     return job_df_with_location_data[['job_title','company','location','rating_provided','rating','salary_provided','weblink','date_recorded','location_model','country', 'jurisdiction','city']]
 
 
-def append_pandas_to_sql(df, df_type):
-    '''Take dataframes created and populated by program with new jobs found and append them to the existing SQL tables.'''
-
-    engine = sqlalchemy.create_engine('sqlite:///JobData.db')
+def insert_df_rows(conn, df, table):
+    '''
+    Bulk insert the rows of a dataframe (index included as the id column) into the normalized tables behind the Jobs, KeywordRef or Salaries view. Rows whose key already exists are skipped.
+    Must be called inside a transaction. Returns the number of rows inserted.
+    '''
+    rows_df = df.reset_index()
+    rows_df = rows_df.astype(object).where(rows_df.notna(), None)
+    return insert_normalized_rows(conn, rows_df, table)
 
-    if df_type == 'job':
-        try:
-            df.to_sql('Jobs', engine, if_exists='append')
-            return True
-        except Exception as e:
-            print(f'Cannot add to job table. Error raised: {e}')
-    if df_type == 'keyword':
-        try:
-            df.to_sql('KeywordRef', engine, if_exists='append')
-            return True
-        except Exception as e:
-            print(f'Cannot add to keyword table. Error raised: {e}')
-    if df_type == 'salary':
-        try:
-            df.to_sql('Salaries', engine, if_exists = 'append')
-            return True
-        except Exception as e:
-            print(f'Cannot add to salary table. Error raised: {e}')
-
-def get_indeed_job_data(search_terms, country = 'Canada', page_limit = 15):
-    for keyword in search_terms:
-        job_df, keyword_df = crawl_webpages_to_append_job_data_to_dfs(keyword, country, page_limit)
+def write_dfs_to_sql(dfs, database = DATABASE_PATH):
+    '''
+    Insert several dataframes in a single transaction, where dfs is a list of (df_type, df) pairs. Either every table is written or, if any insert fails, none are.
+    The summary tables and the JobSearch full text index are updated with the new rows in the same transaction. Near-duplicate clusters are updated after the crawl, see refresh_duplicate_clusters.
+    Returns the number of rows inserted into each table, or None if the transaction was rolled back.
+    '''
+    conn = get_database_connection(database)
+    try:
+        with conn:
+            inserted_rows = {TABLE_NAMES[df_type]: insert_df_rows(conn, df, TABLE_NAMES[df_type]) for df_type, df in dfs}
+            update_summary_tables(conn)
+            update_search_index(conn)
+            return inserted_rows
+    except sqlite3.Error as e:
+        print(f'Cannot add to {", ".join(TABLE_NAMES[df_type] for df_type, _ in dfs)}, no rows were written. Error raised: {e}')
+        return None
 
-        salary_df = create_salary_df(job_df)
+def append_pandas_to_sql(df, df_type, database = DATABASE_PATH):
+    '''Take dataframes created and populated by program with new jobs found and append them to the existing SQL tables.'''
+    return write_dfs_to_sql([(df_type, df)], database) is not None
+
+def update_stored_jobs(job_df, salary_df, database = DATABASE_PATH):
+    '''Overwrite the stored rows of the enriched jobs in job_df and salary_df that are already in the database, in one transaction. Returns the number of jobs updated.'''
+    conn = get_database_connection(database)
+    with conn:
+        updated_jobs = update_normalized_rows(conn, job_df.reset_index(), 'Jobs')
+        salary_rows_df = salary_df.reset_index()
+        update_normalized_rows(conn, salary_rows_df.astype(object).where(salary_rows_df.notna(), None), 'Salaries')
+    return updated_jobs
+
+def write_keyword_job_data(keyword, job_df, keyword_df, country, database = DATABASE_PATH, metrics = None, update_existing = False):
+    '''
+    Enrich the jobs found for a keyword with salary and location data and append them to the SQL tables in one transaction.
+    With update_existing set (when replaying cached pages), jobs already stored are overwritten with the values parsed again, in a second transaction once the new rows are in.
+    The time taken by each step, the rows inserted and a failed write are recorded in metrics if given.
+    '''
+    if metrics is None:
+        metrics = CrawlMetrics()
+    start = time.perf_counter()
+    salary_df = create_salary_df(job_df)
 
-        job_df_with_location_data = get_job_location_attrs(job_df, country)
+    job_df_with_location_data = get_job_location_attrs(job_df, country)
+    metrics.record_stage('enrichment', keyword, time.perf_counter() - start)
 
-        print(f'New {keyword} jobs found to be added: {len(job_df_with_location_data.index)}')
+    print(f'New {keyword} jobs found to be added: {len(job_df_with_location_data.index)}')
 
-        append_pandas_to_sql(job_df_with_location_data, 'job')
-        append_pandas_to_sql(keyword_df, 'keyword')
-        append_pandas_to_sql(salary_df, 'salary')
+    start = time.perf_counter()
+    inserted_rows = write_dfs_to_sql([('job', job_df_with_location_data), ('keyword', keyword_df), ('salary', salary_df)], database)
+    metrics.record_stage('sql_write', keyword, time.perf_counter() - start)
+    if inserted_rows is None:
+        metrics.record_failure('sql_write', keyword, f'transaction rolled back, {len(job_df.index)} jobs not written')
+    else:
+        metrics.count(keyword, jobs_inserted = inserted_rows['Jobs'], keyword_rows_inserted = inserted_rows['KeywordRef'])
+        if update_existing:
+            start = time.perf_counter()
+            print(f'Stored {keyword} jobs updated: {update_stored_jobs(job_df_with_location_data, salary_df, database) - inserted_rows["Jobs"]}')
+            metrics.record_stage('sql_write', keyword, time.perf_counter() - start)
+
+#Rows re-enriched per transaction by reenrich_stored_jobs
+REENRICH_CHUNK_ROWS = 50_000
+#Stored jobs in the shape of the job_df built from crawled pages, the next chunk after a job_key
+STORED_JOBS_QUERY = """ SELECT t1.job_key, t1.id, t1.job_title, t1.company, t1.location, t1.rating_provided, t1.rating, t1.salary_provided, t2.salary_text, t1.weblink, t1.date_recorded
+FROM JobDetails t1 LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+WHERE t1.job_key > ?
+ORDER BY t1.job_key
+LIMIT ?
+"""
+
+def iterate_stored_job_chunks(database = DATABASE_PATH, chunk_size = REENRICH_CHUNK_ROWS, after_key = 0):
+    '''
+    Generator reading the stored jobs chunk_size at a time in job_key order, starting after after_key, so only one chunk is held in memory.
+    Yields (last job_key in the chunk, job_df) with job_df shaped like the job_df of a crawl.
+    '''
+    conn = sqlite3.connect(database)
+    try:
+        while True:
+            job_df = pd.read_sql(STORED_JOBS_QUERY, conn, params = (after_key, chunk_size), index_col = 'id')
+            if job_df.empty:
+                return
+            after_key = int(job_df.pop('job_key').iloc[-1])
+            yield after_key, job_df
+    finally:
+        conn.close()
+
+def enrich_job_chunks(job_chunks, country):
+    '''Generator enriching each (key, job_df) chunk of job_chunks with location and salary data as it arrives, yielding (key, job_df_with_location_data, salary_df).'''
+    for key, job_df in job_chunks:
+        yield key, get_job_location_attrs(job_df, country), create_salary_df(job_df)
+
+def reenrich_stored_jobs(database = DATABASE_PATH, country = 'Canada', chunk_size = REENRICH_CHUNK_ROWS, after_key = 0, snapshot_directory = SNAPSHOT_DIRECTORY):
+    '''
+    Re-run the location and salary enrichment over the jobs already stored, ie. after the parsing rules in parse_job_location_columns or parse_salary_columns changed.
+    Jobs are read, enriched and updated chunk_size at a time with one transaction per chunk, so memory stays bounded however large the database is.
+    If interrupted, pass the last job_key printed as after_key to carry on from there. The summary tables and the analytics snapshot in snapshot_directory 
+    are rebuilt at the end since they hold the rows under their old values. The snapshot is flagged for a rebuild before any row changes, so if the run is interrupted 
+    the next export still rebuilds it. Pass snapshot_directory = None to leave the snapshot alone. Returns the number of jobs re-enriched.
+    '''
+    if snapshot_directory is not None:
+        mark_snapshot_for_rebuild(snapshot_directory)
+    job_count = 0
+    for last_key, job_df, salary_df in enrich_job_chunks(iterate_stored_job_chunks(database, chunk_size, after_key), country):
+        update_stored_jobs(job_df, salary_df, database)
+        job_count += len(job_df.index)
+        print(f'Re-enriched {job_count} jobs, up to job_key {last_key}')
+    close_database_connections()
+
+    rebuild_summary_tables(database)
+    if snapshot_directory is not None:
+        export_analytics_snapshot(database, snapshot_directory, rebuild = True)
+    return job_count
+
+def update_crawl_high_water_mark(crawl_summary, database = DATABASE_PATH):
+    '''
+    Record how far the latest crawl of a keyword got in the CrawlHighWaterMarks table: the newest job id at the top of the results, how many pages were crawled, 
+    the last page that still had new jobs and how many new jobs were found.
+    '''
+    conn = get_database_connection(database)
+    with conn:
+        conn.execute(""" INSERT INTO CrawlHighWaterMarks (keyword, search_location, last_crawled, newest_job_id, pages_crawled, last_new_page, new_jobs)
+        VALUES (:keyword, :search_location, :last_crawled, :newest_job_id, :pages_crawled, :last_new_page, :new_jobs)
+        ON CONFLICT (keyword, search_location) DO UPDATE SET last_crawled = excluded.last_crawled, newest_job_id = coalesce(excluded.newest_job_id, newest_job_id), 
+        pages_crawled = excluded.pages_crawled, last_new_page = excluded.last_new_page, new_jobs = excluded.new_jobs
+        """, {**crawl_summary, 'last_crawled': get_current_str_date()})
+
+def write_buffered_keyword_rows(keyword, keyword_buffer, pending_job_rows, country, database = DATABASE_PATH, metrics = None, update_existing = False):
+    '''
+    Write a keyword's buffered (id, keyword) pairs along with the pending job rows they reference, which are removed from pending_job_rows.
+    With update_existing set, jobs already stored are overwritten with the pending rows.
+    '''
+    keyword_df = convert_record_buffer_to_df(keyword_buffer, 'keyword')
+    job_buffer = create_record_buffer()
+    for job_id in keyword_df.index:
+        if job_id in pending_job_rows:
+            add_record_to_buffer(job_buffer, pending_job_rows.pop(job_id))
+    write_keyword_job_data(keyword, convert_record_buffer_to_df(job_buffer, 'job'), keyword_df, country, database, metrics, update_existing)
+
+def write_crawled_pages(page_queue, worker_count, country, accepted_job_ids, database = DATABASE_PATH, metrics = None, write_batch_pages = None, update_existing = False):
+    '''
+    Single writer for the crawler pool. Collects the rows each worker parses into per keyword buffers and writes a keyword to the database once its crawl is finished.
+    With write_batch_pages set, a keyword's rows are instead enriched and committed every write_batch_pages pages as they arrive (and the rest once its crawl is finished),
+    so memory stays bounded by the batch size rather than page_limit and a crawl that stops part way keeps the pages written before it stopped.
+    Job ids are checked against accepted_job_ids, which is updated as jobs are accepted, so a job found by two workers under different keywords is only added to Jobs once. 
+    Accepted job rows are held in a pool shared by every keyword and written with the first keyword whose (id, keyword) pairs reference them, 
+    since a keyword row can only be stored once its job is. The (id, keyword) pairs are checked against the keyword's own buffer.
+    The keyword's high-water mark is updated from its crawl summary once written. The stats of every page and the writes are recorded in metrics.
+    With update_existing set (when replaying cached pages), jobs already stored are overwritten with the rows parsed again rather than skipped.
+    Returns the keywords that were not finished because their worker stopped early and the stats of every page.
+    '''
+    if metrics is None:
+        metrics = CrawlMetrics()
+    pending_job_rows = {}
+    keyword_buffers = {}
+    buffered_pages = {}
+    page_timings = []
+    running_workers = worker_count
+    while running_workers:
+        message = page_queue.get()
+        if message is None:
+            running_workers -= 1
+            continue
+
+        keyword, job_rows, keyword_rows, page_stats = message
+        keyword_buffer = keyword_buffers.setdefault(keyword, create_record_buffer())
+
+        if job_rows is None:
+            write_buffered_keyword_rows(keyword, keyword_buffers.pop(keyword), pending_job_rows, country, database, metrics, update_existing)
+            buffered_pages.pop(keyword, None)
+            if page_stats is not None:
+                update_crawl_high_water_mark(page_stats, database)
+            continue
+
+        page_timings.append(page_stats)
+        metrics.record_page(page_stats)
+        for job_row in job_rows:
+            if job_row[0] not in accepted_job_ids:
+                accepted_job_ids.add(job_row[0])
+                pending_job_rows[job_row[0]] = job_row
+        for keyword_row in keyword_rows:
+            add_record_to_buffer(keyword_buffer, keyword_row)
+
+        if write_batch_pages is not None:
+            buffered_pages[keyword] = buffered_pages.get(keyword, 0) + 1
+            if buffered_pages[keyword] >= write_batch_pages:
+                write_buffered_keyword_rows(keyword, keyword_buffer, pending_job_rows, country, database, metrics, update_existing)
+                keyword_buffers[keyword] = create_record_buffer()
+                buffered_pages[keyword] = 0
+
+    #Rows of keywords that didn't finish are only written when committing in batches, where keeping the pages crawled so far is the point
+    unfinished_keywords = list(keyword_buffers)
+    if write_batch_pages is not None:
+        for keyword in unfinished_keywords:
+            write_buffered_keyword_rows(keyword, keyword_buffers[keyword], pending_job_rows, country, database, metrics, update_existing)
+    return unfinished_keywords, page_timings
+
+def get_indeed_job_data(search_terms, country = 'Canada', page_limit = 15, workers = 1, driver_factory = None, base_url = INDEED_BASE_URL, database = DATABASE_PATH, 
+    parse_workers = 2, parse_processes = False, parse_engine = 'bs4', cache_directory = None, replay = False, replay_dates = None, incremental = False, stop_after_known_pages = 2, 
+    wait_scheduler = None, fetch_mode = 'click', fetch_workers = 4, snapshot_directory = None, metrics = None, write_batch_pages = None):
+    '''
+    Crawl indeed for each search term and append the new jobs found to the database.
+    The keywords are shared between a pool of worker threads, each with its own driver that is reused across keywords. Parsed pages are handed to a single writer on the calling thread.
+    The drivers only fetch page html. Parsing is done in a pool of parse_workers threads (or processes if parse_processes is set) so it overlaps with navigating to the next page.
+    parse_engine selects how listings are extracted: 'bs4' for the BeautifulSoup get_job_* functions or 'lxml' for the faster single pass extractor.
+    With more than one worker the drivers default to headless Firefox. driver_factory can be used to supply a different driver, ie. one pointed at a local copy of the job board.
+    Setting cache_directory (ie. PAGE_CACHE_DIRECTORY in Job_Page_Cache.py) saves the html of every page fetched so it can be parsed again later, and evicts old pages from the cache once the crawl is done.
+    With replay set, no browser is used: the jobs are rebuilt from the pages in cache_directory for each search term, limited to replay_dates if given. 
+    Jobs already stored are overwritten with the values parsed again, then the summary tables, the JobSearch index and the duplicate clusters are rebuilt 
+    and the analytics snapshot in snapshot_directory, if set, is rebuilt.
+    With incremental set, results are sorted newest first and each keyword stops once stop_after_known_pages pages in a row only had jobs already stored under that keyword, 
+    so a daily refresh only crawls as far as the new postings go. Every live crawl records its reach per keyword in CrawlHighWaterMarks.
+    fetch_mode = 'url' fetches the pages of each keyword by their url over plain http, fetch_workers at a time, instead of clicking through them with a driver. 
+    Combined with cache_directory, a keyword interrupted part way resumes after the last page saved to the cache today.
+    Once the crawl is written, the new jobs are assigned to near-duplicate clusters in their own transaction, so the fingerprinting doesn't hold up the writer.
+    If snapshot_directory is set (ie. SNAPSHOT_DIRECTORY), the rows added are then appended to the parquet analytics snapshot.
+    With write_batch_pages set (ie. 10), the rows of each keyword are enriched and committed every write_batch_pages pages instead of once its crawl is done, for long crawls and backfills.
+    Browser waits are timed by wait_scheduler (a new WaitScheduler shared by the workers if not given), which learns the timeouts and records the time spent per wait type.
+    The seconds spent in each stage per keyword, the listings seen, skipped and inserted and any failures are collected by metrics (a new CrawlMetrics if not given) 
+    and written to the crawl metrics tables once the crawl is done, then keywords whose yield dropped against earlier runs are reported. 
+    Pass CrawlMetrics(profile_path) to also save a cProfile of the crawler threads and the writer.
+    Returns a dataframe with the stage timings and counts of each page.
+    '''
+    if driver_factory is None:
+        driver_factory = partial(create_firefox_driver, headless = workers > 1)
 
-        
-get_indeed_job_data(['data analyst', 'data scientist', 'business intelligence', 'database administrator'], 'Canada', 5)
\ No newline at end of file
+    keyword_queue = queue.Queue()
+    for keyword in search_terms:
+        keyword_queue.put(keyword)
+    page_queue = queue.Queue()
+    accepted_job_ids = set()
+    if wait_scheduler is None:
+        wait_scheduler = WaitScheduler()
+    if metrics is None:
+        metrics = CrawlMetrics()
+    if replay and snapshot_directory is not None:
+        mark_snapshot_for_rebuild(snapshot_directory)
+
+    executor_type = ProcessPoolExecutor if parse_processes else ThreadPoolExecutor
+    with executor_type(max_workers = parse_workers) as parse_executor:
+        crawl_worker = partial(crawl_keywords_with_driver, driver_factory = driver_factory, keyword_queue = keyword_queue, page_queue = page_queue, search_location = country, 
+        page_limit = page_limit, accepted_job_ids = accepted_job_ids, base_url = base_url, database = database, parse_executor = parse_executor, parse_queue_size = 2 * parse_workers, 
+        parse_engine = parse_engine, cache_directory = cache_directory, replay = replay, replay_dates = replay_dates, 
+        stop_after_known_pages = stop_after_known_pages if incremental and not replay else None, wait_scheduler = wait_scheduler, fetch_mode = fetch_mode, 
+        fetch_workers = fetch_workers, metrics = metrics)
+        worker_threads = [threading.Thread(target = crawl_worker, daemon = True) for _ in range(workers)]
+        for worker_thread in worker_threads:
+            worker_thread.start()
+
+        profiler = metrics.start_profile()
+        unfinished_keywords, page_timings = write_crawled_pages(page_queue, workers, country, accepted_job_ids, database, metrics, write_batch_pages, replay)
+        metrics.stop_profile(profiler)
+
+        for worker_thread in worker_threads:
+            worker_thread.join()
+
+    if unfinished_keywords and write_batch_pages is None:
+        print(f'Crawl stopped early, jobs not added for: {unfinished_keywords}')
+    elif unfinished_keywords:
+        print(f'Crawl stopped early, only the jobs of the pages crawled so far were added for: {unfinished_keywords}')
+    if cache_directory is not None and not replay:
+        evict_page_cache(cache_directory)
+    close_database_connections()
+    if replay:
+        rebuild_summary_tables(database)
+        rebuild_search_index(database)
+    start = time.perf_counter()
+    print(f'Reposts of earlier roles found: {rebuild_duplicate_clusters(database) if replay else refresh_duplicate_clusters(database)}')
+    metrics.record_stage('duplicate_clustering', None, time.perf_counter() - start)
+    if snapshot_directory is not None:
+        start = time.perf_counter()
+        export_analytics_snapshot(database, snapshot_directory)
+        metrics.record_stage('snapshot_export', None, time.perf_counter() - start)
+
+    page_timings = pd.DataFrame(page_timings, columns = ['keyword', 'page', 'wait_seconds', 'parse_seconds', 'extract_seconds', 'duplicate_check_seconds', 'listings_seen', 'ads_skipped', 
+    'listings', 'duplicates_skipped', 'new_jobs', 'new_keyword_rows'])
+    print(metrics.get_stage_seconds().round(2))
+    if not replay and fetch_mode == 'click':
+        wait_stats = wait_scheduler.get_wait_stats()
+        metrics.record_wait_stats(wait_stats)
+        print(wait_stats.round(2))
+    metrics.write_run({'search_location': country, 'keywords': ', '.join(search_terms), 'page_limit': page_limit, 'workers': workers, 
+    'fetch_mode': 'replay' if replay else fetch_mode, 'parse_engine': parse_engine, 'incremental': incremental and not replay}, database)
+    find_yield_drops(database)
+    return page_timings
+
+
+if __name__ == '__main__':
+    get_indeed_job_data(['data analyst', 'data scientist', 'business intelligence', 'database administrator'], 'Canada', 5, snapshot_directory = SNAPSHOT_DIRECTORY)
@@ -0,0 +1,143 @@
+import csv
+import sqlite3
+
+
+DATABASE_PATH = 'JobData.db'
+POPULATION_CSV_PATH = 'Canada_Province_Population.csv'
+#Keyword value of the summary rows that count every job once, whichever keywords it was found under
+ALL_KEYWORDS = 'All Keywords'
+#Histogram bin widths per salary period, matching the binwidths used in Job_Data_Analysis.ipynb
+SALARY_HISTOGRAM_BIN_WIDTHS = {'yearly': 10000, 'hourly': 2, 'monthly': 1000, 'daily': 50, 'weekly': 250}
+SUMMARY_DIMENSIONS = 'date_recorded, keyword, jurisdiction, location_model, salary_provided, salary_period'
+HISTOGRAM_DIMENSIONS = 'date_recorded, keyword, jurisdiction, location_model, salary_period, bin_floor'
+
+#Rows added since the summaries were last updated: every new job under ALL_KEYWORDS, plus every new (job, keyword) pair under its keyword
+SUMMARY_ROW_COLUMNS = """t1.date_recorded, coalesce(t1.jurisdiction, 'Not Specified') AS jurisdiction, coalesce(t1.location_model, 'Not Specified') AS location_model,
+t1.salary_provided, coalesce(t2.salary_period, 'Not Specified') AS salary_period, t2.expected, t2.annual_expected"""
+NEW_SUMMARY_ROWS = f""" SELECT :all_keywords AS keyword, {SUMMARY_ROW_COLUMNS}
+FROM JobDetails t1 LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+WHERE t1.job_key > :last_job_key
+UNION ALL
+SELECT t3.keyword, {SUMMARY_ROW_COLUMNS}
+FROM KeywordRefDetails t3 INNER JOIN JobDetails t1 ON t1.job_key = t3.job_key LEFT JOIN SalaryRecords t2 ON t2.job_key = t1.job_key
+WHERE t3.keyword_ref_key > :last_keyword_ref_key
+"""
+
+BIN_WIDTHS_QUERY = ' UNION ALL '.join(f"SELECT '{period}' AS period, {width} AS width" for period, width in SALARY_HISTOGRAM_BIN_WIDTHS.items())
+
+
+def create_summary_tables(c):
+    '''Create the summary tables, the population table and the views dashboards read from.'''
+    c.execute(f""" CREATE TABLE IF NOT EXISTS JobSummaries(
+        date_recorded text not null,
+        keyword text not null,
+        jurisdiction text not null,
+        location_model text not null,
+        salary_provided text not null,
+        salary_period text not null,
+        job_count integer not null,
+        salary_count integer not null,
+        expected_sum real not null,
+        expected_squares_sum real not null,
+        annual_expected_sum real not null,
+
+        CONSTRAINT PK_JobSummaries PRIMARY KEY ({SUMMARY_DIMENSIONS})
+    )
+    """)
+
+    c.execute(f""" CREATE TABLE IF NOT EXISTS SalaryHistograms(
+        date_recorded text not null,
+        keyword text not null,
+        jurisdiction text not null,
+        location_model text not null,
+        salary_period text not null,
+        bin_floor real not null,
+        bin_width real not null,
+        job_count integer not null,
+
+        CONSTRAINT PK_SalaryHistograms PRIMARY KEY ({HISTOGRAM_DIMENSIONS})
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS SummaryState(
+        table_name text not null,
+        last_rowid integer not null,
+
+        CONSTRAINT PK_SummaryState PRIMARY KEY (table_name)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS JurisdictionPopulations(
+        jurisdiction text not null,
+        geography text not null,
+        population integer not null,
+        population_perc real not null,
+
+        CONSTRAINT PK_JurisdictionPopulations PRIMARY KEY (jurisdiction)
+    )
+    """)
+
+    #Same figures as the jurisdiction and population comparison in the notebook: the percent is of all jobs, including those without a jurisdiction
+    c.execute(f""" CREATE VIEW IF NOT EXISTS JurisdictionJobShares AS
+    SELECT t1.jurisdiction, t1.job_count, 100.0 * t1.job_count / sum(t1.job_count) OVER () AS job_count_perc, t2.population, t2.population_perc
+    FROM (SELECT jurisdiction, sum(job_count) AS job_count FROM JobSummaries WHERE keyword = '{ALL_KEYWORDS}' GROUP BY jurisdiction) AS t1
+    LEFT JOIN JurisdictionPopulations t2 ON t2.jurisdiction = t1.jurisdiction
+    """)
+
+def load_jurisdiction_populations(c, csv_path = POPULATION_CSV_PATH):
+    '''Replace the JurisdictionPopulations rows with the populations in csv_path, along with each jurisdiction's percent of the total.'''
+    with open(csv_path, newline = '') as file:
+        rows = [(row['jurisdiction'], row['geography'], int(row['population'].replace(',', ''))) for row in csv.DictReader(file)]
+    total_population = sum(population for _, _, population in rows)
+    c.execute('DELETE FROM JurisdictionPopulations')
+    c.executemany('INSERT INTO JurisdictionPopulations VALUES (?, ?, ?, ?)', [(*row, row[2] / total_population * 100) for row in rows])
+
+def update_summary_tables(c):
+    '''
+    Add the jobs and keyword rows inserted since the last update to JobSummaries and SalaryHistograms.
+    Only the new rows are read (found by job_key and keyword_ref_key, which only grow), so the cost depends on the size of the insert rather than the size of the database.
+    Called inside the transaction that inserts the rows, so a job's salary must be written in the same transaction as the job for it to be counted.
+    '''
+    #SummaryState keeps the keys under the Jobs and KeywordRef names, the rowids of the tables they replaced having carried over as the keys
+    last_keys = dict(c.execute('SELECT table_name, last_rowid FROM SummaryState').fetchall())
+    params = {'all_keywords': ALL_KEYWORDS, 'last_job_key': last_keys.get('Jobs', 0), 'last_keyword_ref_key': last_keys.get('KeywordRef', 0)}
+    c.execute('DROP TABLE IF EXISTS temp.NewSummaryRows')
+    c.execute(f'CREATE TEMP TABLE NewSummaryRows AS {NEW_SUMMARY_ROWS}', params)
+
+    c.execute(f""" INSERT INTO JobSummaries
+    SELECT {SUMMARY_DIMENSIONS}, count(*), count(expected), coalesce(sum(expected), 0), coalesce(sum(expected * expected), 0), coalesce(sum(annual_expected), 0)
+    FROM temp.NewSummaryRows WHERE true
+    GROUP BY {SUMMARY_DIMENSIONS}
+    ON CONFLICT ({SUMMARY_DIMENSIONS}) DO UPDATE SET
+    job_count = job_count + excluded.job_count, salary_count = salary_count + excluded.salary_count, expected_sum = expected_sum + excluded.expected_sum,
+    expected_squares_sum = expected_squares_sum + excluded.expected_squares_sum, annual_expected_sum = annual_expected_sum + excluded.annual_expected_sum
+    """)
+
+    c.execute(f""" INSERT INTO SalaryHistograms
+    SELECT date_recorded, keyword, jurisdiction, location_model, salary_period, CAST(expected / width AS INTEGER) * width AS bin_floor, width, count(*)
+    FROM temp.NewSummaryRows AS summary_rows INNER JOIN ({BIN_WIDTHS_QUERY}) AS widths ON widths.period = summary_rows.salary_period
+    WHERE expected IS NOT NULL
+    GROUP BY {HISTOGRAM_DIMENSIONS}
+    ON CONFLICT ({HISTOGRAM_DIMENSIONS}) DO UPDATE SET job_count = job_count + excluded.job_count
+    """)
+    c.execute('DROP TABLE temp.NewSummaryRows')
+
+    c.execute(""" INSERT INTO SummaryState SELECT 'Jobs', coalesce(max(job_key), 0) FROM JobRecords WHERE true
+    ON CONFLICT (table_name) DO UPDATE SET last_rowid = excluded.last_rowid""")
+    c.execute(""" INSERT INTO SummaryState SELECT 'KeywordRef', coalesce(max(keyword_ref_key), 0) FROM KeywordRefRecords WHERE true
+    ON CONFLICT (table_name) DO UPDATE SET last_rowid = excluded.last_rowid""")
+
+def rebuild_summary_tables(database = DATABASE_PATH):
+    '''Recount the summary tables from every row in the database, ie. after existing rows were updated or deleted.'''
+    conn = sqlite3.connect(database)
+    with conn:
+        create_summary_tables(conn)
+        conn.execute('DELETE FROM JobSummaries')
+        conn.execute('DELETE FROM SalaryHistograms')
+        conn.execute('DELETE FROM SummaryState')
+        update_summary_tables(conn)
+    conn.close()
+
+
+if __name__ == '__main__':
+    rebuild_summary_tables()
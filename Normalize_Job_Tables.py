@@ -0,0 +1,267 @@
+#Weblinks are derived from the job id on read, matching get_job_url in Job_Web_Scraper.py
+WEBLINK_PREFIX = 'https://ca.indeed.com/viewjob?jk='
+#Text columns stored once in a dictionary table and referenced by an integer key, ie. company is stored in Companies and referenced by company_key
+DIMENSION_TABLES = {'company': 'Companies', 'location': 'Locations', 'location_model': 'LocationModels', 'jurisdiction': 'Jurisdictions', 'city': 'Cities', 'country': 'Countries',
+'keyword': 'Keywords'}
+JOB_DIMENSIONS = ['company', 'location', 'location_model', 'jurisdiction', 'city', 'country']
+SALARY_COLUMNS = ['salary_text', 'salary_type', 'salary_period', 'floor', 'expected', 'ceiling', 'annual_floor', 'annual_expected', 'annual_ceiling']
+#Tables replaced by views of the same name and columns. Rows written to them go through insert_normalized_rows
+LEGACY_TABLES = ['Jobs', 'KeywordRef', 'Salaries']
+
+
+def create_legacy_tables(c):
+    '''Create the Jobs, KeywordRef and Salaries tables as they were before the normalized schema, with every value stored as text on every row. Used to build databases to migrate.'''
+    c.execute(""" CREATE TABLE IF NOT EXISTS Jobs(
+        id text not null,
+        job_title text not null,
+        company text not null,
+        location text not null,
+        rating_provided text not null,
+        rating real null,
+        salary_provided text not null,
+        weblink text not null,
+        date_recorded not null,
+        location_model text,
+        jurisdiction text,
+        city text,
+        country text,
+
+        CONSTRAINT PK_Jobs_id PRIMARY KEY (id)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS Salaries(
+        id text not null,
+        salary_text text not null,
+        salary_type text null,
+        salary_period text null,
+        floor real null,
+        expected real null,
+        ceiling real null,
+        annual_floor real null,
+        annual_expected real null,
+        annual_ceiling real null,
+
+        CONSTRAINT PK_Salaries_id PRIMARY KEY (id),
+        CONSTRAINT FK_Salaries_id FOREIGN KEY (id) REFERENCES Jobs (id)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS KeywordRef(
+        id text not null,
+        keyword text not null,
+        CONSTRAINT PK_KeywordRef_id_keyword PRIMARY KEY (id, keyword)
+    )
+    """)
+
+def add_missing_columns(c, table, columns):
+    '''Add any columns missing from an existing table so a database created before the columns were introduced can still be appended to.'''
+    existing_columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+    for column, column_definition in columns:
+        if column not in existing_columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_definition}')
+
+def upgrade_legacy_tables(c):
+    '''Bring legacy tables created by earlier versions of the scripts up to the last legacy schema, so they can be migrated.'''
+    add_missing_columns(c, 'Jobs', [('location_model', 'text'), ('jurisdiction', 'text'), ('city', 'text'), ('country', 'text')])
+    add_missing_columns(c, 'Salaries', [('annual_floor', 'real null'), ('annual_expected', 'real null'), ('annual_ceiling', 'real null')])
+
+    #Backfill annualized salaries for existing rows, matching SALARY_PERIOD_ANNUAL_FACTORS in Job_Web_Scraper.py
+    c.execute(""" UPDATE Salaries SET
+        annual_floor = round(floor * factor, 2),
+        annual_expected = round(expected * factor, 2),
+        annual_ceiling = round(ceiling * factor, 2)
+    FROM (SELECT 'yearly' AS period, 1 AS factor UNION ALL SELECT 'hourly', 2080 UNION ALL SELECT 'monthly', 12 UNION ALL SELECT 'daily', 260 UNION ALL SELECT 'weekly', 52) AS factors
+    WHERE Salaries.salary_period = factors.period AND Salaries.annual_floor IS NULL AND Salaries.annual_expected IS NULL AND Salaries.annual_ceiling IS NULL
+    """)
+
+def create_normalized_tables(c):
+    '''Create the dictionary tables and the JobRecords, KeywordRefRecords and SalaryRecords tables that reference them by integer key.'''
+    for column, table in DIMENSION_TABLES.items():
+        c.execute(f""" CREATE TABLE IF NOT EXISTS {table}(
+            {column}_key integer not null,
+            {column} text not null,
+
+            CONSTRAINT PK_{table} PRIMARY KEY ({column}_key),
+            CONSTRAINT UQ_{table} UNIQUE ({column})
+        )
+        """)
+
+    c.execute(f""" CREATE TABLE IF NOT EXISTS JobRecords(
+        job_key integer not null,
+        id text not null,
+        job_title text not null,
+        company_key integer not null,
+        location_key integer not null,
+        rating_provided integer not null,
+        rating real null,
+        salary_provided integer not null,
+        date_recorded text not null,
+        location_model_key integer null,
+        jurisdiction_key integer null,
+        city_key integer null,
+        country_key integer null,
+
+        CONSTRAINT PK_JobRecords PRIMARY KEY (job_key),
+        CONSTRAINT UQ_JobRecords_id UNIQUE (id),
+        {', '.join(f'CONSTRAINT FK_JobRecords_{column}_key FOREIGN KEY ({column}_key) REFERENCES {DIMENSION_TABLES[column]} ({column}_key)' for column in JOB_DIMENSIONS)}
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS KeywordRefRecords(
+        keyword_ref_key integer not null,
+        job_key integer not null,
+        keyword_key integer not null,
+
+        CONSTRAINT PK_KeywordRefRecords PRIMARY KEY (keyword_ref_key),
+        CONSTRAINT UQ_KeywordRefRecords_job_key_keyword_key UNIQUE (job_key, keyword_key),
+        CONSTRAINT FK_KeywordRefRecords_job_key FOREIGN KEY (job_key) REFERENCES JobRecords (job_key),
+        CONSTRAINT FK_KeywordRefRecords_keyword_key FOREIGN KEY (keyword_key) REFERENCES Keywords (keyword_key)
+    )
+    """)
+
+    c.execute(""" CREATE TABLE IF NOT EXISTS SalaryRecords(
+        job_key integer not null,
+        salary_text text not null,
+        salary_type text null,
+        salary_period text null,
+        floor real null,
+        expected real null,
+        ceiling real null,
+        annual_floor real null,
+        annual_expected real null,
+        annual_ceiling real null,
+
+        CONSTRAINT PK_SalaryRecords PRIMARY KEY (job_key),
+        CONSTRAINT FK_SalaryRecords_job_key FOREIGN KEY (job_key) REFERENCES JobRecords (job_key)
+    )
+    """)
+
+def create_normalized_views(c):
+    '''
+    Create the Jobs, KeywordRef and Salaries views, showing the normalized rows with the same columns and values the tables had before they were normalized, so existing queries keep working.
+    JobDetails and KeywordRefDetails are the same views with the integer keys included, for queries that read the rows added after a given key.
+    '''
+    #Dictionary tables are left joined so a query that doesn't use a column skips its lookup
+    c.execute(f""" CREATE VIEW IF NOT EXISTS JobDetails AS
+    SELECT t1.job_key, t1.id, t1.job_title, d_company.company, d_location.location, CASE WHEN t1.rating_provided THEN 'y' ELSE 'n' END AS rating_provided, t1.rating,
+    CASE WHEN t1.salary_provided THEN 'y' ELSE 'n' END AS salary_provided, '{WEBLINK_PREFIX}' || t1.id AS weblink, t1.date_recorded,
+    d_location_model.location_model, d_jurisdiction.jurisdiction, d_city.city, d_country.country
+    FROM JobRecords t1 {' '.join(f'LEFT JOIN {DIMENSION_TABLES[column]} d_{column} ON d_{column}.{column}_key = t1.{column}_key' for column in JOB_DIMENSIONS)}
+    """)
+    c.execute(""" CREATE VIEW IF NOT EXISTS Jobs AS
+    SELECT id, job_title, company, location, rating_provided, rating, salary_provided, weblink, date_recorded, location_model, jurisdiction, city, country FROM JobDetails
+    """)
+
+    c.execute(""" CREATE VIEW IF NOT EXISTS KeywordRefDetails AS
+    SELECT t1.keyword_ref_key, t1.job_key, t2.id, t3.keyword
+    FROM KeywordRefRecords t1 INNER JOIN JobRecords t2 ON t2.job_key = t1.job_key INNER JOIN Keywords t3 ON t3.keyword_key = t1.keyword_key
+    """)
+    c.execute('CREATE VIEW IF NOT EXISTS KeywordRef AS SELECT id, keyword FROM KeywordRefDetails')
+
+    c.execute(f""" CREATE VIEW IF NOT EXISTS Salaries AS
+    SELECT t2.id, {', '.join(f't1.{column}' for column in SALARY_COLUMNS)}
+    FROM SalaryRecords t1 INNER JOIN JobRecords t2 ON t2.job_key = t1.job_key
+    """)
+
+def has_legacy_tables(c):
+    '''Check whether Jobs is still a table rather than the view over the normalized tables.'''
+    return c.execute("SELECT type FROM sqlite_master WHERE name = 'Jobs'").fetchone() == ('table',)
+
+def stage_legacy_rows(c, rows_df, table):
+    '''
+    Copy rows shaped like one of the LEGACY_TABLES (ie. a dataframe with its index reset, so the id is a column) into a temp.New<table> table and add any new dictionary values they hold.
+    Returns the name of the temp table.
+    '''
+    #weblink is derived from the id on read, so it isn't stored
+    rows_df = rows_df.drop(columns = 'weblink', errors = 'ignore')
+    columns = list(rows_df.columns)
+    c.execute(f'DROP TABLE IF EXISTS temp.New{table}')
+    c.execute(f'CREATE TEMP TABLE New{table} ({", ".join(columns)})')
+    c.executemany(f'INSERT INTO temp.New{table} VALUES ({", ".join("?" * len(columns))})', rows_df.itertuples(index = False, name = None))
+    for column in columns:
+        if column in DIMENSION_TABLES:
+            c.execute(f'INSERT OR IGNORE INTO {DIMENSION_TABLES[column]} ({column}) SELECT DISTINCT {column} FROM temp.New{table} WHERE {column} IS NOT NULL')
+    return f'temp.New{table}'
+
+def insert_normalized_rows(c, rows_df, table):
+    '''
+    Insert rows shaped like one of the LEGACY_TABLES (ie. a dataframe with its index reset, so the id is a column) into the normalized tables behind it.
+    The rows are staged in a temp table, any new dictionary values are added, then the rows are inserted with their text swapped for keys in a single statement.
+    Rows whose id (or id and keyword) already exist are skipped, as are keyword and salary rows for jobs not in JobRecords.
+    Must be called inside a transaction. Returns the number of rows inserted.
+    '''
+    staged_table = stage_legacy_rows(c, rows_df, table)
+    inserted_rows = c.execute(get_normalized_insert(table, staged_table)).rowcount
+    c.execute(f'DROP TABLE {staged_table}')
+    return inserted_rows
+
+def update_normalized_rows(c, rows_df, table):
+    '''
+    Update the rows behind the Jobs or Salaries view from rows shaped like the legacy table, matched on id, ie. once stored jobs were enriched or parsed again under changed rules.
+    For Jobs the dictionary columns and listing columns in rows_df are updated, except date_recorded which stays the date the job was first found. 
+    For Salaries every salary column is, and salary rows are added for jobs that had none.
+    Must be called inside a transaction. Returns the number of rows updated or added.
+    '''
+    staged_table = stage_legacy_rows(c, rows_df, table)
+    if table == 'Jobs':
+        columns = [column for column in JOB_DIMENSIONS if column in rows_df.columns]
+        listing_values = {column: value for column, value in [('job_title', 't.job_title'), ('rating_provided', "t.rating_provided = 'y'"), ('rating', 't.rating'), 
+        ('salary_provided', "t.salary_provided = 'y'")] if column in rows_df.columns}
+        updated_rows = c.execute(f""" UPDATE JobRecords SET {', '.join([f'{column}_key = d_{column}.{column}_key' for column in columns] + [f'{column} = {value}' for column, value in listing_values.items()])}
+        FROM {staged_table} t {' '.join(f'LEFT JOIN {DIMENSION_TABLES[column]} d_{column} ON d_{column}.{column} = t.{column}' for column in columns)}
+        WHERE JobRecords.id = t.id
+        """).rowcount
+    else:
+        updated_rows = c.execute(f""" UPDATE SalaryRecords SET {', '.join(f'{column} = t.{column}' for column in SALARY_COLUMNS)}
+        FROM {staged_table} t INNER JOIN JobRecords t1 ON t1.id = t.id
+        WHERE SalaryRecords.job_key = t1.job_key
+        """).rowcount
+        updated_rows += c.execute(get_normalized_insert(table, staged_table)).rowcount
+    c.execute(f'DROP TABLE {staged_table}')
+    return updated_rows
+
+
+def get_normalized_insert(table, source_table, keep_rowid = False):
+    '''
+    Build the statement inserting the rows of source_table, shaped like the legacy table, into the normalized table behind it with the text swapped for keys from the dictionary tables.
+    Rows are inserted in source_table's rowid order so keys follow the order the rows were found. keep_rowid uses each source row's rowid as its key instead.
+    '''
+    if table == 'Jobs':
+        return f""" INSERT OR IGNORE INTO JobRecords ({'job_key, ' if keep_rowid else ''}id, job_title, {', '.join(f'{column}_key' for column in JOB_DIMENSIONS)}, rating_provided, rating, salary_provided, date_recorded)
+        SELECT {'t.rowid, ' if keep_rowid else ''}t.id, t.job_title, {', '.join(f'd_{column}.{column}_key' for column in JOB_DIMENSIONS)}, t.rating_provided = 'y', t.rating, t.salary_provided = 'y', t.date_recorded
+        FROM {source_table} t {' '.join(f'LEFT JOIN {DIMENSION_TABLES[column]} d_{column} ON d_{column}.{column} = t.{column}' for column in JOB_DIMENSIONS)}
+        ORDER BY t.rowid
+        """
+    if table == 'KeywordRef':
+        return f""" INSERT OR IGNORE INTO KeywordRefRecords ({'keyword_ref_key, ' if keep_rowid else ''}job_key, keyword_key)
+        SELECT {'t.rowid, ' if keep_rowid else ''}t1.job_key, t2.keyword_key
+        FROM {source_table} t INNER JOIN JobRecords t1 ON t1.id = t.id INNER JOIN Keywords t2 ON t2.keyword = t.keyword
+        ORDER BY t.rowid
+        """
+    return f""" INSERT OR IGNORE INTO SalaryRecords (job_key, {', '.join(SALARY_COLUMNS)})
+    SELECT t1.job_key, {', '.join(f't.{column}' for column in SALARY_COLUMNS)}
+    FROM {source_table} t INNER JOIN JobRecords t1 ON t1.id = t.id
+    ORDER BY t.rowid
+    """
+
+def migrate_legacy_tables(c):
+    '''
+    Move the rows of the legacy Jobs, KeywordRef and Salaries tables into the normalized tables and replace the legacy tables with the views of the same name.
+    Jobs and KeywordRef rows keep their rowid as their key, so the rowids recorded by the summary tables and the analytics snapshot still mark the same rows.
+    The full text index and saved tags of the legacy tables are dropped, to be rebuilt over the normalized tables by create_search_index and update_search_index.
+    Must be called inside a transaction, and the database vacuumed afterwards to free the space of the dropped tables.
+    '''
+    upgrade_legacy_tables(c)
+    create_normalized_tables(c)
+    for column in DIMENSION_TABLES:
+        source_table = 'KeywordRef' if column == 'keyword' else 'Jobs'
+        c.execute(f'INSERT OR IGNORE INTO {DIMENSION_TABLES[column]} ({column}) SELECT DISTINCT {column} FROM {source_table} WHERE {column} IS NOT NULL ORDER BY {column}')
+    for table in LEGACY_TABLES:
+        c.execute(get_normalized_insert(table, table, keep_rowid = table != 'Salaries'))
+
+    c.execute('DROP TABLE IF EXISTS JobTags')
+    c.execute('DROP TABLE IF EXISTS JobSearch')
+    for table in LEGACY_TABLES:
+        c.execute(f'DROP TABLE {table}')
+    create_normalized_views(c)